@@ -129,6 +129,12 @@ def action2str(
                 action_str = f"type [{element_id}] [{text}] where [{element_id}] is {semantic_element}"
             case ActionTypes.HOVER:
                 action_str = f"hover [{element_id}] where [{element_id}] is {semantic_element}"
+            case ActionTypes.MOUSE_CLICK:
+                left, top = action["coords"]
+                action_str = f"mouse_click [{left}] [{top}] where [{left}] [{top}] is {semantic_element}"
+            case ActionTypes.MOUSE_HOVER:
+                left, top = action["coords"]
+                action_str = f"mouse_hover [{left}] [{top}] where [{left}] [{top}] is {semantic_element}"
             case ActionTypes.SCROLL:
                 action_str = f"scroll [{action['direction']}]"
             case ActionTypes.KEY_PRESS:
@@ -1230,9 +1236,15 @@ def execute_action(
 
 
 async def aexecute_action(
-    action: Action, page: APage, browser_ctx: ABrowserContext
+    action: Action,
+    page: APage,
+    browser_ctx: ABrowserContext,
+    obseration_processor: ObservationProcessor | None = None,
 ) -> APage:
-    """Execute the async action on the ChromeDriver."""
+    """Execute the async action on the ChromeDriver.
+
+    The element id actions need the observation processor of the env.
+    """
     action_type = action["action_type"]
     match action_type:
         case ActionTypes.NONE:
@@ -1259,7 +1271,13 @@ async def aexecute_action(
             # check each kind of locator in order
             # TODO[shuyanzh]: order is temp now
             if action["element_id"]:
-                raise NotImplementedError
+                if obseration_processor is None:
+                    raise NotImplementedError
+                element_id = action["element_id"]
+                element_center = obseration_processor.get_element_center(element_id)  # type: ignore[attr-defined]
+                await aexecute_mouse_click(
+                    element_center[0], element_center[1], page
+                )
             elif action["element_role"] and action["element_name"]:
                 element_role = int(action["element_role"])
                 element_name = action["element_name"]
@@ -1277,7 +1295,13 @@ async def aexecute_action(
                 raise ValueError("No proper locator found for click action")
         case ActionTypes.HOVER:
             if action["element_id"]:
-                raise NotImplementedError
+                if obseration_processor is None:
+                    raise NotImplementedError
+                element_id = action["element_id"]
+                element_center = obseration_processor.get_element_center(element_id)  # type: ignore[attr-defined]
+                await aexecute_mouse_hover(
+                    element_center[0], element_center[1], page
+                )
             elif action["element_role"] and action["element_name"]:
                 element_role = int(action["element_role"])
                 element_name = action["element_name"]
@@ -1296,7 +1320,14 @@ async def aexecute_action(
                 )
         case ActionTypes.TYPE:
             if action["element_id"]:
-                raise NotImplementedError
+                if obseration_processor is None:
+                    raise NotImplementedError
+                element_id = action["element_id"]
+                element_center = obseration_processor.get_element_center(element_id)  # type: ignore[attr-defined]
+                await aexecute_mouse_click(
+                    element_center[0], element_center[1], page
+                )
+                await aexecute_type(action["text"], page)
             elif action["element_role"] and action["element_name"]:
                 element_role = int(action["element_role"])
                 element_name = action["element_name"]
@@ -1321,6 +1352,7 @@ async def aexecute_action(
             await page.bring_to_front()
         case ActionTypes.NEW_TAB:
             page = await browser_ctx.new_page()
+            page.client = await page.context.new_cdp_session(page)  # type: ignore[attr-defined]
         case ActionTypes.GO_BACK:
             await page.go_back()
         case ActionTypes.GO_FORWARD:
@@ -2,15 +2,28 @@ import asyncio
 import json
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable
 
 import numpy as np
 import numpy.typing as npt
 from gymnasium import Env
 from gymnasium.spaces import Box, Text
-from playwright.async_api import Page, ViewportSize, async_playwright
+from playwright.async_api import (
+    Browser,
+    CDPSession,
+    Page,
+    ViewportSize,
+    async_playwright,
+)
 
 from .actions import Action, aexecute_action, get_action_space
-from .utils import DetachedPage, png_bytes_to_numpy
+from .processors import AsyncObservationHandler, ObservationMetadata
+from .utils import (
+    DetachedPage,
+    Observation,
+    ScreenshotConfig,
+    png_bytes_to_numpy,
+)
 
 
 class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
@@ -29,6 +42,14 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         slow_mo: int = 0,
         timeout: int = 30000,
         viewport_size: ViewportSize = {"width": 1280, "height": 720},
+        observation_type: str | None = None,
+        current_viewport_only: bool = False,
+        bounds_mode: str = "per_node",
+        observation_budget: int = 0,
+        budget_counter: Callable[[str], int] | None = None,
+        capture_screenshot: bool = True,
+        screenshot_config: ScreenshotConfig | None = None,
+        browser: Browser | None = None,
     ):
         self.observation_space = Box(
             0,
@@ -43,13 +64,51 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         self.reset_finished = False
         self.timeout = timeout
         self.viewport_size = viewport_size
+        # a browser shared with other envs, the env only owns its context
+        self.shared_browser = browser
+
+        # without an observation type, the observation is the screenshot
+        self.observation_type = observation_type
+        self.observation_handler: AsyncObservationHandler | None = None
+        if observation_type is not None:
+            text_observation_type: str
+            match observation_type:
+                case "html" | "accessibility_tree":
+                    text_observation_type = observation_type
+                    image_observation_type = ""
+                    main_observation_type = "text"
+                case "image":
+                    image_observation_type = observation_type
+                    text_observation_type = ""
+                    main_observation_type = "image"
+                case _:
+                    raise ValueError(
+                        f"Unsupported observation type: {observation_type}"
+                    )
+            self.observation_handler = AsyncObservationHandler(
+                main_observation_type,
+                text_observation_type,
+                image_observation_type,
+                current_viewport_only,
+                viewport_size,
+                bounds_mode=bounds_mode,
+                observation_budget=observation_budget,
+                budget_counter=budget_counter,
+                capture_screenshot=capture_screenshot,
+                screenshot_config=screenshot_config,
+            )
+            # the observations are dicts of the text and the image here
+            self.observation_space = self.observation_handler.get_observation_space()  # type: ignore[assignment]
 
     async def setup(self, config_file: Path | None = None) -> None:
-        self.context_manager = async_playwright()
-        self.playwright = await self.context_manager.__aenter__()
-        self.browser = await self.playwright.chromium.launch(
-            headless=self.headless, slow_mo=self.slow_mo
-        )
+        if self.shared_browser is not None:
+            self.browser = self.shared_browser
+        else:
+            self.context_manager = async_playwright()
+            self.playwright = await self.context_manager.__aenter__()
+            self.browser = await self.playwright.chromium.launch(
+                headless=self.headless, slow_mo=self.slow_mo
+            )
         if config_file:
             with open(config_file, "r") as f:
                 instance_config = json.load(f)
@@ -66,9 +125,39 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
             geolocation=geolocation,
             device_scale_factor=1,
         )
-        self.page = await self.context.new_page()
-        if start_url:
-            await self.page.goto(start_url)
+        start_urls = start_url.split(" |AND| ") if start_url else []
+        for idx in range(max(len(start_urls), 1)):
+            page = await self.context.new_page()
+            if self.observation_handler is not None:
+                client = await page.context.new_cdp_session(page)
+                if self.observation_type == "accessibility_tree":
+                    await client.send("Accessibility.enable")
+                page.client = client  # type: ignore
+            if start_urls:
+                await page.goto(start_urls[idx])
+        # set the first page as the current page
+        self.page = self.context.pages[0]
+        if start_urls:
+            await self.page.bring_to_front()
+
+    async def ateardown(self) -> None:
+        if self.shared_browser is not None:
+            await self.context.close()
+        else:
+            await self.context_manager.__aexit__()
+
+    def get_page_client(self, page: Page) -> CDPSession:
+        return page.client  # type: ignore
+
+    async def _aget_obs(self) -> dict[str, Observation]:
+        assert self.observation_handler is not None
+        return await self.observation_handler.aget_observation(
+            self.page, self.get_page_client(self.page)
+        )
+
+    def _get_obs_metadata(self) -> dict[str, ObservationMetadata]:
+        assert self.observation_handler is not None
+        return self.observation_handler.get_observation_metadata()
 
     async def areset(
         self,
@@ -83,7 +172,7 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         """
         super().reset(seed=seed, options=options)
         if self.reset_finished:
-            await self.context_manager.__aexit__()
+            await self.ateardown()
         if options is not None and "config_file" in options:
             config_file = Path(options["config_file"])
             if config_file.exists():
@@ -93,6 +182,16 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         else:
             await self.setup()
         self.reset_finished = True
+        if self.observation_handler is not None:
+            observation = await self._aget_obs()
+            return (
+                observation,  # type: ignore[return-value]
+                {
+                    "page": DetachedPage(self.page.url, ""),
+                    "fail_error": "",
+                    "observation_metadata": self._get_obs_metadata(),
+                },
+            )
         content = await self.page.content()
         screenshot = png_bytes_to_numpy(await self.page.screenshot())
         return (
@@ -110,7 +209,8 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
 
     async def aclose(self) -> None:
         if self.reset_finished:
-            await self.context_manager.__aexit__()
+            await self.ateardown()
+            self.reset_finished = False
 
     def close(self) -> None:
         asyncio.run(self.aclose())
@@ -123,11 +223,34 @@ class AsyncScriptBrowserEnv(Env[npt.NDArray[np.uint8], Action]):
         success = False
         fail_error = ""
         try:
-            self.page = await aexecute_action(action, self.page, self.context)
+            self.page = await aexecute_action(
+                action,
+                self.page,
+                self.context,
+                self.observation_handler.action_processor
+                if self.observation_handler is not None
+                else None,
+            )
             success = True
         except Exception as e:
             fail_error = str(e)
 
+        if self.observation_handler is not None:
+            observation = await self._aget_obs()
+            return (
+                observation,  # type: ignore[return-value]
+                float(success),
+                False,
+                False,
+                {
+                    "page": DetachedPage(
+                        self.page.url, await self.page.content()
+                    ),
+                    "fail_error": fail_error,
+                    "observation_metadata": self._get_obs_metadata(),
+                },
+            )
+
         try:
             content = await self.page.content()
             screenshot = png_bytes_to_numpy(await self.page.screenshot())
@@ -1,10 +1,11 @@
 import json
 import re
 import time
+import weakref
 from collections import defaultdict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Union
+from typing import Any, Callable, Union
 
 import numpy as np
 import numpy.typing as npt
@@ -13,7 +14,9 @@ from beartype.door import is_bearable
 from gymnasium import Env
 from gymnasium.spaces import Box, Text
 from playwright.sync_api import (
+    BrowserContext,
     CDPSession,
+    Geolocation,
     Page,
     Playwright,
     ViewportSize,
@@ -21,15 +24,47 @@ from playwright.sync_api import (
     sync_playwright,
 )
 
-from .actions import Action, execute_action, get_action_space
-from .processors import ObservationHandler, ObservationMetadata
+from .actions import (
+    Action,
+    ActionTypes,
+    execute_action,
+    get_action_space,
+)
+from .processors import (
+    WATCH_MUTATIONS,
+    ObservationHandler,
+    ObservationMetadata,
+)
 from .utils import (
     AccessibilityTree,
     DetachedPage,
     Observation,
+    ScreenshotConfig,
     png_bytes_to_numpy,
 )
 
+# start loading the url after `evaluate` returns, without waiting for it
+START_LOADING = "url => { setTimeout(() => { window.location.href = url }) }"
+
+# the load state and the number of changes of the document
+SETTLE_PROBE = (
+    """() => {
+    const mutations = ("""
+    + WATCH_MUTATIONS
+    + """)();
+    return {
+        readyState: document.readyState,
+        documentId: mutations.documentId,
+        changeCount: mutations.changeCount,
+    };
+}"""
+)
+# the page is settled once the document and the network are quiet this long
+SETTLE_QUIET_PERIOD = 0.3
+# long polling and analytics requests may never finish, as networkidle2
+SETTLE_MAX_IN_FLIGHT = 2
+SETTLE_POLL_INTERVAL = 50  # ms
+
 
 @dataclass
 class PlaywrightScript:
@@ -40,6 +75,59 @@ class PlaywrightScript:
     value: str | None = None  # avatar movie, Enter
 
 
+@dataclass
+class PooledContext:
+    """A context prepared for a task with the same storage state, viewport
+    and geolocation"""
+
+    key: tuple[str | None, float | None, str, str]
+    context: BrowserContext
+    start_urls: list[str]  # loading in the pages of the context
+
+
+class NetworkActivity:
+    """The in flight requests of a page, from the Network events of its
+    CDP session.
+
+    The requests of a document that is navigated away from may never
+    finish, they are dropped when the frame navigates or the page closes.
+    """
+
+    def __init__(self, page: Page, client: CDPSession) -> None:
+        # request id -> (frame id, loader id) of the request
+        self.in_flight: dict[str, tuple[str, str]] = {}
+        self.last_activity = time.perf_counter()
+        client.on("Network.requestWillBeSent", self.on_request_started)
+        client.on("Network.loadingFinished", self.on_request_done)
+        client.on("Network.loadingFailed", self.on_request_done)
+        client.on("Page.frameNavigated", self.on_frame_navigated)
+        page.on("close", lambda page: self.in_flight.clear())
+        client.send("Network.enable")
+        client.send("Page.enable")
+
+    def on_request_started(self, event: dict[str, Any]) -> None:
+        self.in_flight[event["requestId"]] = (
+            event.get("frameId", ""),
+            event["loaderId"],
+        )
+        self.last_activity = time.perf_counter()
+
+    def on_request_done(self, event: dict[str, Any]) -> None:
+        self.in_flight.pop(event["requestId"], None)
+        self.last_activity = time.perf_counter()
+
+    def on_frame_navigated(self, event: dict[str, Any]) -> None:
+        frame = event["frame"]
+        # the main frame takes the child frames of its old document along
+        is_main_frame = "parentId" not in frame
+        self.in_flight = {
+            request_id: (frame_id, loader_id)
+            for request_id, (frame_id, loader_id) in self.in_flight.items()
+            if loader_id == frame["loaderId"]
+            or (not is_main_frame and frame_id != frame["id"])
+        }
+
+
 def parse_action(action: str) -> PlaywrightScript:
     splitted = action.strip().split(" ")
     assert len(splitted) >= 2
@@ -84,6 +172,22 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         viewport_size: ViewportSize = {"width": 1280, "height": 720},
         save_trace_enabled: bool = False,
         sleep_after_execution: float = 0.0,
+        bounds_mode: str = "per_node",
+        observation_budget: int = 0,
+        budget_counter: Callable[[str], int] | None = None,
+        capture_screenshot: bool = True,
+        screenshot_config: ScreenshotConfig | None = None,
+        incremental_observation: bool = False,
+        verify_incremental_observation: bool = False,
+        observation_cache: bool = False,
+        viewport_accessibility_fetch: bool = False,
+        scroll_observation_cache: bool = False,
+        profile_observation: bool = False,
+        stable_element_ids: bool = False,
+        persistent_browser: bool = False,
+        context_pool_size: int = 0,
+        settle_timeout: float = 0.0,
+        lazy_page_content: bool = False,
     ):
         # TODO: make Space[Action] = ActionSpace
         self.action_space = get_action_space()  # type: ignore[assignment]
@@ -94,6 +198,24 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         self.viewport_size = viewport_size
         self.save_trace_enabled = save_trace_enabled
         self.sleep_after_execution = sleep_after_execution
+        # keep the driver and the browser across resets, one context per task
+        self.persistent_browser = persistent_browser
+        self.browser_launched = False
+        # contexts prepared for the next tasks, 0 to disable
+        if context_pool_size and not persistent_browser:
+            raise ValueError("The context pool needs a persistent browser")
+        self.context_pool_size = context_pool_size
+        self.context_pool: list[PooledContext] = []
+        # wait at most this long for the page to settle instead of the
+        # fixed sleep after execution, 0 to disable
+        self.settle_timeout = settle_timeout
+        self.network_activities: weakref.WeakKeyDictionary[
+            Page, NetworkActivity
+        ] = weakref.WeakKeyDictionary()
+        # only serialize the html of the page when info["page"].content is
+        # read, before the next step
+        self.lazy_page_content = lazy_page_content
+        self.detached_page: DetachedPage | None = None
 
         match observation_type:
             case "html" | "accessibility_tree":
@@ -115,62 +237,244 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             self.image_observation_type,
             self.current_viewport_only,
             self.viewport_size,
+            bounds_mode=bounds_mode,
+            observation_budget=observation_budget,
+            budget_counter=budget_counter,
+            capture_screenshot=capture_screenshot,
+            screenshot_config=screenshot_config,
+            incremental_observation=incremental_observation,
+            verify_incremental_observation=verify_incremental_observation,
+            observation_cache=observation_cache,
+            viewport_accessibility_fetch=viewport_accessibility_fetch,
+            scroll_observation_cache=scroll_observation_cache,
+            profile_observation=profile_observation,
+            stable_element_ids=stable_element_ids,
         )
 
         self.observation_space = (
             self.observation_handler.get_observation_space()
         )
 
-    @beartype
-    def setup(self, config_file: Path | None = None) -> None:
+    def launch_browser(self) -> None:
         self.context_manager = sync_playwright()
         self.playwright = self.context_manager.__enter__()
         self.browser = self.playwright.chromium.launch(
             headless=self.headless, slow_mo=self.slow_mo
         )
+        self.browser_launched = True
 
+    def close_browser(self) -> None:
+        if self.browser_launched:
+            # the pooled contexts are closed with the browser
+            self.context_pool = []
+            self.context_manager.__exit__()
+            self.browser_launched = False
+
+    @staticmethod
+    def load_instance_config(config_file: Path | None) -> dict[str, Any]:
+        instance_config: dict[str, Any]
         if config_file:
             with open(config_file, "r") as f:
                 instance_config = json.load(f)
         else:
             instance_config = {}
+        return instance_config
 
-        storage_state = instance_config.get("storage_state", None)
-        start_url = instance_config.get("start_url", None)
-        geolocation = instance_config.get("geolocation", None)
+    def get_context_pool_key(
+        self, storage_state: str | None, geolocation: Geolocation | None
+    ) -> tuple[str | None, float | None, str, str]:
+        """What a context is created with, the storage state files are
+        refreshed by the auto login"""
+        mtime = None
+        if storage_state is not None:
+            mtime = Path(storage_state).stat().st_mtime
+        return (
+            storage_state,
+            mtime,
+            json.dumps(self.viewport_size, sort_keys=True),
+            json.dumps(geolocation, sort_keys=True),
+        )
 
-        self.context = self.browser.new_context(
+    def new_context(
+        self,
+        storage_state: str | None,
+        geolocation: Geolocation | None,
+    ) -> BrowserContext:
+        context = self.browser.new_context(
             viewport=self.viewport_size,
             storage_state=storage_state,
             geolocation=geolocation,
             device_scale_factor=1,
         )
+        if self.settle_timeout > 0:
+            # follow the requests of the pages opened by the actions too,
+            # e.g., popups, from their first request on
+            context.on("page", self.track_network_activity)
+        return context
+
+    def new_page(self, context: BrowserContext) -> Page:
+        page = context.new_page()
+        client = page.context.new_cdp_session(page)  # talk to chrome devtools
+        if self.text_observation_type == "accessibility_tree":
+            client.send("Accessibility.enable")
+        page.client = client  # type: ignore # TODO[shuyanzh], fix this hackey client
+        if self.settle_timeout > 0:
+            self.track_network_activity(page)
+        return page
+
+    @beartype
+    def setup(self, config_file: Path | None = None) -> None:
+        if not self.browser_launched:
+            self.launch_browser()
+        elif not self.browser.is_connected():
+            # the persistent browser crashed, start a new one
+            self.close_browser()
+            self.launch_browser()
+
+        instance_config = self.load_instance_config(config_file)
+        storage_state = instance_config.get("storage_state", None)
+        start_url = instance_config.get("start_url", None)
+        geolocation = instance_config.get("geolocation", None)
+        start_urls = start_url.split(" |AND| ") if start_url else []
+
+        pooled = self.take_pooled_context(
+            self.get_context_pool_key(storage_state, geolocation)
+        )
+        if pooled is not None:
+            self.context = pooled.context
+            # the prepared pages are reused for the start urls
+            pages = self.context.pages
+            for page in pages[len(start_urls) :]:
+                page.close()
+            pages = pages[: len(start_urls)]
+            preloaded_urls = dict(zip(pages, pooled.start_urls))
+        else:
+            self.context = self.new_context(storage_state, geolocation)
+            pages = []
+            preloaded_urls = {}
         if self.save_trace_enabled:
             self.context.tracing.start(screenshots=True, snapshots=True)
-        if start_url:
-            start_urls = start_url.split(" |AND| ")
-            for url in start_urls:
-                page = self.context.new_page()
-                client = page.context.new_cdp_session(
-                    page
-                )  # talk to chrome devtools
-                if self.text_observation_type == "accessibility_tree":
-                    client.send("Accessibility.enable")
-                page.client = client  # type: ignore # TODO[shuyanzh], fix this hackey client
-                page.goto(url)
-            # set the first page as the current page
-            self.page = self.context.pages[0]
+
+        while len(pages) < max(len(start_urls), 1):
+            pages.append(self.new_page(self.context))
+        # navigate again, the preloaded pages may be stale
+        for page, url in zip(pages, start_urls):
+            if preloaded_urls.get(page) == url:
+                self.wait_for_preloaded_page(page)
+            page.goto(url)
+        # set the first page as the current page
+        self.page = pages[0]
+        if start_urls:
             self.page.bring_to_front()
-        else:
-            self.page = self.context.new_page()
-            client = self.page.context.new_cdp_session(self.page)
-            if self.text_observation_type == "accessibility_tree":
-                client.send("Accessibility.enable")
-            self.page.client = client  # type: ignore
+
+    @staticmethod
+    def wait_for_preloaded_page(page: Page) -> None:
+        """Wait for the page prepared by `prewarm` to load its start url,
+        the navigation again is then served from the warm HTTP cache"""
+        try:
+            # the navigation of the page may not be committed yet
+            page.wait_for_url(
+                lambda page_url: page_url != "about:blank",
+                wait_until="load",
+            )
+        except Exception:
+            # e.g., the start url is down, the navigation reports it
+            pass
+
+    def take_pooled_context(
+        self, key: tuple[str | None, float | None, str, str]
+    ) -> PooledContext | None:
+        for idx, pooled in enumerate(self.context_pool):
+            if pooled.key == key:
+                return self.context_pool.pop(idx)
+        return None
+
+    def prewarm(self, config_file: Path | None = None) -> None:
+        """Prepare a context for a task with the same login combination:
+        storage state loaded, CDP sessions ready and the start urls
+        loading in the browser while the current task runs"""
+        if not self.context_pool_size:
+            raise RuntimeError("The context pool is disabled")
+        if not self.browser_launched:
+            self.launch_browser()
+
+        instance_config = self.load_instance_config(config_file)
+        storage_state = instance_config.get("storage_state", None)
+        start_url = instance_config.get("start_url", None)
+        geolocation = instance_config.get("geolocation", None)
+
+        context = self.new_context(storage_state, geolocation)
+        start_urls = start_url.split(" |AND| ") if start_url else []
+        for url in start_urls:
+            page = self.new_page(context)
+            page.evaluate(START_LOADING, url)
+        self.context_pool.append(
+            PooledContext(
+                self.get_context_pool_key(storage_state, geolocation),
+                context,
+                start_urls,
+            )
+        )
+        # drop the oldest prepared contexts
+        while len(self.context_pool) > self.context_pool_size:
+            self.context_pool.pop(0).context.close()
 
     def get_page_client(self, page: Page) -> CDPSession:
         return page.client  # type: ignore
 
+    def get_network_activity(self, page: Page) -> NetworkActivity:
+        if page not in self.network_activities:
+            # a session of its own, the pages opened by the site have no
+            # client yet when they are created
+            self.network_activities[page] = NetworkActivity(
+                page, page.context.new_cdp_session(page)
+            )
+        return self.network_activities[page]
+
+    def track_network_activity(self, page: Page) -> None:
+        self.get_network_activity(page)
+
+    def wait_for_settle(self) -> float:
+        """Wait until the page is loaded, the document stopped changing and
+        the network is idle, return the time it took"""
+        start = time.perf_counter()
+        network = self.get_network_activity(self.page)
+        last_state = None
+        last_change = start
+        while True:
+            try:
+                probe = self.page.evaluate(SETTLE_PROBE)
+                state = (probe["documentId"], probe["changeCount"])
+                loaded = probe["readyState"] == "complete"
+            except Exception:
+                # the execution context is destroyed by a navigation
+                state = None
+                loaded = False
+
+            now = time.perf_counter()
+            if state is None or state != last_state:
+                last_change = now
+            last_state = state
+            if (
+                loaded
+                and len(network.in_flight) <= SETTLE_MAX_IN_FLIGHT
+                and now - max(last_change, network.last_activity)
+                >= SETTLE_QUIET_PERIOD
+            ):
+                break
+            if now - start >= self.settle_timeout:
+                break
+            self.page.wait_for_timeout(SETTLE_POLL_INTERVAL)
+        return time.perf_counter() - start
+
+    def wait_after_execution(self) -> float:
+        if self.settle_timeout > 0:
+            return self.wait_for_settle()
+        # hard sleep TODO[shuyanzh] suboptimal, may need to check network
+        if self.sleep_after_execution > 0:
+            time.sleep(self.sleep_after_execution)
+        return self.sleep_after_execution
+
     def _get_obs(self) -> dict[str, Observation]:
         obs = self.observation_handler.get_observation(
             self.page, self.get_page_client(self.page)
@@ -194,8 +498,15 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             - "storage_state": the storage state of the browser. It is a file path to a json file.
         """
         super().reset(seed=seed, options=options)
+        self.expire_detached_page()
+        reset_start = time.perf_counter()
         if self.reset_finished:
-            self.context_manager.__exit__()
+            if self.persistent_browser:
+                # a new context does not share the cookies, the storage or
+                # the geolocation of the previous task
+                self.context.close()
+            else:
+                self.close_browser()
 
         if options is not None and "config_file" in options:
             config_file = Path(options["config_file"])
@@ -206,9 +517,9 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
         else:
             self.setup()
         self.reset_finished = True
+        reset_latency = time.perf_counter() - reset_start
 
-        if self.sleep_after_execution > 0:
-            time.sleep(self.sleep_after_execution)
+        settle_time = self.wait_after_execution()
 
         observation = self._get_obs()
         observation_metadata = self._get_obs_metadata()
@@ -216,6 +527,9 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             "page": DetachedPage(self.page.url, ""),
             "fail_error": "",
             "observation_metadata": observation_metadata,
+            # seconds to tear down the previous task and set up this one
+            "reset_latency": reset_latency,
+            "settle_time": settle_time,
         }
 
         return (observation, info)
@@ -225,14 +539,26 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             self.context.tracing.stop(path=trace_path)
 
     def close(self) -> None:
-        if self.reset_finished:
-            self.context_manager.__exit__()
+        self.expire_detached_page()
+        self.close_browser()
+
+    def expire_detached_page(self) -> None:
+        if self.detached_page is not None:
+            self.detached_page.expire()
+            self.detached_page = None
+
+    def get_detached_page(self) -> DetachedPage:
+        if self.lazy_page_content:
+            self.detached_page = DetachedPage(self.page.url, self.page.content)
+            return self.detached_page
+        return DetachedPage(self.page.url, self.page.content())
 
     def step(
         self, action: Action
     ) -> tuple[dict[str, Observation], float, bool, bool, dict[str, Any]]:
         if not self.reset_finished:
             raise RuntimeError("Call reset first before calling step.")
+        self.expire_detached_page()
 
         success = False
         fail_error = ""
@@ -246,18 +572,22 @@ class ScriptBrowserEnv(Env[dict[str, Observation], Action]):
             success = True
         except Exception as e:
             fail_error = str(e)
+        # the text processor can slice its cached tree after a scroll
+        self.observation_handler.text_processor.scrolled = (
+            action["action_type"] == ActionTypes.SCROLL
+        )
 
-        # hard sleep TODO[shuyanzh] suboptimal, may need to check network
-        if self.sleep_after_execution > 0:
-            time.sleep(self.sleep_after_execution)
+        settle_time = self.wait_after_execution()
 
         observation = self._get_obs()
         observation_metadata = self._get_obs_metadata()
 
         info = {
-            "page": DetachedPage(self.page.url, self.page.content()),
+            "page": self.get_detached_page(),
             "fail_error": fail_error,
             "observation_metadata": observation_metadata,
+            # seconds waited for the page after the action
+            "settle_time": settle_time,
         }
         msg = (
             observation,
@@ -89,6 +89,28 @@ def get_action_description(
                     )
                 else:
                     action_str = f"Attempt to perfom \"{action_name}\" on element \"[{action['element_id']}]\" but no matching element found. Please check the observation more carefully."
+            elif action["action_type"] in [
+                ActionTypes.MOUSE_CLICK,
+                ActionTypes.MOUSE_HOVER,
+            ]:
+                action_name = str(action["action_type"]).split(".")[1].lower()
+                left, top = action["coords"]
+                spatial_index = text_meta_data["spatial_index"]
+                element_id = (
+                    spatial_index.get_element_at(left, top)
+                    if spatial_index is not None
+                    else None
+                )
+                if element_id is not None:
+                    node_content = text_meta_data["obs_nodes_info"][
+                        element_id
+                    ]["text"]
+                    node_content = " ".join(node_content.split()[1:])
+                    action_str = action2str(
+                        action, action_set_tag, node_content
+                    )
+                else:
+                    action_str = f'Attempt to perfom "{action_name}" at [{left}] [{top}] but no element found there. Please check the observation more carefully.'
             else:
                 if (
                     action["action_type"] == ActionTypes.NONE
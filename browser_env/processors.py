@@ -1,12 +1,34 @@
+import asyncio
+import base64
 import json
+import math
 import re
+import time
+import weakref
 from collections import defaultdict
-from typing import Any, TypedDict, Union
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    ContextManager,
+    Iterable,
+    Iterator,
+    Sequence,
+    TypedDict,
+    TypeVar,
+    Union,
+    cast,
+)
 
 import numpy as np
 import numpy.typing as npt
 from gymnasium import spaces
-from playwright.sync_api import CDPSession, Page, ViewportSize
+from playwright.async_api import CDPSession as ACDPSession
+from playwright.async_api import Frame as AFrame
+from playwright.async_api import Page as APage
+from playwright.sync_api import CDPSession, Frame, Page, ViewportSize
 
 from browser_env.constants import (
     ASCII_CHARSET,
@@ -23,24 +45,454 @@ from .utils import (
     DOMNode,
     DOMTree,
     Observation,
+    ScreenshotConfig,
     png_bytes_to_numpy,
 )
 
 IN_VIEWPORT_RATIO_THRESHOLD = 0.6
+BOUNDS_MODES = ("per_node", "batched")
+SCREENSHOT_MODES = ("playwright", "cdp")
+SCREENSHOT_FORMATS = ("png", "jpeg", "webp")
+# a StaticText line of the accessibility tree, names can have new lines
+STATIC_TEXT_PATTERN = re.compile(r"\[\d+\] StaticText (.+)", re.DOTALL)
+
+DOM_SNAPSHOT_PARAMS = {
+    "computedStyles": [],
+    "includeDOMRects": True,
+    "includePaintOrder": True,
+}
+BOUNDING_CLIENT_RECT_FUNCTION = """
+    function() {
+        if (this.nodeType == 3) {
+            var range = document.createRange();
+            range.selectNode(this);
+            var rect = range.getBoundingClientRect().toJSON();
+            range.detach();
+            return rect;
+        } else {
+            return this.getBoundingClientRect().toJSON();
+        }
+    }
+"""
+
+# counts the changes of the document in the page, `count` skips the class
+# and style changes (e.g., hover) that Accessibility.nodesUpdated reports,
+# `changeCount` has every mutation and user interaction, `layoutCount` has
+# every change that can move the elements but the scroll of the window.
+# `count` is also reported to the MUTATION_BINDING when it is installed,
+# in order with the Accessibility.nodesUpdated events
+WATCH_MUTATIONS = """() => {
+    if (window.__browserEnvMutations === undefined) {
+        const state = {
+            documentId: Math.random().toString(36).slice(2),
+            count: 0,
+            changeCount: 0,
+            layoutCount: 0,
+        };
+        new MutationObserver((records) => {
+            state.changeCount += 1;
+            state.layoutCount += 1;
+            if (records.some((record) => record.type !== "attributes"
+                || !["class", "style"].includes(record.attributeName))) {
+                state.count += 1;
+                if (typeof window.__browserEnvMutation === "function") {
+                    window.__browserEnvMutation(JSON.stringify({
+                        documentId: state.documentId,
+                        count: state.count,
+                    }));
+                }
+            }
+        }).observe(document, {
+            subtree: true,
+            childList: true,
+            characterData: true,
+            attributes: true,
+        });
+        // values, focus and css hover change without any mutation
+        for (const type of ["input", "change", "focusin", "mousemove"]) {
+            document.addEventListener(type, () => {
+                state.changeCount += 1;
+                if (type !== "mousemove") {
+                    state.layoutCount += 1;
+                }
+            }, true);
+        }
+        // loaded images and scrolled elements move the elements too
+        for (const type of ["load", "scroll"]) {
+            document.addEventListener(type, (event) => {
+                if (event.target !== document) {
+                    state.changeCount += 1;
+                    state.layoutCount += 1;
+                }
+            }, true);
+        }
+        window.addEventListener("resize", () => {
+            state.changeCount += 1;
+            state.layoutCount += 1;
+        });
+        window.__browserEnvMutations = state;
+    }
+    return window.__browserEnvMutations;
+}"""
+
+MUTATION_BINDING = "__browserEnvMutation"
+
+# all the scalar page metrics in one round trip
+BROWSER_INFO_PROBE = (
+    """(watchMutations) => {
+    const mutations = watchMutations ? ("""
+    + WATCH_MUTATIONS
+    + """)() : null;
+    return {
+        pageXOffset: window.pageXOffset,
+        pageYOffset: window.pageYOffset,
+        screenWidth: window.screen.width,
+        screenHeight: window.screen.height,
+        devicePixelRatio: window.devicePixelRatio,
+        title: document.title,
+        documentId: mutations && mutations.documentId,
+        mutationCount: mutations && mutations.count,
+        layoutCount: mutations && mutations.layoutCount,
+    };
+}"""
+)
+
+# what the text observation depends on in the page
+OBSERVATION_FINGERPRINT_PROBE = (
+    """() => {
+    const mutations = ("""
+    + WATCH_MUTATIONS
+    + """)();
+    return {
+        documentId: mutations.documentId,
+        changeCount: mutations.changeCount,
+        pageXOffset: window.pageXOffset,
+        pageYOffset: window.pageYOffset,
+    };
+}"""
+)
+
+# max number of getChildAXNodes calls to patch a step, a full fetch is
+# cheaper beyond that
+MAX_INCREMENTAL_FETCHES = 50
+
+# the elements whose accessibility subtrees cover the viewport: `roots`
+# are fetched with their subtree, `path` are their ancestors, fetched
+# alone. The sweep adds the overlays positioned out of their ancestors.
+VIEWPORT_ELEMENTS_PROBE = """(sweepStep) => {
+    const width = window.innerWidth;
+    const height = window.innerHeight;
+    const path = [document];
+    const roots = [];
+    const pathSet = new Set(path);
+    const rootSet = new Set();
+    const hasText = (element) => Array.from(element.childNodes).some(
+        (node) => node.nodeType === Node.TEXT_NODE && node.textContent.trim()
+    );
+    const visit = (element) => {
+        const rect = element.getBoundingClientRect();
+        const empty = rect.width === 0 && rect.height === 0;
+        const intersects = rect.right > 0 && rect.bottom > 0
+            && rect.left < width && rect.top < height;
+        if (!empty && !intersects) {
+            return;
+        }
+        const inside = !empty && rect.left >= 0 && rect.top >= 0
+            && rect.right <= width && rect.bottom <= height;
+        if (inside || element.children.length === 0 || element.shadowRoot
+            || hasText(element)) {
+            roots.push(element);
+            rootSet.add(element);
+            return;
+        }
+        path.push(element);
+        pathSet.add(element);
+        for (const child of element.children) {
+            visit(child);
+        }
+    };
+    visit(document.documentElement);
+
+    const covered = (element) => {
+        for (let node = element; node; node = node.parentElement) {
+            if (rootSet.has(node)) {
+                return true;
+            }
+        }
+        return false;
+    };
+    for (let x = sweepStep / 2; x < width; x += sweepStep) {
+        for (let y = sweepStep / 2; y < height; y += sweepStep) {
+            for (const element of document.elementsFromPoint(x, y)) {
+                if (pathSet.has(element) || covered(element)) {
+                    continue;
+                }
+                roots.push(element);
+                rootSet.add(element);
+                let node = element.parentElement;
+                for (; node && !pathSet.has(node); node = node.parentElement) {
+                    path.push(node);
+                    pathSet.add(node);
+                }
+            }
+        }
+    }
+    return [path, roots];
+}"""
+# distance between the points of the elementsFromPoint sweep, in pixels
+VIEWPORT_SWEEP_STEP = 64
+# max number of subtrees of a viewport fetch, a full fetch is cheaper
+# beyond that
+MAX_VIEWPORT_FETCH_ROOTS = 200
+
+# side of the cells of the spatial index, in pixels
+SPATIAL_INDEX_CELL_SIZE = 64
+
+TreeT = TypeVar("TreeT", AccessibilityTree, DOMTree)
+
+
+@dataclass
+class AccessibilityTreeCache:
+    """The accessibility nodes of the previous step, patched with the
+    Accessibility.nodesUpdated events of the page"""
+
+    client: CDPSession
+    document_id: str | None
+    mutation_count: int | None
+    root_id: str
+    nodes: dict[str, AccessibilityTreeNode]
+    updates: list[AccessibilityTreeNode] = field(default_factory=list)
+    # the mutation count of the page when the last update was sent
+    updates_mutation_count: int | None = None
+    reload: bool = False
+
+
+@dataclass
+class ScrollTreeCache:
+    """The full page accessibility tree of a previous step, the bounds are
+    in document coordinates so that a scroll only moves the viewport.
+
+    The anchored nodes (fixed and sticky elements) move with the viewport,
+    their bounds are fetched again.
+    """
+
+    client: CDPSession
+    document_id: str | None
+    layout_count: int | None
+    nodes: AccessibilityTree
+    document_bounds: list[list[float] | None]
+    anchored: list[bool]
+
+
+@dataclass
+class StableIdTable:
+    """The stable ids of the accessibility nodes of a page.
+
+    The nodes are keyed by (backend DOM node id, role, occurrence), several
+    accessibility nodes can share a DOM node. The nodes without a DOM node
+    are keyed by their accessibility id. The ids are never reused.
+    """
+
+    ids: dict[tuple[int | str, ...], str] = field(default_factory=dict)
+    next_id: int = 1
+
+
+@dataclass
+class SpatialIndex:
+    """A uniform grid over the union bounds of the observed elements.
+
+    Only the part of the bounds inside the viewport is indexed, each cell
+    lists the ids of the elements overlapping it. The grid is built on the
+    first lookup, most steps never look up an element by its position.
+    """
+
+    width: float
+    height: float
+    cell_size: int
+    obs_nodes_info: dict[str, Any]
+    cells: dict[tuple[int, int], list[str]] = field(default_factory=dict)
+    bounds: dict[str, tuple[float, float, float, float]] = field(
+        default_factory=dict
+    )
+    order: dict[str, int] = field(default_factory=dict)
+    built: bool = False
+
+    def build(self) -> None:
+        """Index the union bounds of the observed elements in the grid"""
+        if self.built:
+            return
+        self.built = True
+        width, height, cell_size = self.width, self.height, self.cell_size
+        max_col = math.ceil(width / cell_size) - 1
+        max_row = math.ceil(height / cell_size) - 1
+        for order, (element_id, node_info) in enumerate(
+            self.obs_nodes_info.items()
+        ):
+            bound = node_info["union_bound"]
+            if bound is None:
+                continue
+            x, y, w, h = (float(value) for value in bound)
+            if not (w > 0 and h > 0) or math.isnan(w) or math.isnan(h):
+                continue
+            # the elements out of the viewport can not be hit
+            if x + w <= 0 or y + h <= 0 or x >= width or y >= height:
+                continue
+            self.bounds[element_id] = (x, y, x + w, y + h)
+            self.order[element_id] = order
+            first_col = max(0, int(x // cell_size))
+            last_col = min(max_col, int((x + w) // cell_size))
+            first_row = max(0, int(y // cell_size))
+            last_row = min(max_row, int((y + h) // cell_size))
+            for col in range(first_col, last_col + 1):
+                for row in range(first_row, last_row + 1):
+                    self.cells.setdefault((col, row), []).append(element_id)
+
+    def hit_test(self, x: float, y: float) -> list[str]:
+        """The ids of the elements containing the point (x, y), in pixels,
+        the innermost (smallest) element first"""
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return []
+        self.build()
+        cell = (int(x // self.cell_size), int(y // self.cell_size))
+        hits = []
+        for element_id in self.cells.get(cell, []):
+            left, top, right, bottom = self.bounds[element_id]
+            if left <= x < right and top <= y < bottom:
+                hits.append(element_id)
+        # later elements are deeper in the tree on ties
+        hits.sort(
+            key=lambda element_id: (
+                (self.bounds[element_id][2] - self.bounds[element_id][0])
+                * (self.bounds[element_id][3] - self.bounds[element_id][1]),
+                -self.order[element_id],
+            )
+        )
+        return hits
+
+    def get_element_at(self, left: float, top: float) -> str | None:
+        """The innermost element at (left, top), as fractions of the
+        viewport like the coordinates of the mouse actions"""
+        hits = self.hit_test(left * self.width, top * self.height)
+        return hits[0] if hits else None
+
+
+class StageProfile(TypedDict):
+    time: float
+    messages: int
+    bytes: int
+
+
+class ObservationProfiler:
+    """Wall time, CDP messages and payload bytes of the observation stages"""
+
+    def __init__(self) -> None:
+        self.stages: dict[str, StageProfile] = {}
+        self.active_stages: list[str] = []
+        # time spent measuring the payloads, excluded from the stages
+        self.overhead = 0.0
+
+    def get_stage(self, name: str) -> StageProfile:
+        if name not in self.stages:
+            self.stages[name] = {"time": 0.0, "messages": 0, "bytes": 0}
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        self.active_stages.append(name)
+        overhead = self.overhead
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.get_stage(name)["time"] += elapsed - (
+                self.overhead - overhead
+            )
+            self.active_stages.pop()
+
+    def record_message(self, *payloads: Any) -> None:
+        """Count a message in the innermost active stage"""
+        start = time.perf_counter()
+        stage = self.get_stage(
+            self.active_stages[-1] if self.active_stages else "other"
+        )
+        stage["messages"] += 1
+        stage["bytes"] += sum(
+            len(json.dumps(payload, separators=(",", ":")))
+            for payload in payloads
+            if payload is not None
+        )
+        self.overhead += time.perf_counter() - start
+
+    def pop_stages(self) -> dict[str, StageProfile]:
+        stages, self.stages = self.stages, {}
+        return stages
+
+
+def merge_stage_profiles(
+    total: dict[str, StageProfile], profile: dict[str, StageProfile]
+) -> None:
+    """Add the stages of one observation to the running total"""
+    for name, stage in profile.items():
+        if name not in total:
+            total[name] = {"time": 0.0, "messages": 0, "bytes": 0}
+        total[name]["time"] += stage["time"]
+        total[name]["messages"] += stage["messages"]
+        total[name]["bytes"] += stage["bytes"]
+
+
+class ProfiledCDPSession:
+    """Forward to a CDP session and record its messages in a profiler"""
+
+    def __init__(
+        self, client: CDPSession, profiler: ObservationProfiler
+    ) -> None:
+        # the handler keeps the wrappers in a dictionary weakly keyed by
+        # the session, a strong reference would keep the session alive
+        self.client_ref = weakref.ref(client)
+        self.profiler = profiler
+
+    @property
+    def client(self) -> CDPSession:
+        client = self.client_ref()
+        if client is None:
+            raise RuntimeError("The CDP session is garbage collected")
+        return client
+
+    def send(self, method: str, params: dict[str, Any] | None = None) -> Any:
+        response = self.client.send(method, params)
+        self.profiler.record_message(params, response)
+        return response
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
 
 
 class ObservationProcessor:
+    # set by the ObservationHandler to profile the observations
+    profiler: ObservationProfiler | None = None
+
     def process(self, page: Page, client: CDPSession) -> Observation:
         raise NotImplementedError
 
+    def profile_stage(self, name: str) -> ContextManager[None]:
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.stage(name)
+
 
 class ObservationMetadata(TypedDict):
     obs_nodes_info: dict[str, Any]
+    spatial_index: SpatialIndex | None
+    # per stage wall time and CDP traffic, empty when not profiling
+    profile: dict[str, StageProfile]
 
 
 def create_empty_metadata() -> ObservationMetadata:
     return {
         "obs_nodes_info": {},
+        "spatial_index": None,
+        "profile": {},
     }
 
 
@@ -50,45 +502,126 @@ class TextObervationProcessor(ObservationProcessor):
         observation_type: str,
         current_viewport_only: bool,
         viewport_size: ViewportSize,
+        bounds_mode: str = "per_node",
+        observation_budget: int = 0,
+        budget_counter: Callable[[str], int] | None = None,
+        incremental: bool = False,
+        verify_incremental: bool = False,
+        viewport_fetch: bool = False,
+        scroll_cache: bool = False,
+        stable_ids: bool = False,
     ):
+        if bounds_mode not in BOUNDS_MODES:
+            raise ValueError(f"Invalid bounds mode: {bounds_mode}")
+        if incremental and observation_type == "html":
+            raise ValueError(
+                "Incremental observations need accessibility tree"
+            )
+        if viewport_fetch and observation_type == "html":
+            raise ValueError("Viewport fetch needs accessibility tree")
+        if viewport_fetch and incremental:
+            raise ValueError(
+                "Viewport fetch and incremental observations are exclusive"
+            )
+        if scroll_cache and (
+            observation_type == "html" or incremental or viewport_fetch
+        ):
+            raise ValueError(
+                "Scroll cache needs the full accessibility tree fetch"
+            )
+        if stable_ids and observation_type == "html":
+            raise ValueError("Stable ids need accessibility tree")
         self.observation_type = observation_type
         self.current_viewport_only = current_viewport_only
         self.viewport_size = viewport_size
+        self.bounds_mode = bounds_mode
+        # stop serializing once the text reaches the budget, 0 to disable
+        self.observation_budget = observation_budget
+        # measures the budget, e.g., number of tokens, default to characters
+        self.budget_counter = budget_counter or len
+        # patch the accessibility tree of the previous step with the updates
+        self.incremental = incremental
+        # compare every patched tree with a full fetch, for debugging
+        self.verify_incremental = verify_incremental
+        self.accessibility_tree_cache: AccessibilityTreeCache | None = None
+        self.watched_clients: weakref.WeakSet[CDPSession] = weakref.WeakSet()
+        # the last (document id, mutation count) reported by each page
+        self.reported_mutation_counts: weakref.WeakKeyDictionary[
+            CDPSession, tuple[str, int]
+        ] = weakref.WeakKeyDictionary()
+        self.incremental_stats: dict[str, int] = defaultdict(int)
+        # only fetch the accessibility subtrees in the current viewport
+        self.viewport_fetch = viewport_fetch
+        self.accessibility_clients: weakref.WeakSet[
+            CDPSession
+        ] = weakref.WeakSet()
+        # slice the full page tree of the previous step after a scroll
+        self.scroll_cache = scroll_cache
+        self.scroll_tree_cache: ScrollTreeCache | None = None
+        self.scroll_cache_stats: dict[str, int] = defaultdict(int)
+        # set by the environment when the last action is a scroll
+        self.scrolled = False
+        # number the elements by their backend DOM node ids, per page
+        self.stable_ids = stable_ids
+        self.stable_id_tables: weakref.WeakKeyDictionary[
+            CDPSession, StableIdTable
+        ] = weakref.WeakKeyDictionary()
         self.observation_tag = "text"
         self.meta_data = (
             create_empty_metadata()
         )  # use the store meta data of this observation type
+        # titles of the non current tabs, dropped when the tab navigates
+        self.tab_titles: dict[Page | APage, str] = {}
+        self.watched_tabs: set[Page | APage] = set()
 
-    def fetch_browser_info(
-        self,
-        page: Page,
-        client: CDPSession,
-    ) -> BrowserInfo:
-        # extract domtree
-        tree = client.send(
-            "DOMSnapshot.captureSnapshot",
-            {
-                "computedStyles": [],
-                "includeDOMRects": True,
-                "includePaintOrder": True,
-            },
-        )
+    def fetch_dom_snapshot(self, client: CDPSession) -> dict[str, Any]:
+        tree = client.send("DOMSnapshot.captureSnapshot", DOM_SNAPSHOT_PARAMS)
+        return self.calibrate_dom_snapshot(tree)
 
+    def calibrate_dom_snapshot(self, tree: dict[str, Any]) -> dict[str, Any]:
         # calibrate the bounds, in some cases, the bounds are scaled somehow
         bounds = tree["documents"][0]["layout"]["bounds"]
         b = bounds[0]
         n = b[2] / self.viewport_size["width"]
-        bounds = [[x / n for x in bound] for bound in bounds]
+        bounds = (np.asarray(bounds, dtype=np.float64) / n).tolist()
         tree["documents"][0]["layout"]["bounds"] = bounds
+        return tree
+
+    def fetch_browser_info(
+        self,
+        page: Page,
+        client: CDPSession,
+    ) -> BrowserInfo:
+        # extract domtree
+        if self.needs_dom_snapshot:
+            with self.profile_stage("dom_snapshot"):
+                tree = self.fetch_dom_snapshot(client)
+        else:
+            tree = {}
 
         # extract browser info
-        win_top_bound = page.evaluate("window.pageYOffset")
-        win_left_bound = page.evaluate("window.pageXOffset")
-        win_width = page.evaluate("window.screen.width")
-        win_height = page.evaluate("window.screen.height")
+        with self.profile_stage("browser_info"):
+            probe = page.evaluate(
+                BROWSER_INFO_PROBE, self.incremental or self.scroll_cache
+            )
+        return self.make_browser_info(tree, probe)
+
+    @property
+    def needs_dom_snapshot(self) -> bool:
+        """Only the html and the batched bounds read the DOM snapshot"""
+        return self.observation_type == "html" or self.bounds_mode == "batched"
+
+    @staticmethod
+    def make_browser_info(
+        tree: dict[str, Any], probe: dict[str, Any]
+    ) -> BrowserInfo:
+        win_top_bound = probe["pageYOffset"]
+        win_left_bound = probe["pageXOffset"]
+        win_width = probe["screenWidth"]
+        win_height = probe["screenHeight"]
         win_right_bound = win_left_bound + win_width
         win_lower_bound = win_top_bound + win_height
-        device_pixel_ratio = page.evaluate("window.devicePixelRatio")
+        device_pixel_ratio = probe["devicePixelRatio"]
         assert device_pixel_ratio == 1.0, "devicePixelRatio is not 1.0"
 
         config: BrowserConfig = {
@@ -102,7 +635,14 @@ class TextObervationProcessor(ObservationProcessor):
         }
 
         # assert len(tree['documents']) == 1, "More than one document in the DOM tree"
-        info: BrowserInfo = {"DOMTree": tree, "config": config}
+        info: BrowserInfo = {
+            "DOMTree": tree,
+            "config": config,
+            "title": probe["title"],
+            "document_id": probe["documentId"],
+            "mutation_count": probe["mutationCount"],
+            "layout_count": probe["layoutCount"],
+        }
 
         return info
 
@@ -119,19 +659,7 @@ class TextObervationProcessor(ObservationProcessor):
                 "Runtime.callFunctionOn",
                 {
                     "objectId": remote_object_id,
-                    "functionDeclaration": """
-                        function() {
-                            if (this.nodeType == 3) {
-                                var range = document.createRange();
-                                range.selectNode(this);
-                                var rect = range.getBoundingClientRect().toJSON();
-                                range.detach();
-                                return rect;
-                            } else {
-                                return this.getBoundingClientRect().toJSON();
-                            }
-                        }
-                    """,
+                    "functionDeclaration": BOUNDING_CLIENT_RECT_FUNCTION,
                     "returnByValue": True,
                 },
             )
@@ -139,6 +667,62 @@ class TextObervationProcessor(ObservationProcessor):
         except Exception as e:
             return {"result": {"subtype": "error"}}
 
+    @staticmethod
+    def get_union_bound(response: dict[str, Any]) -> list[float] | None:
+        """Convert the response of `get_bounding_client_rect` to a bound"""
+        if response.get("result", {}).get("subtype", "") == "error":
+            return None
+        x = response["result"]["value"]["x"]
+        y = response["result"]["value"]["y"]
+        width = response["result"]["value"]["width"]
+        height = response["result"]["value"]["height"]
+        return [x, y, width, height]
+
+    @staticmethod
+    def get_snapshot_node_bounds(
+        info: BrowserInfo,
+    ) -> list[list[float] | None]:
+        """Read the client rect of every node in the main document from the
+        layout bounds of the DOM snapshot, indexed like the snapshot nodes.
+
+        The layout bounds are absolute document coordinates, shifting them by
+        the scroll offsets gives what `getBoundingClientRect` returns. Element
+        and text nodes without a layout object have an empty rect, the other
+        node types (document, comment, doctype) have none.
+        """
+        config = info["config"]
+        document = info["DOMTree"]["documents"][0]
+        node_types = np.asarray(document["nodes"]["nodeType"])
+        layout = document["layout"]
+
+        has_rect = (node_types == 1) | (node_types == 3)
+        bounds = np.zeros((len(node_types), 4))
+        if layout["nodeIndex"]:
+            layout_node_idxs = np.asarray(layout["nodeIndex"])
+            layout_bounds = np.asarray(layout["bounds"], dtype=np.float64)
+            keep = has_rect[layout_node_idxs]
+            bounds[layout_node_idxs[keep]] = layout_bounds[keep] - [
+                config["win_left_bound"],
+                config["win_top_bound"],
+                0.0,
+                0.0,
+            ]
+        return [
+            bound if valid else None
+            for bound, valid in zip(bounds.tolist(), has_rect.tolist())
+        ]
+
+    @classmethod
+    def get_snapshot_client_rects(
+        cls,
+        info: BrowserInfo,
+    ) -> dict[int, list[float] | None]:
+        """Same as `get_snapshot_node_bounds`, keyed by backend node id"""
+        backend_node_ids = info["DOMTree"]["documents"][0]["nodes"][
+            "backendNodeId"
+        ]
+        return dict(zip(backend_node_ids, cls.get_snapshot_node_bounds(info)))
+
     @staticmethod
     def get_element_in_viewport_ratio(
         elem_left_bound: float,
@@ -171,6 +755,107 @@ class TextObervationProcessor(ObservationProcessor):
         ratio = overlap_width * overlap_height / width * height
         return ratio
 
+    @staticmethod
+    def get_elements_in_viewport_ratio(
+        union_bounds: Sequence[list[float] | None], config: BrowserConfig
+    ) -> tuple[npt.NDArray[np.float64], npt.NDArray[np.bool_]]:
+        """Vectorized `get_element_in_viewport_ratio` over all the nodes.
+
+        Return the ratio of each node, nan for nodes without a bound, and
+        the mask of the nodes with a non-empty bound.
+        """
+        bounds = np.array(
+            [bound if bound else [np.nan] * 4 for bound in union_bounds],
+            dtype=np.float64,
+        ).reshape(-1, 4)
+        x, y, width, height = bounds.T
+        visible = (width != 0) & (height != 0) & ~np.isnan(width)
+
+        # Compute the overlap in x and y axes
+        overlap_width = np.maximum(
+            0,
+            np.minimum(x + width, config["win_width"]) - np.maximum(x, 0),
+        )
+        overlap_height = np.maximum(
+            0,
+            np.minimum(y + height, config["win_height"]) - np.maximum(y, 0),
+        )
+
+        # Compute the overlap area, invisible nodes are not in the viewport
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = overlap_width * overlap_height / width * height
+        ratio[~visible & ~np.isnan(width)] = 0.0
+        return ratio, visible
+
+    @classmethod
+    def set_in_viewport_ratio(
+        cls, tree: TreeT, config: BrowserConfig
+    ) -> npt.NDArray[np.bool_]:
+        """Store the in viewport ratio on each node and return the mask of
+        the nodes in the current viewport"""
+        ratio, visible = cls.get_elements_in_viewport_ratio(
+            [node["union_bound"] for node in tree], config
+        )
+        for node, node_ratio in zip(tree, ratio.tolist()):
+            node["in_viewport_ratio"] = (
+                None if math.isnan(node_ratio) else node_ratio
+            )
+        in_viewport: npt.NDArray[np.bool_] = visible & (
+            ratio >= IN_VIEWPORT_RATIO_THRESHOLD
+        )
+        return in_viewport
+
+    @staticmethod
+    def remove_nodes_in_graph(tree: TreeT, keep: Sequence[bool]) -> TreeT:
+        """Remove the nodes that are not kept from the tree in O(n).
+
+        The children of a removed node take its place in the children of the
+        closest kept ancestor, and are re-parented to that ancestor.
+        """
+        nodeid_to_cursor = {
+            node["nodeId"]: cursor for cursor, node in enumerate(tree)
+        }
+        # only the kept nodes with a removed child change, the children of
+        # a removed node are spliced when its closest kept ancestor is
+        changed_cursors = []
+        for cursor, node in enumerate(tree):
+            if keep[cursor]:
+                continue
+            parent_cursor = nodeid_to_cursor.get(node.get("parentId"))
+            if parent_cursor is not None and keep[parent_cursor]:
+                changed_cursors.append(parent_cursor)
+
+        for cursor in dict.fromkeys(changed_cursors):
+            node = tree[cursor]
+            # splice the children of the removed descendants in place
+            child_ids = []
+            stack = [
+                (child_id, False) for child_id in reversed(node["childIds"])
+            ]
+            while stack:
+                child_id, reparent = stack.pop()
+                child_cursor = nodeid_to_cursor.get(child_id)
+                if child_cursor is None or keep[child_cursor]:
+                    child_ids.append(child_id)
+                    if child_cursor is not None and reparent:
+                        tree[child_cursor]["parentId"] = node["nodeId"]
+                else:
+                    grandchild_ids = tree[child_cursor]["childIds"]
+                    stack.extend(
+                        (grandchild_id, True)
+                        for grandchild_id in reversed(grandchild_ids)
+                    )
+            node["childIds"] = child_ids
+
+        kept_tree = []
+        for cursor, node in enumerate(tree):
+            if keep[cursor]:
+                kept_tree.append(node)
+            else:
+                # mark as removed
+                node["parentId"] = "[REMOVED]"
+        return kept_tree
+
     def fetch_page_html(
         self,
         info: BrowserInfo,
@@ -178,12 +863,39 @@ class TextObervationProcessor(ObservationProcessor):
         client: CDPSession,
         current_viewport_only: bool,
     ) -> DOMTree:
+        with self.profile_stage("dom_tree"):
+            dom_tree = self.build_dom_tree(info)
+        if self.bounds_mode != "batched":
+            with self.profile_stage("bounds"):
+                for node in dom_tree:
+                    if node["parentId"] != "-1":
+                        response = self.get_bounding_client_rect(
+                            client, node["backendNodeId"]
+                        )
+                        node["union_bound"] = self.get_union_bound(response)
+        with self.profile_stage("prune"):
+            return self.filter_viewport_nodes(
+                dom_tree, info["config"], current_viewport_only
+            )
+
+    def build_dom_tree(self, info: BrowserInfo) -> DOMTree:
+        """The DOM tree of the snapshot, the bounds are only set in the
+        batched mode"""
         # adopted from [natbot](https://github.com/nat/natbot)
         tree = info["DOMTree"]
         strings = tree["strings"]
         document = tree["documents"][0]
         nodes = document["nodes"]
 
+        # decode the string table once, values are whitespace normalized
+        clean_strings = [" ".join(string.split()) for string in strings]
+        # join the layout bounds to the nodes without going to the browser
+        snapshot_bounds = (
+            self.get_snapshot_node_bounds(info)
+            if self.bounds_mode == "batched"
+            else []
+        )
+
         # make a dom tree that is easier to navigate
         dom_tree: DOMTree = []
         graph = defaultdict(list)
@@ -199,6 +911,7 @@ class TextObervationProcessor(ObservationProcessor):
                 "childIds": [],
                 "cursor": 0,
                 "union_bound": None,
+                "in_viewport_ratio": None,
             }
 
             node_type_idx = nodes["nodeType"][node_idx]
@@ -211,18 +924,15 @@ class TextObervationProcessor(ObservationProcessor):
             node_value_idx = nodes["nodeValue"][node_idx]
             node_value = ""
             if node_value_idx >= 0 and node_value_idx < len(strings):
-                node_value = " ".join(strings[node_value_idx].split())
+                node_value = clean_strings[node_value_idx]
 
-            node_attributes = [
-                strings[i] for i in nodes["attributes"][node_idx]
-            ]
-            node_attributes_str = ""
-            for i in range(0, len(node_attributes), 2):
-                a = node_attributes[i]
-                b = node_attributes[i + 1]
-                b = " ".join(b.split())
-                node_attributes_str += f'{a}="{b}" '
-            node_attributes_str = node_attributes_str.strip()
+            node_attributes = nodes["attributes"][node_idx]
+            node_attributes_str = " ".join(
+                f'{strings[name_idx]}="{clean_strings[value_idx]}"'
+                for name_idx, value_idx in zip(
+                    node_attributes[::2], node_attributes[1::2]
+                )
+            )
 
             cur_node["nodeId"] = str(node_idx)
             cur_node["nodeType"] = node_type
@@ -238,96 +948,43 @@ class TextObervationProcessor(ObservationProcessor):
             # get the bound
             if cur_node["parentId"] == "-1":
                 cur_node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
-            else:
-                response = self.get_bounding_client_rect(
-                    client, cur_node["backendNodeId"]
-                )
-                if response.get("result", {}).get("subtype", "") == "error":
-                    cur_node["union_bound"] = None
-                else:
-                    x = response["result"]["value"]["x"]
-                    y = response["result"]["value"]["y"]
-                    width = response["result"]["value"]["width"]
-                    height = response["result"]["value"]["height"]
-                    cur_node["union_bound"] = [x, y, width, height]
+            elif snapshot_bounds:
+                cur_node["union_bound"] = snapshot_bounds[node_idx]
 
             dom_tree.append(cur_node)
 
         # add parent children index to the node
         for parent_id, child_ids in graph.items():
             dom_tree[int(parent_id)]["childIds"] = child_ids
+        return dom_tree
 
-        # remove the nodes that are not in the current viewport
+    @classmethod
+    def filter_viewport_nodes(
+        cls, tree: TreeT, config: BrowserConfig, current_viewport_only: bool
+    ) -> TreeT:
+        """Set the in viewport ratio of the nodes with their bound, and
+        remove the nodes that are not in the current viewport"""
+        in_viewport = cls.set_in_viewport_ratio(tree, config)
         if current_viewport_only:
-
-            def remove_node_in_graph(node: DOMNode) -> None:
-                # update the node information in the accessibility tree
-                node_id = node["nodeId"]
-                parent_id = node["parentId"]
-                child_ids = node["childIds"]
-
-                # update the children of the parent node
-                assert dom_tree[int(parent_id)]["parentId"] != "[REMOVED]"
-                # remove the nodeid from parent
-                index = dom_tree[int(parent_id)]["childIds"].index(node_id)
-                dom_tree[int(parent_id)]["childIds"].pop(index)
-
-                # Insert children_nodeids in the same location
-                for child_id in child_ids:
-                    dom_tree[int(parent_id)]["childIds"].insert(
-                        index, child_id
-                    )
-                    index += 1
-
-                # update children node's parent
-                for child_id in child_ids:
-                    dom_tree[int(child_id)]["parentId"] = parent_id
-                # mark as removed
-                dom_tree[int(node_id)]["parentId"] = "[REMOVED]"
-
-            config = info["config"]
-            for cursor, node in enumerate(dom_tree):
-                if not node["union_bound"]:
-                    remove_node_in_graph(node)
-                    continue
-
-                [x, y, width, height] = node["union_bound"]
-
-                # invisible node
-                if width == 0.0 or height == 0.0:
-                    remove_node_in_graph(node)
-                    continue
-
-                in_viewport_ratio = self.get_element_in_viewport_ratio(
-                    elem_left_bound=float(x),
-                    elem_top_bound=float(y),
-                    width=float(width),
-                    height=float(height),
-                    config=config,
-                )
-
-                if in_viewport_ratio < IN_VIEWPORT_RATIO_THRESHOLD:
-                    remove_node_in_graph(node)
-
-            dom_tree = [
-                node
-                for node in dom_tree
-                if node.get("parentId", "-1") != "[REMOVED]"
-            ]
-
-        return dom_tree
+            tree = cls.remove_nodes_in_graph(tree, in_viewport.tolist())
+        return tree
 
     @staticmethod
-    def parse_html(dom_tree: DOMTree) -> tuple[str, dict[str, Any]]:
-        """Parse the html tree into a string text"""
-
-        obs_nodes_info = {}
+    def iter_html(
+        dom_tree: DOMTree,
+    ) -> Iterator[tuple[str, str, dict[str, Any]]]:
+        """Yield the (obs node id, line, node info) of the html tree
+        in depth first order, the traversal is lazy and can be stopped
+        at any line"""
         nodeid_to_cursor = {
             node["nodeId"]: idx for idx, node in enumerate(dom_tree)
         }
 
-        def dfs(node_cursor: int, depth: int) -> str:
-            tree_str = ""
+        # depth first traversal with an explicit stack, deeply nested pages
+        # would hit the recursion limit
+        stack = [(0, 0)]
+        while stack:
+            node_cursor, depth = stack.pop()
             node = dom_tree[node_cursor]
             indent = "\t" * depth
             valid_node = True
@@ -339,37 +996,68 @@ class TextObervationProcessor(ObservationProcessor):
                 valid_node = bool(node["attributes"] or node["nodeValue"])
 
                 if valid_node:
-                    obs_nodes_info[str(node_cursor)] = {
+                    node_info = {
                         "backend_id": node["backendNodeId"],
                         "union_bound": node["union_bound"],
+                        "in_viewport_ratio": node.get("in_viewport_ratio"),
                         "text": node_str,
                     }
-                    tree_str += f"{indent}{node_str}\n"
+                    yield str(node_cursor), f"{indent}{node_str}\n", node_info
 
             except Exception as e:
                 valid_node = False
 
-            for child_ids in node["childIds"]:
+            child_depth = depth + 1 if valid_node else depth
+            for child_ids in reversed(node["childIds"]):
                 child_cursor = nodeid_to_cursor[child_ids]
-                child_depth = depth + 1 if valid_node else depth
-                child_str = dfs(child_cursor, child_depth)
-                tree_str += child_str
+                stack.append((child_cursor, child_depth))
 
-            return tree_str
+    @classmethod
+    def parse_html(cls, dom_tree: DOMTree) -> tuple[str, dict[str, Any]]:
+        """Parse the html tree into a string text"""
+        obs_nodes_info = {}
+        lines: list[str] = []
+        for obs_node_id, line, node_info in cls.iter_html(dom_tree):
+            lines.append(line)
+            obs_nodes_info[obs_node_id] = node_info
 
-        html = dfs(0, 0)
+        html = "".join(lines)
         return html, obs_nodes_info
 
-    def fetch_page_accessibility_tree(
-        self,
-        info: BrowserInfo,
+    @classmethod
+    def parse_html_with_budget(
+        cls,
+        dom_tree: DOMTree,
+        budget: int,
+        count: Callable[[str], int] = len,
+    ) -> tuple[str, dict[str, Any]]:
+        """Parse the html tree until the text reaches the budget"""
+        obs_nodes_info = {}
+
+        def iter_lines() -> Iterator[str]:
+            for obs_node_id, line, node_info in cls.iter_html(dom_tree):
+                obs_nodes_info[obs_node_id] = node_info
+                yield line
+
+        lines = cls.take_lines_with_budget(iter_lines(), budget, count)
+        html = "".join(lines)
+        return html, obs_nodes_info
+
+    @staticmethod
+    def fetch_full_accessibility_tree(
         client: CDPSession,
-        current_viewport_only: bool,
     ) -> AccessibilityTree:
         accessibility_tree: AccessibilityTree = client.send(
             "Accessibility.getFullAXTree", {}
         )["nodes"]
+        return TextObervationProcessor.dedup_accessibility_tree(
+            accessibility_tree
+        )
 
+    @staticmethod
+    def dedup_accessibility_tree(
+        accessibility_tree: AccessibilityTree,
+    ) -> AccessibilityTree:
         # a few nodes are repeated in the accessibility tree
         seen_ids = set()
         _accessibility_tree = []
@@ -378,137 +1066,597 @@ class TextObervationProcessor(ObservationProcessor):
                 _accessibility_tree.append(node)
                 seen_ids.add(node["nodeId"])
         accessibility_tree = _accessibility_tree
+        return accessibility_tree
 
-        nodeid_to_cursor = {}
-        for cursor, node in enumerate(accessibility_tree):
-            nodeid_to_cursor[node["nodeId"]] = cursor
-            # usually because the node is not visible etc
-            if "backendDOMNodeId" not in node:
-                node["union_bound"] = None
-                continue
-            backend_node_id = str(node["backendDOMNodeId"])
-            if node["role"]["value"] == "RootWebArea":
-                # always inside the viewport
-                node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
-            else:
-                response = self.get_bounding_client_rect(
-                    client, backend_node_id
-                )
-                if response.get("result", {}).get("subtype", "") == "error":
-                    node["union_bound"] = None
-                else:
-                    x = response["result"]["value"]["x"]
-                    y = response["result"]["value"]["y"]
-                    width = response["result"]["value"]["width"]
-                    height = response["result"]["value"]["height"]
-                    node["union_bound"] = [x, y, width, height]
-
-        # filter nodes that are not in the current viewport
-        if current_viewport_only:
+    def enable_accessibility(self, client: CDPSession) -> None:
+        """Keep the accessibility node ids stable between the calls"""
+        if client in self.accessibility_clients:
+            return
+        client.send("Accessibility.enable")
+        self.accessibility_clients.add(client)
 
-            def remove_node_in_graph(node: AccessibilityTreeNode) -> None:
-                # update the node information in the accessibility tree
-                nodeid = node["nodeId"]
-                node_cursor = nodeid_to_cursor[nodeid]
-                parent_nodeid = node["parentId"]
-                children_nodeids = node["childIds"]
-                parent_cursor = nodeid_to_cursor[parent_nodeid]
-                # update the children of the parent node
-                assert (
-                    accessibility_tree[parent_cursor].get("parentId", "Root")
-                    is not None
-                )
-                # remove the nodeid from parent's childIds
-                index = accessibility_tree[parent_cursor]["childIds"].index(
-                    nodeid
-                )
-                accessibility_tree[parent_cursor]["childIds"].pop(index)
-                # Insert children_nodeids in the same location
-                for child_nodeid in children_nodeids:
-                    accessibility_tree[parent_cursor]["childIds"].insert(
-                        index, child_nodeid
-                    )
-                    index += 1
-                # update children node's parent
-                for child_nodeid in children_nodeids:
-                    child_cursor = nodeid_to_cursor[child_nodeid]
-                    accessibility_tree[child_cursor][
-                        "parentId"
-                    ] = parent_nodeid
-                # mark as removed
-                accessibility_tree[node_cursor]["parentId"] = "[REMOVED]"
+    @staticmethod
+    def fetch_viewport_elements(
+        client: CDPSession,
+    ) -> tuple[list[str], list[str]]:
+        """The object ids of the path and root elements of
+        VIEWPORT_ELEMENTS_PROBE"""
+        response = client.send(
+            "Runtime.evaluate",
+            {
+                "expression": f"({VIEWPORT_ELEMENTS_PROBE})"
+                f"({VIEWPORT_SWEEP_STEP})",
+                "objectGroup": "browser_env",
+            },
+        )
 
-            config = info["config"]
-            for node in accessibility_tree:
-                if not node["union_bound"]:
-                    remove_node_in_graph(node)
-                    continue
+        def get_items(object_id: str) -> list[str]:
+            properties = client.send(
+                "Runtime.getProperties",
+                {"objectId": object_id, "ownProperties": True},
+            )["result"]
+            return [
+                prop["value"]["objectId"]
+                for prop in properties
+                if prop["name"].isdigit()
+            ]
 
-                [x, y, width, height] = node["union_bound"]
+        path_id, roots_id = get_items(response["result"]["objectId"])
+        return get_items(path_id), get_items(roots_id)
 
-                # invisible node
-                if width == 0 or height == 0:
-                    remove_node_in_graph(node)
-                    continue
+    def fetch_viewport_accessibility_tree(
+        self, client: CDPSession
+    ) -> AccessibilityTree | None:
+        """Fetch the accessibility subtrees of the elements in the
+        viewport and stitch them under the root.
 
-                in_viewport_ratio = self.get_element_in_viewport_ratio(
-                    elem_left_bound=float(x),
-                    elem_top_bound=float(y),
-                    width=float(width),
-                    height=float(height),
-                    config=config,
+        The nodes out of the viewport are still removed by the in viewport
+        ratio, this only bounds the CDP payload. None if the page needs
+        too many subtrees.
+        """
+        self.enable_accessibility(client)
+        try:
+            path_ids, root_ids = self.fetch_viewport_elements(client)
+            if len(root_ids) > MAX_VIEWPORT_FETCH_ROOTS:
+                return None
+            nodes: dict[str, AccessibilityTreeNode] = {}
+            root_id = None
+            for object_id in path_ids:
+                response = client.send(
+                    "Accessibility.getPartialAXTree",
+                    {"objectId": object_id, "fetchRelatives": False},
                 )
+                for node in response["nodes"]:
+                    if root_id is None:
+                        # the document comes first
+                        root_id = node["nodeId"]
+                    nodes.setdefault(node["nodeId"], node)
+            for object_id in root_ids:
+                response = client.send(
+                    "Accessibility.queryAXTree", {"objectId": object_id}
+                )
+                for node in response["nodes"]:
+                    nodes.setdefault(node["nodeId"], node)
+        finally:
+            client.send(
+                "Runtime.releaseObjectGroup", {"objectGroup": "browser_env"}
+            )
+        if root_id is None:
+            return None
+
+        # the accessibility parent is not always a DOM ancestor, e.g.,
+        # aria-owns, fetch the missing ancestors
+        orphans = [
+            node
+            for node in nodes.values()
+            if "parentId" in node and node["parentId"] not in nodes
+        ]
+        for node in orphans:
+            if node["parentId"] in nodes or "backendDOMNodeId" not in node:
+                continue
+            response = client.send(
+                "Accessibility.getPartialAXTree",
+                {
+                    "backendNodeId": node["backendDOMNodeId"],
+                    "fetchRelatives": True,
+                },
+            )
+            for relative in response["nodes"]:
+                nodes.setdefault(relative["nodeId"], relative)
+
+        # the children out of the viewport are not fetched
+        for node in nodes.values():
+            if "childIds" in node:
+                node["childIds"] = [
+                    child_id
+                    for child_id in node["childIds"]
+                    if child_id in nodes
+                ]
+        return self.get_reachable_nodes(nodes, root_id)
+
+    def watch_accessibility_updates(self, client: CDPSession) -> None:
+        if client in self.watched_clients:
+            return
+        # the clients of the new tabs are not enabled
+        client.send("Accessibility.enable")
+        client.on(
+            "Accessibility.nodesUpdated",
+            lambda event: self.on_nodes_updated(client, event["nodes"]),
+        )
+        client.on(
+            "Accessibility.loadComplete",
+            lambda event: self.on_load_complete(client),
+        )
+        client.on(
+            "Runtime.bindingCalled",
+            lambda event: self.on_binding_called(client, event),
+        )
+        client.send("Runtime.addBinding", {"name": MUTATION_BINDING})
+        self.watched_clients.add(client)
 
-                if in_viewport_ratio < IN_VIEWPORT_RATIO_THRESHOLD:
-                    remove_node_in_graph(node)
+    def on_nodes_updated(
+        self, client: CDPSession, nodes: list[AccessibilityTreeNode]
+    ) -> None:
+        cache = self.accessibility_tree_cache
+        if cache is not None and cache.client is client:
+            cache.updates.extend(nodes)
+            # every mutation of the document is reported, none yet is 0
+            document_id, mutation_count = self.reported_mutation_counts.get(
+                client, (cache.document_id, 0)
+            )
+            cache.updates_mutation_count = (
+                mutation_count if document_id == cache.document_id else None
+            )
 
-            accessibility_tree = [
-                node
-                for node in accessibility_tree
-                if node.get("parentId", "Root") != "[REMOVED]"
-            ]
+    def on_binding_called(
+        self, client: CDPSession, event: dict[str, Any]
+    ) -> None:
+        if event["name"] != MUTATION_BINDING:
+            return
+        payload = json.loads(event["payload"])
+        self.reported_mutation_counts[client] = (
+            payload["documentId"],
+            payload["count"],
+        )
 
-        return accessibility_tree
+    def on_load_complete(self, client: CDPSession) -> None:
+        cache = self.accessibility_tree_cache
+        if cache is not None and cache.client is client:
+            cache.reload = True
 
     @staticmethod
-    def parse_accessibility_tree(
-        accessibility_tree: AccessibilityTree,
-    ) -> tuple[str, dict[str, Any]]:
-        """Parse the accessibility tree into a string text"""
-        node_id_to_idx = {}
-        for idx, node in enumerate(accessibility_tree):
-            node_id_to_idx[node["nodeId"]] = idx
+    def get_reachable_nodes(
+        nodes: dict[str, AccessibilityTreeNode], root_id: str
+    ) -> AccessibilityTree:
+        """Nodes reachable from the root in depth first order"""
+        reachable = []
+        stack = [root_id]
+        while stack:
+            node_id = stack.pop()
+            if node_id not in nodes:
+                continue
+            node = nodes[node_id]
+            reachable.append(node)
+            stack.extend(reversed(node.get("childIds", [])))
+        return reachable
 
-        obs_nodes_info = {}
+    @staticmethod
+    def patch_accessibility_tree_cache(
+        cache: AccessibilityTreeCache, client: CDPSession
+    ) -> bool:
+        """Apply the pending updates and fetch the children that are new
+        to the cache, return False if it takes too many round trips"""
+        updates, cache.updates = cache.updates, []
+        nodes = cache.nodes
+        for node in updates:
+            nodes[node["nodeId"]] = node
+
+        parents = list(updates)
+        num_fetches = 0
+        while parents:
+            parent = parents.pop()
+            if all(
+                child_id in nodes for child_id in parent.get("childIds", [])
+            ):
+                continue
+            if num_fetches == MAX_INCREMENTAL_FETCHES:
+                return False
+            num_fetches += 1
+            children = client.send(
+                "Accessibility.getChildAXNodes", {"id": parent["nodeId"]}
+            )["nodes"]
+            for child in children:
+                if child["nodeId"] not in nodes:
+                    nodes[child["nodeId"]] = child
+                    parents.append(child)
+
+        # the removed subtrees are no longer reachable
+        cache.nodes = {
+            node["nodeId"]: node
+            for node in TextObervationProcessor.get_reachable_nodes(
+                nodes, cache.root_id
+            )
+        }
+        return True
+
+    @classmethod
+    def get_accessibility_tree_signature(
+        cls, accessibility_tree: AccessibilityTree
+    ) -> dict[str, tuple[Any, ...]]:
+        """The parts of the reachable nodes that reach the observation"""
+        nodes = {node["nodeId"]: node for node in accessibility_tree}
+        return {
+            node["nodeId"]: (
+                node.get("role"),
+                node.get("name"),
+                node.get("properties"),
+                node.get("childIds"),
+                node.get("backendDOMNodeId"),
+            )
+            for node in cls.get_reachable_nodes(
+                nodes, accessibility_tree[0]["nodeId"]
+            )
+        }
 
-        def dfs(idx: int, obs_node_id: str, depth: int) -> str:
-            tree_str = ""
-            node = accessibility_tree[idx]
-            indent = "\t" * depth
-            valid_node = True
-            try:
-                role = node["role"]["value"]
-                name = node["name"]["value"]
-                node_str = f"[{obs_node_id}] {role} {repr(name)}"
-                properties = []
-                for property in node.get("properties", []):
-                    try:
-                        if property["name"] in IGNORED_ACTREE_PROPERTIES:
-                            continue
-                        properties.append(
-                            f'{property["name"]}: {property["value"]["value"]}'
-                        )
-                    except KeyError:
-                        pass
+    def fetch_incremental_accessibility_tree(
+        self, info: BrowserInfo, client: CDPSession
+    ) -> AccessibilityTree:
+        """Reuse the accessibility tree of the previous step when the
+        page did not change and patch it with the accessibility updates
+        otherwise, fall back to a full fetch when unsure"""
+        self.watch_accessibility_updates(client)
+        cache = self.accessibility_tree_cache
+        status = "full"
+        if (
+            cache is not None
+            and cache.client is client
+            and cache.document_id is not None
+            and cache.document_id == info["document_id"]
+            and not cache.reload
+        ):
+            if cache.updates:
+                # the updates miss the mutations after the last one of them
+                if cache.updates_mutation_count == info["mutation_count"]:
+                    # the nodes are patched in place, a failed patch is
+                    # discarded
+                    if self.patch_accessibility_tree_cache(cache, client):
+                        status = "patched"
+            elif cache.mutation_count == info["mutation_count"]:
+                status = "reused"
+            # mutations without any update yet, the update can be late
+
+        if status == "full" or cache is None:
+            accessibility_tree = self.fetch_full_accessibility_tree(client)
+            cache = AccessibilityTreeCache(
+                client=client,
+                document_id=info["document_id"],
+                mutation_count=info["mutation_count"],
+                root_id=accessibility_tree[0]["nodeId"],
+                nodes={node["nodeId"]: node for node in accessibility_tree},
+            )
+            self.accessibility_tree_cache = cache
+        else:
+            cache.mutation_count = info["mutation_count"]
+            accessibility_tree = self.get_reachable_nodes(
+                cache.nodes, cache.root_id
+            )
+            if self.verify_incremental:
+                full_accessibility_tree = self.fetch_full_accessibility_tree(
+                    client
+                )
+                if self.get_accessibility_tree_signature(
+                    accessibility_tree
+                ) != self.get_accessibility_tree_signature(
+                    full_accessibility_tree
+                ):
+                    self.incremental_stats["mismatch"] += 1
+                    status = "full"
+                    accessibility_tree = full_accessibility_tree
+                    cache.nodes = {
+                        node["nodeId"]: node for node in accessibility_tree
+                    }
+                    cache.root_id = accessibility_tree[0]["nodeId"]
+        self.incremental_stats[status] += 1
 
-                if properties:
-                    node_str += " " + " ".join(properties)
+        # the bounds and the viewport filter are set on copies
+        return [node.copy() for node in accessibility_tree]
 
-                # check valid
-                if not node_str.strip():
-                    valid_node = False
+    def get_accessibility_node_bound(
+        self,
+        node: AccessibilityTreeNode,
+        snapshot_rects: dict[int, list[float] | None],
+        client: CDPSession,
+    ) -> list[float] | None:
+        # usually because the node is not visible etc
+        if "backendDOMNodeId" not in node:
+            return None
+        backend_node_id = str(node["backendDOMNodeId"])
+        if node["role"]["value"] == "RootWebArea":
+            # always inside the viewport
+            return [0.0, 0.0, 10.0, 10.0]
+        elif int(backend_node_id) in snapshot_rects:
+            return snapshot_rects[int(backend_node_id)]
+        else:
+            # per node mode, or nodes outside of the main document
+            response = self.get_bounding_client_rect(client, backend_node_id)
+            return self.get_union_bound(response)
 
-                # empty generic node
+    @staticmethod
+    def fetch_anchored_backend_ids(client: CDPSession) -> set[int]:
+        """The backend ids of the fixed and sticky elements of the main
+        document and of their descendants"""
+        tree = client.send(
+            "DOMSnapshot.captureSnapshot", {"computedStyles": ["position"]}
+        )
+        strings = tree["strings"]
+        document = tree["documents"][0]
+        layout = document["layout"]
+        positions = {
+            node_idx: strings[styles[0]]
+            for node_idx, styles in zip(layout["nodeIndex"], layout["styles"])
+            if styles
+        }
+        backend_ids = set()
+        # the parents come before their children
+        anchored: list[bool] = []
+        for node_idx, (parent_idx, backend_id) in enumerate(
+            zip(
+                document["nodes"]["parentIndex"],
+                document["nodes"]["backendNodeId"],
+            )
+        ):
+            anchored.append(
+                positions.get(node_idx) in ("fixed", "sticky")
+                or (parent_idx >= 0 and anchored[parent_idx])
+            )
+            if anchored[-1]:
+                backend_ids.add(backend_id)
+        return backend_ids
+
+    def fetch_scroll_cached_accessibility_tree(
+        self, info: BrowserInfo, client: CDPSession
+    ) -> tuple[AccessibilityTree, list[list[float] | None]]:
+        """The accessibility tree and the bounds of its nodes, sliced from
+        the tree of the previous step when the page only scrolled since"""
+        config = info["config"]
+        cache = self.scroll_tree_cache
+        scrolled, self.scrolled = self.scrolled, False
+        if (
+            scrolled
+            and cache is not None
+            and cache.client is client
+            and cache.document_id is not None
+            and cache.document_id == info["document_id"]
+            and cache.layout_count == info["layout_count"]
+        ):
+            self.scroll_cache_stats["sliced"] += 1
+            union_bounds = [
+                self.get_accessibility_node_bound(node, {}, client)
+                if anchored
+                else (
+                    None
+                    if bound is None
+                    else [
+                        bound[0] - config["win_left_bound"],
+                        bound[1] - config["win_top_bound"],
+                        bound[2],
+                        bound[3],
+                    ]
+                )
+                for node, bound, anchored in zip(
+                    cache.nodes, cache.document_bounds, cache.anchored
+                )
+            ]
+        else:
+            self.scroll_cache_stats["full"] += 1
+            nodes = self.fetch_full_accessibility_tree(client)
+            snapshot_rects = (
+                self.get_snapshot_client_rects(info)
+                if self.bounds_mode == "batched"
+                else {}
+            )
+            union_bounds = [
+                self.get_accessibility_node_bound(node, snapshot_rects, client)
+                for node in nodes
+            ]
+            anchored_ids = self.fetch_anchored_backend_ids(client)
+            cache = ScrollTreeCache(
+                client=client,
+                document_id=info["document_id"],
+                layout_count=info["layout_count"],
+                nodes=nodes,
+                document_bounds=[
+                    None
+                    if bound is None
+                    else [
+                        bound[0] + config["win_left_bound"],
+                        bound[1] + config["win_top_bound"],
+                        bound[2],
+                        bound[3],
+                    ]
+                    for bound in union_bounds
+                ],
+                anchored=[
+                    node["role"]["value"] == "RootWebArea"
+                    or int(node.get("backendDOMNodeId", -1)) in anchored_ids
+                    for node in nodes
+                ],
+            )
+            self.scroll_tree_cache = cache
+
+        # the bounds and the viewport filter are set on copies
+        return [node.copy() for node in cache.nodes], union_bounds
+
+    def fetch_page_accessibility_tree(
+        self,
+        info: BrowserInfo,
+        client: CDPSession,
+        current_viewport_only: bool,
+    ) -> AccessibilityTree:
+        if self.scroll_cache:
+            # the bounds come with the cached tree
+            with self.profile_stage("accessibility_tree"):
+                (
+                    accessibility_tree,
+                    union_bounds,
+                ) = self.fetch_scroll_cached_accessibility_tree(info, client)
+                if self.stable_ids:
+                    accessibility_tree = self.assign_stable_ids(
+                        accessibility_tree, client
+                    )
+        else:
+            with self.profile_stage("accessibility_tree"):
+                accessibility_tree = self.fetch_accessibility_tree(
+                    info, client, current_viewport_only
+                )
+                if self.stable_ids:
+                    accessibility_tree = self.assign_stable_ids(
+                        accessibility_tree, client
+                    )
+
+            with self.profile_stage("bounds"):
+                # resolve all the bounds from the DOM snapshot at once
+                snapshot_rects = (
+                    self.get_snapshot_client_rects(info)
+                    if self.bounds_mode == "batched"
+                    else {}
+                )
+
+                union_bounds = [
+                    self.get_accessibility_node_bound(
+                        node, snapshot_rects, client
+                    )
+                    for node in accessibility_tree
+                ]
+        with self.profile_stage("prune"):
+            return self.filter_viewport_accessibility_tree(
+                accessibility_tree,
+                union_bounds,
+                info["config"],
+                current_viewport_only,
+            )
+
+    def fetch_accessibility_tree(
+        self,
+        info: BrowserInfo,
+        client: CDPSession,
+        current_viewport_only: bool,
+    ) -> AccessibilityTree:
+        """Fetch the tree in the configured mode, without the bounds"""
+        viewport_tree = None
+        if self.viewport_fetch and current_viewport_only:
+            viewport_tree = self.fetch_viewport_accessibility_tree(client)
+
+        if viewport_tree is not None:
+            return viewport_tree
+        elif self.incremental:
+            return self.fetch_incremental_accessibility_tree(info, client)
+        else:
+            return self.fetch_full_accessibility_tree(client)
+
+    def assign_stable_ids(
+        self, accessibility_tree: AccessibilityTree, client: CDPSession
+    ) -> AccessibilityTree:
+        """Replace the accessibility node ids, which change between the
+        fetches, with short ids numbered by the backend DOM node ids in the
+        order they are first seen on the page. The nodes that are no longer
+        in the tree are forgotten."""
+        table = self.stable_id_tables.setdefault(client, StableIdTable())
+        ids: dict[tuple[int | str, ...], str] = {}
+        stable_ids: dict[str, str] = {}
+        for node in accessibility_tree:
+            key: tuple[int | str, ...]
+            if "backendDOMNodeId" in node:
+                role = str(node.get("role", {}).get("value", ""))
+                key = (node["backendDOMNodeId"], role, 0)
+                # the nodes sharing a DOM node and a role, in tree order
+                while key in ids:
+                    key = (key[0], role, int(key[2]) + 1)
+            else:
+                # the few nodes without a DOM node keep their accessibility id
+                key = ("ax", node["nodeId"])
+            if key in table.ids:
+                ids[key] = table.ids[key]
+            elif key not in ids:
+                ids[key] = str(table.next_id)
+                table.next_id += 1
+            stable_ids[node["nodeId"]] = ids[key]
+        table.ids = ids
+
+        # copies, the caches of the other modes keep the original ids
+        stable_tree = []
+        for node in accessibility_tree:
+            stable_node = dict(node)
+            stable_node["nodeId"] = stable_ids[node["nodeId"]]
+            stable_node["childIds"] = [
+                stable_ids[child_id]
+                for child_id in node["childIds"]
+                if child_id in stable_ids
+            ]
+            if node.get("parentId") in stable_ids:
+                stable_node["parentId"] = stable_ids[node["parentId"]]
+            else:
+                stable_node.pop("parentId", None)
+            stable_tree.append(stable_node)
+        return cast(AccessibilityTree, stable_tree)
+
+    def filter_viewport_accessibility_tree(
+        self,
+        accessibility_tree: AccessibilityTree,
+        union_bounds: list[list[float] | None],
+        config: BrowserConfig,
+        current_viewport_only: bool,
+    ) -> AccessibilityTree:
+        """Set the bounds on the tree and filter the nodes that are not in
+        the current viewport"""
+        for node, union_bound in zip(accessibility_tree, union_bounds):
+            node["union_bound"] = union_bound
+        return self.filter_viewport_nodes(
+            accessibility_tree, config, current_viewport_only
+        )
+
+    @staticmethod
+    def iter_accessibility_tree(
+        accessibility_tree: AccessibilityTree,
+    ) -> Iterator[tuple[str, str, dict[str, Any] | None]]:
+        """Yield the (obs node id, line, node info) of the accessibility
+        tree in depth first order, the traversal is lazy and can be stopped
+        at any line"""
+        node_id_to_idx = {}
+        for idx, node in enumerate(accessibility_tree):
+            node_id_to_idx[node["nodeId"]] = idx
+
+        # depth first traversal with an explicit stack, deeply nested pages
+        # would hit the recursion limit
+        stack = [(0, accessibility_tree[0]["nodeId"], 0)]
+        while stack:
+            idx, obs_node_id, depth = stack.pop()
+            node = accessibility_tree[idx]
+            indent = "\t" * depth
+            valid_node = True
+            try:
+                role = node["role"]["value"]
+                name = node["name"]["value"]
+                node_str = f"[{obs_node_id}] {role} {repr(name)}"
+                properties = []
+                for property in node.get("properties", []):
+                    try:
+                        if property["name"] in IGNORED_ACTREE_PROPERTIES:
+                            continue
+                        properties.append(
+                            f'{property["name"]}: {property["value"]["value"]}'
+                        )
+                    except KeyError:
+                        pass
+
+                if properties:
+                    node_str += " " + " ".join(properties)
+
+                # check valid
+                if not node_str.strip():
+                    valid_node = False
+
+                # empty generic node
                 if not name.strip():
                     if not properties:
                         if role in [
@@ -529,115 +1677,265 @@ class TextObervationProcessor(ObservationProcessor):
                         valid_node = False
 
                 if valid_node:
-                    tree_str += f"{indent}{node_str}"
-                    obs_nodes_info[obs_node_id] = {
-                        "backend_id": node["backendDOMNodeId"],
-                        "union_bound": node["union_bound"],
-                        "text": node_str,
-                    }
+                    node_info = None
+                    try:
+                        node_info = {
+                            "backend_id": node["backendDOMNodeId"],
+                            "union_bound": node["union_bound"],
+                            "in_viewport_ratio": node.get("in_viewport_ratio"),
+                            "text": node_str,
+                        }
+                    except Exception:
+                        # the line is kept but its children are not indented
+                        valid_node = False
+                    yield obs_node_id, f"{indent}{node_str}", node_info
 
             except Exception as e:
                 valid_node = False
 
-            for _, child_node_id in enumerate(node["childIds"]):
+            # mark this to save some tokens
+            child_depth = depth + 1 if valid_node else depth
+            for child_node_id in reversed(node["childIds"]):
                 if child_node_id not in node_id_to_idx:
                     continue
-                # mark this to save some tokens
-                child_depth = depth + 1 if valid_node else depth
-                child_str = dfs(
-                    node_id_to_idx[child_node_id], child_node_id, child_depth
+                stack.append(
+                    (node_id_to_idx[child_node_id], child_node_id, child_depth)
                 )
-                if child_str.strip():
-                    if tree_str.strip():
-                        tree_str += "\n"
-                    tree_str += child_str
 
-            return tree_str
+    @classmethod
+    def parse_accessibility_tree(
+        cls,
+        accessibility_tree: AccessibilityTree,
+    ) -> tuple[str, dict[str, Any]]:
+        """Parse the accessibility tree into a string text"""
+        obs_nodes_info = {}
+        lines: list[str] = []
+        for obs_node_id, line, node_info in cls.iter_accessibility_tree(
+            accessibility_tree
+        ):
+            lines.append(line)
+            if node_info is not None:
+                obs_nodes_info[obs_node_id] = node_info
+
+        # the lines of the nodes are joined once
+        tree_str = "\n".join(lines)
+        return tree_str, obs_nodes_info
+
+    @classmethod
+    def parse_accessibility_tree_with_budget(
+        cls,
+        accessibility_tree: AccessibilityTree,
+        budget: int,
+        count: Callable[[str], int] = len,
+    ) -> tuple[str, dict[str, Any]]:
+        """Parse and clean the accessibility tree until the text reaches
+        the budget, the nodes after the cutoff are never visited"""
+        obs_nodes_info = {}
 
-        tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
+        def iter_lines() -> Iterator[str]:
+            for obs_node_id, line, node_info in cls.iter_accessibility_tree(
+                accessibility_tree
+            ):
+                if node_info is not None:
+                    obs_nodes_info[obs_node_id] = node_info
+                # names can contain new lines, clean works on the split lines
+                yield from line.split("\n")
+
+        lines = cls.take_lines_with_budget(
+            cls.iter_clean_accessibility_tree(iter_lines()),
+            budget,
+            count=lambda line: count(f"{line}\n"),
+        )
+        tree_str = "\n".join(lines)
         return tree_str, obs_nodes_info
 
     @staticmethod
-    def clean_accesibility_tree(tree_str: str) -> str:
-        """further clean accesibility tree"""
-        clean_lines: list[str] = []
-        for line in tree_str.split("\n"):
+    def take_lines_with_budget(
+        lines: Iterator[str],
+        budget: int,
+        count: Callable[[str], int] = len,
+    ) -> list[str]:
+        """Take lines until the budget is used up, the line crossing the
+        budget is kept so a later truncation sees the same prefix"""
+        taken: list[str] = []
+        used = 0
+        while used < budget:
+            line = next(lines, None)
+            if line is None:
+                break
+            taken.append(line)
+            used += count(line)
+        return taken
+
+    @staticmethod
+    def iter_clean_accessibility_tree(lines: Iterable[str]) -> Iterator[str]:
+        """Yield the lines kept by `clean_accesibility_tree`"""
+        # the last three kept lines, unrolled as the check runs per line
+        prev_line_1 = prev_line_2 = prev_line_3 = ""
+        for line in lines:
             # remove statictext if the content already appears in the previous line
             if "statictext" in line.lower():
-                prev_lines = clean_lines[-3:]
-                pattern = r"\[\d+\] StaticText (.+)"
-
-                match = re.search(pattern, line, re.DOTALL)
-                if match:
-                    static_text = match.group(1)[1:-1]  # remove the quotes
-                    if static_text and all(
-                        static_text not in prev_line
-                        for prev_line in prev_lines
-                    ):
-                        clean_lines.append(line)
-            else:
-                clean_lines.append(line)
+                match = STATIC_TEXT_PATTERN.search(line)
+                if not match:
+                    continue
+                static_text = match.group(1)[1:-1]  # remove the quotes
+                if (
+                    not static_text
+                    or static_text in prev_line_1
+                    or static_text in prev_line_2
+                    or static_text in prev_line_3
+                ):
+                    continue
+            prev_line_1, prev_line_2, prev_line_3 = (
+                prev_line_2,
+                prev_line_3,
+                line,
+            )
+            yield line
 
+    @classmethod
+    def clean_accesibility_tree(cls, tree_str: str) -> str:
+        """further clean accesibility tree"""
+        clean_lines = cls.iter_clean_accessibility_tree(tree_str.split("\n"))
         return "\n".join(clean_lines)
 
-    def process(self, page: Page, client: CDPSession) -> str:
-        # get the tab info
-        open_tabs = page.context.pages
-        try:
-            tab_titles = [tab.title() for tab in open_tabs]
-            current_tab_idx = open_tabs.index(page)
-            for idx in range(len(open_tabs)):
-                if idx == current_tab_idx:
-                    tab_titles[
-                        idx
-                    ] = f"Tab {idx} (current): {open_tabs[idx].title()}"
-                else:
-                    tab_titles[idx] = f"Tab {idx}: {open_tabs[idx].title()}"
-            tab_title_str = " | ".join(tab_titles)
-        except Exception:
-            tab_title_str = " | ".join(
-                ["Tab {idx}" for idx in range(len(open_tabs))]
-            )
+    def get_tab_title(self, tab: Page) -> str:
+        """Title of a non current tab, cached until the tab navigates"""
+        if tab not in self.watched_tabs:
+            tab.on("framenavigated", self.on_tab_navigated)
+            tab.on("load", self.on_tab_load)
+            self.watched_tabs.add(tab)
+        if tab not in self.tab_titles:
+            self.tab_titles[tab] = tab.title()
+        return self.tab_titles[tab]
+
+    def on_tab_navigated(self, frame: Frame | AFrame) -> None:
+        if frame.parent_frame is None:
+            self.tab_titles.pop(frame.page, None)
+
+    def on_tab_load(self, tab: Page | APage) -> None:
+        self.tab_titles.pop(tab, None)
 
+    def process(self, page: Page, client: CDPSession) -> str:
         try:
             browser_info = self.fetch_browser_info(page, client)
         except Exception:
             page.wait_for_load_state("load", timeout=500)
             browser_info = self.fetch_browser_info(page, client)
 
+        # get the tab info, the current title comes with the browser info
+        with self.profile_stage("tab_titles"):
+            open_tabs = page.context.pages
+            try:
+                current_tab_idx = open_tabs.index(page)
+                tab_titles = [
+                    browser_info["title"]
+                    if idx == current_tab_idx
+                    else self.get_tab_title(tab)
+                    for idx, tab in enumerate(open_tabs)
+                ]
+                tab_title_str = self.format_tab_titles(
+                    tab_titles, current_tab_idx
+                )
+            except Exception:
+                tab_title_str = " | ".join(
+                    ["Tab {idx}" for idx in range(len(open_tabs))]
+                )
+            self.prune_tab_titles(page, open_tabs)
+
         if self.observation_type == "html":
-            dom_tree = self.fetch_page_html(
+            tree: DOMTree | AccessibilityTree = self.fetch_page_html(
                 browser_info,
                 page,
                 client,
                 current_viewport_only=self.current_viewport_only,
             )
-            content, obs_nodes_info = self.parse_html(dom_tree)
-            self.obs_nodes_info = obs_nodes_info
-            self.meta_data["obs_nodes_info"] = obs_nodes_info
-
         elif self.observation_type == "accessibility_tree":
-            accessibility_tree = self.fetch_page_accessibility_tree(
+            tree = self.fetch_page_accessibility_tree(
                 browser_info,
                 client,
                 current_viewport_only=self.current_viewport_only,
             )
-            content, obs_nodes_info = self.parse_accessibility_tree(
-                accessibility_tree
-            )
-            content = self.clean_accesibility_tree(content)
-            self.obs_nodes_info = obs_nodes_info
-            self.meta_data["obs_nodes_info"] = obs_nodes_info
-
         else:
             raise ValueError(
                 f"Invalid observatrion type: {self.observation_type}"
             )
+        with self.profile_stage("serialize"):
+            return self.serialize_observation(
+                tree, browser_info, tab_title_str
+            )
+
+    @staticmethod
+    def format_tab_titles(tab_titles: list[str], current_tab_idx: int) -> str:
+        return " | ".join(
+            f"Tab {idx} (current): {title}"
+            if idx == current_tab_idx
+            else f"Tab {idx}: {title}"
+            for idx, title in enumerate(tab_titles)
+        )
+
+    def prune_tab_titles(
+        self,
+        page: Page | APage,
+        open_tabs: Sequence[Page] | Sequence[APage],
+    ) -> None:
+        # the current tab can change without navigating, closed tabs are gone
+        self.tab_titles = {
+            tab: title
+            for tab, title in self.tab_titles.items()
+            if tab != page and tab in open_tabs
+        }
+        self.watched_tabs.intersection_update(open_tabs)
+
+    def serialize_observation(
+        self,
+        tree: DOMTree | AccessibilityTree,
+        browser_info: BrowserInfo,
+        tab_title_str: str,
+    ) -> str:
+        """Serialize the fetched tree and store its meta data"""
+        if self.observation_type == "html":
+            dom_tree = cast(DOMTree, tree)
+            if self.observation_budget:
+                content, obs_nodes_info = self.parse_html_with_budget(
+                    dom_tree,
+                    self.get_remaining_budget(tab_title_str),
+                    self.budget_counter,
+                )
+            else:
+                content, obs_nodes_info = self.parse_html(dom_tree)
+        else:
+            accessibility_tree = cast(AccessibilityTree, tree)
+            if self.observation_budget:
+                (
+                    content,
+                    obs_nodes_info,
+                ) = self.parse_accessibility_tree_with_budget(
+                    accessibility_tree,
+                    self.get_remaining_budget(tab_title_str),
+                    self.budget_counter,
+                )
+            else:
+                content, obs_nodes_info = self.parse_accessibility_tree(
+                    accessibility_tree
+                )
+                content = self.clean_accesibility_tree(content)
+        self.obs_nodes_info = obs_nodes_info
+        self.meta_data["obs_nodes_info"] = obs_nodes_info
+        self.meta_data["spatial_index"] = self.build_spatial_index(
+            obs_nodes_info, self.viewport_size
+        )
 
         self.browser_config = browser_info["config"]
         content = f"{tab_title_str}\n\n{content}"
         return content
 
+    def get_remaining_budget(self, tab_title_str: str) -> int:
+        """The budget left for the page content after the tab titles"""
+        return self.observation_budget - self.budget_counter(
+            f"{tab_title_str}\n\n"
+        )
+
     def get_element_center(self, element_id: str) -> tuple[float, float]:
         node_info = self.obs_nodes_info[element_id]
         node_bound = node_info["union_bound"]
@@ -649,19 +1947,154 @@ class TextObervationProcessor(ObservationProcessor):
             center_y / self.viewport_size["height"],
         )
 
+    @staticmethod
+    def build_spatial_index(
+        obs_nodes_info: dict[str, Any],
+        viewport_size: ViewportSize,
+        cell_size: int = SPATIAL_INDEX_CELL_SIZE,
+    ) -> SpatialIndex:
+        """The spatial index of the observed elements, the grid is built
+        on the first lookup"""
+        return SpatialIndex(
+            viewport_size["width"],
+            viewport_size["height"],
+            cell_size,
+            obs_nodes_info,
+        )
+
+    def get_element_at(self, left: float, top: float) -> str | None:
+        """The id of the innermost element at (left, top), fractions of
+        the viewport as in `get_element_center`, None if there is none"""
+        spatial_index = self.meta_data["spatial_index"]
+        if spatial_index is None:
+            return None
+        return spatial_index.get_element_at(left, top)
+
 
 class ImageObservationProcessor(ObservationProcessor):
-    def __init__(self, observation_type: str):
+    def __init__(
+        self,
+        observation_type: str,
+        screenshot_config: ScreenshotConfig | None = None,
+    ):
+        screenshot_config = screenshot_config or {}
+        mode = screenshot_config.get("mode", "playwright")
+        if mode not in SCREENSHOT_MODES:
+            raise ValueError(f"Invalid screenshot mode: {mode}")
+        if mode == "playwright" and set(screenshot_config) - {"mode"}:
+            raise ValueError(
+                "Screenshot format, quality, scale and clip require the cdp mode"
+            )
+        image_format = screenshot_config.get("format", "png")
+        if image_format not in SCREENSHOT_FORMATS:
+            raise ValueError(f"Invalid screenshot format: {image_format}")
+        if "quality" in screenshot_config and image_format == "png":
+            raise ValueError("Screenshot quality requires jpeg or webp")
+        if screenshot_config.get("scale", 1.0) <= 0:
+            raise ValueError("Screenshot scale must be positive")
+
         self.observation_type = observation_type
+        self.screenshot_config = screenshot_config
         self.observation_tag = "image"
         self.meta_data = create_empty_metadata()
 
+    @staticmethod
+    def capture_screenshot(
+        client: CDPSession, screenshot_config: ScreenshotConfig
+    ) -> bytes:
+        """Capture the viewport with Page.captureScreenshot"""
+        viewport = None
+        if ImageObservationProcessor.needs_layout_metrics(screenshot_config):
+            viewport = client.send("Page.getLayoutMetrics")[
+                "cssVisualViewport"
+            ]
+        params = ImageObservationProcessor.get_capture_screenshot_params(
+            screenshot_config, viewport
+        )
+        response = client.send("Page.captureScreenshot", params)
+        return base64.b64decode(response["data"])
+
+    @staticmethod
+    def needs_layout_metrics(screenshot_config: ScreenshotConfig) -> bool:
+        return (
+            "clip" in screenshot_config
+            or screenshot_config.get("scale", 1.0) != 1.0
+        )
+
+    @staticmethod
+    def get_capture_screenshot_params(
+        screenshot_config: ScreenshotConfig,
+        viewport: dict[str, Any] | None,
+    ) -> dict[str, Any]:
+        """The Page.captureScreenshot parameters, the viewport is the
+        cssVisualViewport of the layout metrics when a clip is needed"""
+        params: dict[str, Any] = {
+            "format": screenshot_config.get("format", "png")
+        }
+        if "quality" in screenshot_config:
+            params["quality"] = screenshot_config["quality"]
+
+        scale = screenshot_config.get("scale", 1.0)
+        if viewport is not None:
+            # the clip is in document coordinates
+            clip = screenshot_config.get(
+                "clip",
+                {
+                    "x": 0.0,
+                    "y": 0.0,
+                    "width": viewport["clientWidth"],
+                    "height": viewport["clientHeight"],
+                },
+            )
+            params["clip"] = {
+                "x": viewport["pageX"] + clip["x"],
+                "y": viewport["pageY"] + clip["y"],
+                "width": clip["width"],
+                "height": clip["height"],
+                "scale": scale,
+            }
+        return params
+
+    @staticmethod
+    def get_screenshot_shape(
+        screenshot_config: ScreenshotConfig, viewport_size: ViewportSize
+    ) -> tuple[int, int, int]:
+        """The (height, width, channel) of the screenshots, the clip is in
+        CSS pixels and the pages have a device scale factor of 1"""
+        scale = screenshot_config.get("scale", 1.0)
+        clip = screenshot_config.get(
+            "clip",
+            {
+                "x": 0.0,
+                "y": 0.0,
+                "width": viewport_size["width"],
+                "height": viewport_size["height"],
+            },
+        )
+        return (
+            round(clip["height"] * scale),
+            round(clip["width"] * scale),
+            3,
+        )
+
+    def take_screenshot(
+        self, page: Page, client: CDPSession
+    ) -> npt.NDArray[np.uint8]:
+        if self.screenshot_config.get("mode", "playwright") == "cdp":
+            screenshot = self.capture_screenshot(
+                client, self.screenshot_config
+            )
+        else:
+            screenshot = page.screenshot()
+        return png_bytes_to_numpy(screenshot)
+
     def process(self, page: Page, client: CDPSession) -> npt.NDArray[np.uint8]:
-        try:
-            screenshot = png_bytes_to_numpy(page.screenshot())
-        except:
-            page.wait_for_event("load")
-            screenshot = png_bytes_to_numpy(page.screenshot())
+        with self.profile_stage("screenshot"):
+            try:
+                screenshot = self.take_screenshot(page, client)
+            except:
+                page.wait_for_event("load")
+                screenshot = self.take_screenshot(page, client)
         return screenshot
 
 
@@ -675,15 +2108,52 @@ class ObservationHandler:
         image_observation_type: str,
         current_viewport_only: bool,
         viewport_size: ViewportSize,
+        bounds_mode: str = "per_node",
+        observation_budget: int = 0,
+        budget_counter: Callable[[str], int] | None = None,
+        capture_screenshot: bool = True,
+        screenshot_config: ScreenshotConfig | None = None,
+        incremental_observation: bool = False,
+        verify_incremental_observation: bool = False,
+        observation_cache: bool = False,
+        viewport_accessibility_fetch: bool = False,
+        scroll_observation_cache: bool = False,
+        profile_observation: bool = False,
+        stable_element_ids: bool = False,
     ) -> None:
         self.main_observation_type = main_observation_type
+        # text agents only need the screenshot for rendering
+        self.capture_screenshot = (
+            capture_screenshot or main_observation_type == "image"
+        )
         self.text_processor = TextObervationProcessor(
-            text_observation_type, current_viewport_only, viewport_size
+            text_observation_type,
+            current_viewport_only,
+            viewport_size,
+            bounds_mode=bounds_mode,
+            observation_budget=observation_budget,
+            budget_counter=budget_counter,
+            incremental=incremental_observation,
+            verify_incremental=verify_incremental_observation,
+            viewport_fetch=viewport_accessibility_fetch,
+            scroll_cache=scroll_observation_cache,
+            stable_ids=stable_element_ids,
         )
         self.image_processor = ImageObservationProcessor(
-            image_observation_type
+            image_observation_type, screenshot_config=screenshot_config
         )
         self.viewport_size = viewport_size
+        # reuse the text observation while the page fingerprint is the same
+        self.observation_cache = observation_cache
+        self.cached_observation: tuple[tuple[Any, ...], str] | None = None
+        self.observation_cache_stats: dict[str, int] = defaultdict(int)
+        # record the time and the CDP traffic of each stage in the meta data
+        self.profiler = ObservationProfiler() if profile_observation else None
+        self.text_processor.profiler = self.profiler
+        self.image_processor.profiler = self.profiler
+        self.profiled_clients: weakref.WeakKeyDictionary[
+            CDPSession, ProfiledCDPSession
+        ] = weakref.WeakKeyDictionary()
 
     def get_observation_space(self) -> spaces.Dict:
         text_space = spaces.Text(
@@ -692,17 +2162,16 @@ class ObservationHandler:
             charset=ASCII_CHARSET + FREQ_UNICODE_CHARSET,
         )
 
+        # Each position stores the RGB values. Note the swapped axes (height first).
+        image_shape = self.image_processor.get_screenshot_shape(
+            self.image_processor.screenshot_config, self.viewport_size
+        )
+        if not self.capture_screenshot:
+            # the image observation is empty
+            image_shape = (0, 0, 3)
         image_space = spaces.Box(
-            # Each position stores the RGB values. Note the swapped axes (height first).
-            np.zeros(
-                (self.viewport_size["height"], self.viewport_size["width"], 3),
-                dtype=np.uint8,
-            ),
-            np.ones(
-                (self.viewport_size["height"], self.viewport_size["width"], 3),
-                dtype=np.uint8,
-            )
-            * 255.0,
+            np.zeros(image_shape, dtype=np.uint8),
+            np.ones(image_shape, dtype=np.uint8) * 255.0,
             dtype=np.uint8,
         )
 
@@ -711,10 +2180,91 @@ class ObservationHandler:
     def get_observation(
         self, page: Page, client: CDPSession
     ) -> dict[str, Observation]:
-        text_obs = self.text_processor.process(page, client)
-        image_obs = self.image_processor.process(page, client)
+        if self.profiler is not None:
+            client = self.get_profiled_client(client)
+            self.profiler.pop_stages()
+
+        if self.observation_cache:
+            text_obs = self.get_cached_text_observation(page, client)
+        else:
+            text_obs = self.text_processor.process(page, client)
+        if self.profiler is not None:
+            self.text_processor.meta_data[
+                "profile"
+            ] = self.profiler.pop_stages()
+
+        if self.capture_screenshot:
+            image_obs = self.image_processor.process(page, client)
+        else:
+            image_obs = np.zeros((0, 0, 3), dtype=np.uint8)
+        if self.profiler is not None:
+            self.image_processor.meta_data[
+                "profile"
+            ] = self.profiler.pop_stages()
         return {"text": text_obs, "image": image_obs}
 
+    def get_profiled_client(self, client: CDPSession) -> CDPSession:
+        """The same wrapper for the lifetime of the session, the processors
+        keep state per session"""
+        assert self.profiler is not None
+        if client not in self.profiled_clients:
+            self.profiled_clients[client] = ProfiledCDPSession(
+                client, self.profiler
+            )
+        return cast(CDPSession, self.profiled_clients[client])
+
+    def get_page_fingerprint(self, page: Page) -> tuple[Any, ...]:
+        """A cheap key of the page state the text observation depends on"""
+        probe = page.evaluate(OBSERVATION_FINGERPRINT_PROBE)
+        return (
+            page,
+            page.url,
+            probe["documentId"],
+            probe["changeCount"],
+            probe["pageXOffset"],
+            probe["pageYOffset"],
+        )
+
+    def get_tabs_fingerprint(self, page: Page) -> tuple[Any, ...]:
+        # the cached titles of the other tabs are dropped when they navigate
+        return tuple(
+            (tab, tab.url, self.text_processor.tab_titles.get(tab))
+            for tab in page.context.pages
+        )
+
+    def get_cached_text_observation(
+        self, page: Page, client: CDPSession
+    ) -> str:
+        fingerprint: tuple[Any, ...] | None
+        try:
+            with self.text_processor.profile_stage("fingerprint"):
+                fingerprint = self.get_page_fingerprint(page)
+        except Exception:
+            # e.g., the page is navigating
+            fingerprint = None
+
+        if (
+            fingerprint is not None
+            and self.cached_observation is not None
+            and self.cached_observation[0]
+            == fingerprint + self.get_tabs_fingerprint(page)
+        ):
+            self.observation_cache_stats["hit"] += 1
+            # obs_nodes_info and the meta data are the ones of the cached step
+            return self.cached_observation[1]
+
+        self.observation_cache_stats["miss"] += 1
+        text_obs = self.text_processor.process(page, client)
+        if fingerprint is None:
+            self.cached_observation = None
+        else:
+            # the tab titles are refreshed by the processing
+            self.cached_observation = (
+                fingerprint + self.get_tabs_fingerprint(page),
+                text_obs,
+            )
+        return text_obs
+
     def get_observation_metadata(self) -> dict[str, ObservationMetadata]:
         return {
             "text": self.text_processor.meta_data,
@@ -730,3 +2280,311 @@ class ObservationHandler:
             return self.image_processor
         else:
             raise ValueError("Invalid main observation type")
+
+
+class AsyncTextObervationProcessor(TextObervationProcessor):
+    """`TextObervationProcessor` on the async playwright API, the
+    independent CDP calls (bounds, tab titles) are issued concurrently.
+
+    The incremental, viewport fetch and scroll cache modes are sync only.
+    """
+
+    def __init__(
+        self,
+        observation_type: str,
+        current_viewport_only: bool,
+        viewport_size: ViewportSize,
+        bounds_mode: str = "per_node",
+        observation_budget: int = 0,
+        budget_counter: Callable[[str], int] | None = None,
+    ):
+        super().__init__(
+            observation_type,
+            current_viewport_only,
+            viewport_size,
+            bounds_mode=bounds_mode,
+            observation_budget=observation_budget,
+            budget_counter=budget_counter,
+        )
+
+    async def afetch_dom_snapshot(self, client: ACDPSession) -> dict[str, Any]:
+        tree = await client.send(
+            "DOMSnapshot.captureSnapshot", DOM_SNAPSHOT_PARAMS
+        )
+        return self.calibrate_dom_snapshot(tree)
+
+    async def afetch_browser_info(
+        self,
+        page: APage,
+        client: ACDPSession,
+    ) -> BrowserInfo:
+        probe = page.evaluate(BROWSER_INFO_PROBE, False)
+        if self.needs_dom_snapshot:
+            tree, probe_result = await asyncio.gather(
+                self.afetch_dom_snapshot(client), probe
+            )
+        else:
+            tree, probe_result = {}, await probe
+        return self.make_browser_info(tree, probe_result)
+
+    @staticmethod
+    async def aget_bounding_client_rect(
+        client: ACDPSession, backend_node_id: str
+    ) -> dict[str, Any]:
+        try:
+            remote_object = await client.send(
+                "DOM.resolveNode", {"backendNodeId": int(backend_node_id)}
+            )
+            remote_object_id = remote_object["object"]["objectId"]
+            response = await client.send(
+                "Runtime.callFunctionOn",
+                {
+                    "objectId": remote_object_id,
+                    "functionDeclaration": BOUNDING_CLIENT_RECT_FUNCTION,
+                    "returnByValue": True,
+                },
+            )
+            return response
+        except Exception:
+            return {"result": {"subtype": "error"}}
+
+    async def afetch_page_html(
+        self,
+        info: BrowserInfo,
+        client: ACDPSession,
+        current_viewport_only: bool,
+    ) -> DOMTree:
+        dom_tree = self.build_dom_tree(info)
+        if self.bounds_mode != "batched":
+            nodes = [node for node in dom_tree if node["parentId"] != "-1"]
+            responses = await asyncio.gather(
+                *(
+                    self.aget_bounding_client_rect(
+                        client, node["backendNodeId"]
+                    )
+                    for node in nodes
+                )
+            )
+            for node, response in zip(nodes, responses):
+                node["union_bound"] = self.get_union_bound(response)
+        return self.filter_viewport_nodes(
+            dom_tree, info["config"], current_viewport_only
+        )
+
+    @staticmethod
+    async def afetch_full_accessibility_tree(
+        client: ACDPSession,
+    ) -> AccessibilityTree:
+        response = await client.send("Accessibility.getFullAXTree", {})
+        return TextObervationProcessor.dedup_accessibility_tree(
+            response["nodes"]
+        )
+
+    async def aget_accessibility_node_bound(
+        self,
+        node: AccessibilityTreeNode,
+        snapshot_rects: dict[int, list[float] | None],
+        client: ACDPSession,
+    ) -> list[float] | None:
+        if "backendDOMNodeId" not in node:
+            return None
+        backend_node_id = str(node["backendDOMNodeId"])
+        if node["role"]["value"] == "RootWebArea":
+            return [0.0, 0.0, 10.0, 10.0]
+        elif int(backend_node_id) in snapshot_rects:
+            return snapshot_rects[int(backend_node_id)]
+        else:
+            response = await self.aget_bounding_client_rect(
+                client, backend_node_id
+            )
+            return self.get_union_bound(response)
+
+    async def afetch_page_accessibility_tree(
+        self,
+        info: BrowserInfo,
+        client: ACDPSession,
+        current_viewport_only: bool,
+    ) -> AccessibilityTree:
+        accessibility_tree = await self.afetch_full_accessibility_tree(client)
+        snapshot_rects = (
+            self.get_snapshot_client_rects(info)
+            if self.bounds_mode == "batched"
+            else {}
+        )
+        union_bounds = await asyncio.gather(
+            *(
+                self.aget_accessibility_node_bound(
+                    node, snapshot_rects, client
+                )
+                for node in accessibility_tree
+            )
+        )
+        return self.filter_viewport_accessibility_tree(
+            accessibility_tree,
+            list(union_bounds),
+            info["config"],
+            current_viewport_only,
+        )
+
+    async def aget_tab_title(self, tab: APage) -> str:
+        """Title of a non current tab, cached until the tab navigates"""
+        if tab not in self.watched_tabs:
+            tab.on("framenavigated", self.on_tab_navigated)
+            tab.on("load", self.on_tab_load)
+            self.watched_tabs.add(tab)
+        if tab not in self.tab_titles:
+            self.tab_titles[tab] = await tab.title()
+        return self.tab_titles[tab]
+
+    async def aget_tab_title_str(
+        self, page: APage, open_tabs: list[APage], current_title: str
+    ) -> str:
+        try:
+            current_tab_idx = open_tabs.index(page)
+            tab_titles = list(
+                await asyncio.gather(
+                    *(
+                        self.aget_tab_title(tab)
+                        for idx, tab in enumerate(open_tabs)
+                        if idx != current_tab_idx
+                    )
+                )
+            )
+            tab_titles.insert(current_tab_idx, current_title)
+            return self.format_tab_titles(tab_titles, current_tab_idx)
+        except Exception:
+            return " | ".join(["Tab {idx}" for idx in range(len(open_tabs))])
+
+    async def aprocess(self, page: APage, client: ACDPSession) -> str:
+        try:
+            browser_info = await self.afetch_browser_info(page, client)
+        except Exception:
+            await page.wait_for_load_state("load", timeout=500)
+            browser_info = await self.afetch_browser_info(page, client)
+
+        if self.observation_type == "html":
+            fetch_tree: Awaitable[
+                DOMTree | AccessibilityTree
+            ] = self.afetch_page_html(
+                browser_info,
+                client,
+                current_viewport_only=self.current_viewport_only,
+            )
+        elif self.observation_type == "accessibility_tree":
+            fetch_tree = self.afetch_page_accessibility_tree(
+                browser_info,
+                client,
+                current_viewport_only=self.current_viewport_only,
+            )
+        else:
+            raise ValueError(
+                f"Invalid observatrion type: {self.observation_type}"
+            )
+
+        # the titles of the other tabs are fetched with the tree
+        open_tabs = page.context.pages
+        tab_title_str, tree = await asyncio.gather(
+            self.aget_tab_title_str(page, open_tabs, browser_info["title"]),
+            fetch_tree,
+        )
+        self.prune_tab_titles(page, open_tabs)
+        return self.serialize_observation(tree, browser_info, tab_title_str)
+
+
+class AsyncImageObservationProcessor(ImageObservationProcessor):
+    """`ImageObservationProcessor` on the async playwright API"""
+
+    @staticmethod
+    async def acapture_screenshot(
+        client: ACDPSession, screenshot_config: ScreenshotConfig
+    ) -> bytes:
+        viewport = None
+        if ImageObservationProcessor.needs_layout_metrics(screenshot_config):
+            viewport = (await client.send("Page.getLayoutMetrics"))[
+                "cssVisualViewport"
+            ]
+        params = ImageObservationProcessor.get_capture_screenshot_params(
+            screenshot_config, viewport
+        )
+        response = await client.send("Page.captureScreenshot", params)
+        return base64.b64decode(response["data"])
+
+    async def atake_screenshot(
+        self, page: APage, client: ACDPSession
+    ) -> npt.NDArray[np.uint8]:
+        if self.screenshot_config.get("mode", "playwright") == "cdp":
+            screenshot = await self.acapture_screenshot(
+                client, self.screenshot_config
+            )
+        else:
+            screenshot = await page.screenshot()
+        return png_bytes_to_numpy(screenshot)
+
+    async def aprocess(
+        self, page: APage, client: ACDPSession
+    ) -> npt.NDArray[np.uint8]:
+        try:
+            screenshot = await self.atake_screenshot(page, client)
+        except:
+            await page.wait_for_event("load")
+            screenshot = await self.atake_screenshot(page, client)
+        return screenshot
+
+
+class AsyncObservationHandler(ObservationHandler):
+    """`ObservationHandler` on the async playwright API, the text and the
+    image observations are processed concurrently"""
+
+    def __init__(
+        self,
+        main_observation_type: str,
+        text_observation_type: str,
+        image_observation_type: str,
+        current_viewport_only: bool,
+        viewport_size: ViewportSize,
+        bounds_mode: str = "per_node",
+        observation_budget: int = 0,
+        budget_counter: Callable[[str], int] | None = None,
+        capture_screenshot: bool = True,
+        screenshot_config: ScreenshotConfig | None = None,
+    ) -> None:
+        super().__init__(
+            main_observation_type,
+            text_observation_type,
+            image_observation_type,
+            current_viewport_only,
+            viewport_size,
+            bounds_mode=bounds_mode,
+            observation_budget=observation_budget,
+            budget_counter=budget_counter,
+            capture_screenshot=capture_screenshot,
+            screenshot_config=screenshot_config,
+        )
+        self.text_processor: AsyncTextObervationProcessor = (
+            AsyncTextObervationProcessor(
+                text_observation_type,
+                current_viewport_only,
+                viewport_size,
+                bounds_mode=bounds_mode,
+                observation_budget=observation_budget,
+                budget_counter=budget_counter,
+            )
+        )
+        self.image_processor: AsyncImageObservationProcessor = (
+            AsyncImageObservationProcessor(
+                image_observation_type, screenshot_config=screenshot_config
+            )
+        )
+
+    async def aget_observation(
+        self, page: APage, client: ACDPSession
+    ) -> dict[str, Observation]:
+        text_obs = self.text_processor.aprocess(page, client)
+        if self.capture_screenshot:
+            text_result, image_result = await asyncio.gather(
+                text_obs, self.image_processor.aprocess(page, client)
+            )
+        else:
+            text_result = await text_obs
+            image_result = np.zeros((0, 0, 3), dtype=np.uint8)
+        return {"text": text_result, "image": image_result}
@@ -1,20 +1,54 @@
-from dataclasses import dataclass
 from io import BytesIO
-from typing import Any, Dict, TypedDict, Union
+from typing import Any, Callable, Dict, TypedDict, Union
 
 import numpy as np
 import numpy.typing as npt
 from PIL import Image
+from playwright.sync_api import FloatRect
+
+
+def expired_content() -> str:
+    raise RuntimeError(
+        "The content of a lazy page is only available until the next step"
+    )
 
 
-@dataclass
 class DetachedPage:
-    url: str
-    content: str  # html
+    """The url and the html of a page. The html can be a loader instead,
+    called on the first access, until the environment moves on"""
+
+    def __init__(self, url: str, content: str | Callable[[], str]) -> None:
+        self.url = url
+        self._content = content
+
+    @property
+    def content(self) -> str:
+        if callable(self._content):
+            self._content = self._content()
+        return self._content
+
+    def expire(self) -> None:
+        """The page changed, the html can no longer be loaded"""
+        if callable(self._content):
+            self._content = expired_content
+
+    def __getstate__(self) -> dict[str, Any]:
+        # the loader holds the page, which cannot be pickled
+        if self._content is not expired_content:
+            self.content
+        return self.__dict__
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DetachedPage):
+            return NotImplemented
+        return self.url == other.url and self.content == other.content
+
+    def __repr__(self) -> str:
+        return f"DetachedPage(url={self.url!r})"
 
 
 def png_bytes_to_numpy(png: bytes) -> npt.NDArray[np.uint8]:
-    """Convert png bytes to numpy array
+    """Convert png bytes to numpy array, jpeg and webp bytes work as well
 
     Example:
 
@@ -38,6 +72,7 @@ class AccessibilityTreeNode(TypedDict):
     bound: list[float] | None
     union_bound: list[float] | None
     offsetrect_bound: list[float] | None
+    in_viewport_ratio: float | None
 
 
 class DOMNode(TypedDict):
@@ -51,6 +86,7 @@ class DOMNode(TypedDict):
     childIds: list[str]
     cursor: int
     union_bound: list[float] | None
+    in_viewport_ratio: float | None
 
 
 class BrowserConfig(TypedDict):
@@ -63,9 +99,24 @@ class BrowserConfig(TypedDict):
     device_pixel_ratio: float
 
 
+class ScreenshotConfig(TypedDict, total=False):
+    mode: str  # playwright or cdp
+    # the options below are only supported in the cdp mode
+    format: str  # png, jpeg or webp
+    quality: int  # [0, 100], jpeg and webp only
+    scale: float  # downscale factor of the screenshot
+    clip: FloatRect  # region of the viewport to capture
+
+
 class BrowserInfo(TypedDict):
     DOMTree: dict[str, Any]
     config: BrowserConfig
+    title: str  # title of the current tab
+    # identify the document and count its mutations, incremental and
+    # scroll cache modes only
+    document_id: str | None
+    mutation_count: int | None
+    layout_count: int | None
 
 
 AccessibilityTree = list[AccessibilityTreeNode]
@@ -0,0 +1,203 @@
+import asyncio
+from typing import Any, Sequence, cast
+
+import numpy as np
+import numpy.typing as npt
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+from playwright.async_api import async_playwright
+
+from .actions import Action
+from .async_envs import AsyncScriptBrowserEnv
+from .utils import Observation
+
+
+class VectorScriptBrowserEnv(VectorEnv[Any, Any, Any]):
+    """Drive `num_envs` independent tasks as separate contexts of one
+    browser. The envs are `AsyncScriptBrowserEnv`s stepped concurrently on
+    one event loop, the observations and the infos are batched.
+
+    The tasks do not terminate by themselves, a finished task is replaced
+    with `reset_env`.
+    """
+
+    metadata = {"autoreset_mode": AutoresetMode.DISABLED}
+
+    def __init__(
+        self,
+        num_envs: int,
+        headless: bool = True,
+        slow_mo: int = 0,
+        **env_kwargs: Any,
+    ) -> None:
+        self.num_envs = num_envs
+        self.headless = headless
+        self.slow_mo = slow_mo
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.alaunch_browser())
+        self.envs = [
+            AsyncScriptBrowserEnv(
+                headless=headless,
+                slow_mo=slow_mo,
+                browser=self.browser,
+                **env_kwargs,
+            )
+            for _ in range(num_envs)
+        ]
+
+        self.single_observation_space = self.envs[0].observation_space
+        self.observation_space = batch_space(
+            self.single_observation_space, num_envs
+        )
+        self.single_action_space = self.envs[0].action_space
+        self.action_space = batch_space(self.single_action_space, num_envs)
+
+    async def alaunch_browser(self) -> None:
+        self.context_manager = async_playwright()
+        self.playwright = await self.context_manager.__aenter__()
+        self.browser = await self.playwright.chromium.launch(
+            headless=self.headless, slow_mo=self.slow_mo
+        )
+
+    def batch_observations(
+        self, observations: Sequence[dict[str, Observation] | Observation]
+    ) -> Any:
+        """Stack the arrays, the texts are tuples as in `batch_space`"""
+        first = observations[0]
+        if isinstance(first, dict):
+            return {
+                key: self.batch_observations(
+                    [
+                        cast(dict[str, Observation], obs)[key]
+                        for obs in observations
+                    ]
+                )
+                for key in first
+            }
+        if isinstance(first, np.ndarray):
+            return np.stack(observations)  # type: ignore[arg-type]
+        return tuple(observations)
+
+    def batch_infos(self, infos: Sequence[dict[str, Any]]) -> dict[str, Any]:
+        vector_infos: dict[str, Any] = {}
+        for env_idx, info in enumerate(infos):
+            info = dict(info)
+            # keyed by the element ids, one dict per env
+            metadata = info.pop("observation_metadata", None)
+            vector_infos = self._add_info(vector_infos, info, env_idx)
+            if metadata is not None:
+                if "observation_metadata" not in vector_infos:
+                    vector_infos["observation_metadata"] = np.full(
+                        self.num_envs, None, dtype=object
+                    )
+                    vector_infos["_observation_metadata"] = np.zeros(
+                        self.num_envs, dtype=np.bool_
+                    )
+                vector_infos["observation_metadata"][env_idx] = metadata
+                vector_infos["_observation_metadata"][env_idx] = True
+        return vector_infos
+
+    async def areset(
+        self,
+        *,
+        seed: int | list[int] | None = None,
+        options: dict[str, Any] | None = None,
+    ) -> tuple[Any, dict[str, Any]]:
+        """Reset all the envs.
+        :param options: the options of the envs. The options are:
+            - config_files: one config file per env
+        """
+        if isinstance(seed, int):
+            seeds: list[int | None] = [
+                seed + idx for idx in range(self.num_envs)
+            ]
+        elif seed is None:
+            seeds = [None] * self.num_envs
+        else:
+            seeds = list(seed)
+        config_files = (options or {}).get(
+            "config_files", [None] * self.num_envs
+        )
+        if len(seeds) != self.num_envs or len(config_files) != self.num_envs:
+            raise ValueError("Expected one seed and config per env")
+
+        results = await asyncio.gather(
+            *(
+                env.areset(
+                    seed=env_seed,
+                    options=None
+                    if config_file is None
+                    else {"config_file": str(config_file)},
+                )
+                for env, env_seed, config_file in zip(
+                    self.envs, seeds, config_files
+                )
+            )
+        )
+        observations, infos = zip(*results)
+        return self.batch_observations(observations), self.batch_infos(infos)
+
+    def reset(
+        self,
+        *,
+        seed: int | list[int] | None = None,
+        options: dict[str, Any] | None = None,
+    ) -> tuple[Any, dict[str, Any]]:
+        return self.loop.run_until_complete(
+            self.areset(seed=seed, options=options)
+        )
+
+    def reset_env(
+        self,
+        env_idx: int,
+        *,
+        seed: int | None = None,
+        options: dict[str, str] | None = None,
+    ) -> tuple[Any, dict[str, Any]]:
+        """Start the next task in one env, the other envs are untouched"""
+        return self.loop.run_until_complete(
+            self.envs[env_idx].areset(seed=seed, options=options)
+        )
+
+    async def astep(
+        self, actions: Sequence[Action]
+    ) -> tuple[
+        Any,
+        npt.NDArray[np.float64],
+        npt.NDArray[np.bool_],
+        npt.NDArray[np.bool_],
+        dict[str, Any],
+    ]:
+        if len(actions) != self.num_envs:
+            raise ValueError(f"Expected {self.num_envs} actions")
+        results = await asyncio.gather(
+            *(env.astep(action) for env, action in zip(self.envs, actions))
+        )
+        observations, rewards, terminations, truncations, infos = zip(*results)
+        return (
+            self.batch_observations(observations),
+            np.array(rewards, dtype=np.float64),
+            np.array(terminations, dtype=np.bool_),
+            np.array(truncations, dtype=np.bool_),
+            self.batch_infos(infos),
+        )
+
+    def step(
+        self, actions: Sequence[Action]
+    ) -> tuple[
+        Any,
+        npt.NDArray[np.float64],
+        npt.NDArray[np.bool_],
+        npt.NDArray[np.bool_],
+        dict[str, Any],
+    ]:
+        return self.loop.run_until_complete(self.astep(actions))
+
+    async def aclose_extras(self) -> None:
+        await asyncio.gather(*(env.aclose() for env in self.envs))
+        await self.browser.close()
+        await self.context_manager.__aexit__()
+
+    def close_extras(self, **kwargs: Any) -> None:
+        self.loop.run_until_complete(self.aclose_extras())
+        self.loop.close()
@@ -33,6 +33,12 @@ from browser_env.helper_functions import (
     RenderHelper,
     get_action_description,
 )
+from browser_env.processors import (
+    ObservationMetadata,
+    StageProfile,
+    merge_stage_profiles,
+)
+from browser_env.utils import ScreenshotConfig
 from evaluation_harness import evaluator_router
 
 LOG_FOLDER = "log_files"
@@ -87,6 +93,92 @@ def config() -> argparse.Namespace:
     parser.add_argument("--viewport_height", type=int, default=720)
     parser.add_argument("--save_trace_enabled", action="store_true")
     parser.add_argument("--sleep_after_execution", type=float, default=0.0)
+    parser.add_argument(
+        "--settle_timeout",
+        type=float,
+        default=0.0,
+        help="wait until the page settles, at most this many seconds, instead of sleeping after each action",
+    )
+    parser.add_argument(
+        "--lazy_page_content",
+        action="store_true",
+        help="only serialize the html of the page in the step info when it is read",
+    )
+    parser.add_argument(
+        "--bounds_mode",
+        choices=["per_node", "batched"],
+        default="per_node",
+        help="How to get the element bounds, batched reads them from the DOM snapshot",
+    )
+    parser.add_argument(
+        "--screenshot_mode",
+        choices=["playwright", "cdp"],
+        default="playwright",
+    )
+    parser.add_argument(
+        "--screenshot_format",
+        choices=["png", "jpeg", "webp"],
+        default=None,
+        help="cdp screenshot mode only",
+    )
+    parser.add_argument(
+        "--screenshot_quality",
+        type=int,
+        default=None,
+        help="cdp screenshot mode with jpeg or webp only",
+    )
+    parser.add_argument(
+        "--screenshot_scale",
+        type=float,
+        default=None,
+        help="downscale factor of the screenshot, cdp screenshot mode only",
+    )
+    parser.add_argument(
+        "--incremental_observation",
+        action="store_true",
+        help="patch the accessibility tree of the previous step instead of fetching it again",
+    )
+    parser.add_argument(
+        "--verify_incremental_observation",
+        action="store_true",
+        help="compare every patched accessibility tree with a full fetch",
+    )
+    parser.add_argument(
+        "--observation_cache",
+        action="store_true",
+        help="reuse the text observation when the page did not change",
+    )
+    parser.add_argument(
+        "--viewport_accessibility_fetch",
+        action="store_true",
+        help="only fetch the accessibility subtrees in the viewport, needs --current_viewport_only",
+    )
+    parser.add_argument(
+        "--scroll_observation_cache",
+        action="store_true",
+        help="slice the accessibility tree of the previous step after a scroll",
+    )
+    parser.add_argument(
+        "--profile_observation",
+        action="store_true",
+        help="record the time and the CDP traffic of each observation stage",
+    )
+    parser.add_argument(
+        "--stable_element_ids",
+        action="store_true",
+        help="number the elements by their DOM nodes so the ids persist across steps",
+    )
+    parser.add_argument(
+        "--persistent_browser",
+        action="store_true",
+        help="keep the browser across tasks and only create a new context per task",
+    )
+    parser.add_argument(
+        "--context_pool_size",
+        type=int,
+        default=0,
+        help="contexts prepared for the next tasks, needs --persistent_browser",
+    )
 
     parser.add_argument("--max_steps", type=int, default=30)
 
@@ -131,6 +223,11 @@ def config() -> argparse.Namespace:
         help="when not zero, will truncate the observation to this length before feeding to the model",
         default=1920,
     )
+    parser.add_argument(
+        "--budget_observation",
+        action="store_true",
+        help="stop serializing the text observation once it reaches max_obs_length tokens",
+    )
     parser.add_argument(
         "--model_endpoint",
         help="huggingface model endpoint",
@@ -214,6 +311,57 @@ def early_stop(
     return False, ""
 
 
+def merge_observation_profile(
+    total: dict[str, StageProfile],
+    observation_metadata: dict[str, ObservationMetadata],
+) -> None:
+    for meta_data in observation_metadata.values():
+        merge_stage_profiles(total, meta_data["profile"])
+
+
+def log_observation_profile(
+    profile: dict[str, StageProfile], num_observations: int
+) -> None:
+    logger.info(f"[Observation profile]: {num_observations} observations")
+    for name, stage in sorted(
+        profile.items(), key=lambda item: item[1]["time"], reverse=True
+    ):
+        logger.info(
+            f"  {name}: {stage['time']:.3f}s, "
+            f"{stage['messages']} CDP messages, "
+            f"{stage['bytes'] / 1024:.1f} KiB"
+        )
+
+
+def renew_cookies(config_file: str) -> str:
+    """Renew the cookies of the task, return the config file pointing to
+    the renewed storage state"""
+    with open(config_file) as f:
+        _c = json.load(f)
+    if _c["storage_state"]:
+        cookie_file_name = os.path.basename(_c["storage_state"])
+        comb = get_site_comb_from_filepath(cookie_file_name)
+        temp_dir = tempfile.mkdtemp()
+        # subprocess to renew the cookie
+        subprocess.run(
+            [
+                "python",
+                "browser_env/auto_login.py",
+                "--auth_folder",
+                temp_dir,
+                "--site_list",
+                *comb,
+            ]
+        )
+        _c["storage_state"] = f"{temp_dir}/{cookie_file_name}"
+        assert os.path.exists(_c["storage_state"])
+        # update the config file
+        config_file = f"{temp_dir}/{os.path.basename(config_file)}"
+        with open(config_file, "w") as f:
+            json.dump(_c, f)
+    return config_file
+
+
 def test(
     args: argparse.Namespace,
     agent: Agent | PromptAgent | TeacherForcingAgent,
@@ -227,6 +375,26 @@ def test(
         "repeating_action": args.repeating_action_failure_th,
     }
 
+    # the prompt truncates the observation anyway, stop serializing early
+    observation_budget = 0
+    budget_counter = None
+    if (
+        args.budget_observation
+        and args.max_obs_length
+        and isinstance(agent, PromptAgent)
+    ):
+        tokenizer = agent.prompt_constructor.tokenizer
+        observation_budget = args.max_obs_length
+        budget_counter = lambda text: len(tokenizer.encode(text))
+
+    screenshot_config: ScreenshotConfig = {"mode": args.screenshot_mode}
+    if args.screenshot_format is not None:
+        screenshot_config["format"] = args.screenshot_format
+    if args.screenshot_quality is not None:
+        screenshot_config["quality"] = args.screenshot_quality
+    if args.screenshot_scale is not None:
+        screenshot_config["scale"] = args.screenshot_scale
+
     env = ScriptBrowserEnv(
         headless=not args.render,
         slow_mo=args.slow_mo,
@@ -238,9 +406,29 @@ def test(
         },
         save_trace_enabled=args.save_trace_enabled,
         sleep_after_execution=args.sleep_after_execution,
+        settle_timeout=args.settle_timeout,
+        lazy_page_content=args.lazy_page_content,
+        bounds_mode=args.bounds_mode,
+        observation_budget=observation_budget,
+        budget_counter=budget_counter,
+        # the screenshot is only used for rendering in text observations
+        capture_screenshot=args.render_screenshot
+        or args.observation_type == "image",
+        screenshot_config=screenshot_config,
+        incremental_observation=args.incremental_observation,
+        verify_incremental_observation=args.verify_incremental_observation,
+        observation_cache=args.observation_cache,
+        viewport_accessibility_fetch=args.viewport_accessibility_fetch,
+        scroll_observation_cache=args.scroll_observation_cache,
+        profile_observation=args.profile_observation,
+        stable_element_ids=args.stable_element_ids,
+        persistent_browser=args.persistent_browser,
+        context_pool_size=args.context_pool_size,
     )
 
-    for config_file in config_file_list:
+    # original config file -> config file with the renewed cookies
+    logged_in_config_files: dict[str, str] = {}
+    for config_idx, config_file in enumerate(config_file_list):
         try:
             render_helper = RenderHelper(
                 config_file, args.result_dir, args.action_set_tag
@@ -251,28 +439,11 @@ def test(
                 _c = json.load(f)
                 intent = _c["intent"]
                 task_id = _c["task_id"]
-                # automatically login
-                if _c["storage_state"]:
-                    cookie_file_name = os.path.basename(_c["storage_state"])
-                    comb = get_site_comb_from_filepath(cookie_file_name)
-                    temp_dir = tempfile.mkdtemp()
-                    # subprocess to renew the cookie
-                    subprocess.run(
-                        [
-                            "python",
-                            "browser_env/auto_login.py",
-                            "--auth_folder",
-                            temp_dir,
-                            "--site_list",
-                            *comb,
-                        ]
-                    )
-                    _c["storage_state"] = f"{temp_dir}/{cookie_file_name}"
-                    assert os.path.exists(_c["storage_state"])
-                    # update the config file
-                    config_file = f"{temp_dir}/{os.path.basename(config_file)}"
-                    with open(config_file, "w") as f:
-                        json.dump(_c, f)
+            # automatically login, unless done while the previous task ran
+            if config_file in logged_in_config_files:
+                config_file = logged_in_config_files.pop(config_file)
+            else:
+                config_file = renew_cookies(config_file)
 
             logger.info(f"[Config file]: {config_file}")
             logger.info(f"[Intent]: {intent}")
@@ -280,8 +451,25 @@ def test(
             agent.reset(config_file)
             trajectory: Trajectory = []
             obs, info = env.reset(options={"config_file": config_file})
+            logger.info(f"[Reset latency]: {info['reset_latency']:.2f}s")
+            # the context of the next task is prepared while this one runs
+            if args.context_pool_size and config_idx + 1 < len(
+                config_file_list
+            ):
+                next_config_file = config_file_list[config_idx + 1]
+                logged_in_config_files[next_config_file] = renew_cookies(
+                    next_config_file
+                )
+                env.prewarm(Path(logged_in_config_files[next_config_file]))
             state_info: StateInfo = {"observation": obs, "info": info}
             trajectory.append(state_info)
+            # aggregated over the observations of the task
+            observation_profile: dict[str, StageProfile] = {}
+            merge_observation_profile(
+                observation_profile, info["observation_metadata"]
+            )
+            num_observations = 1
+            settle_time = info["settle_time"]
 
             meta_data = {"action_history": ["None"]}
             while True:
@@ -321,6 +509,11 @@ def test(
                 obs, _, terminated, _, info = env.step(action)
                 state_info = {"observation": obs, "info": info}
                 trajectory.append(state_info)
+                merge_observation_profile(
+                    observation_profile, info["observation_metadata"]
+                )
+                num_observations += 1
+                settle_time += info["settle_time"]
 
                 if terminated:
                     # add a action place holder
@@ -337,6 +530,14 @@ def test(
 
             scores.append(score)
 
+            if args.profile_observation:
+                log_observation_profile(observation_profile, num_observations)
+            if args.settle_timeout:
+                logger.info(
+                    f"[Settle time]: {settle_time:.2f}s over "
+                    f"{num_observations} observations"
+                )
+
             if score == 1:
                 logger.info(f"[Result] (PASS) {config_file}")
             else:
@@ -413,7 +614,8 @@ def dump_config(args: argparse.Namespace) -> None:
 
 if __name__ == "__main__":
     args = config()
-    args.sleep_after_execution = 2.0
+    if not args.settle_timeout:
+        args.sleep_after_execution = 2.0
     prepare(args)
 
     test_file_list = []
@@ -0,0 +1,536 @@
+"""Benchmark the observation processing on synthetic pages.
+The previous implementations are kept here as the reference,
+every run also checks that the outputs are the same."""
+import argparse
+import copy
+import gc
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+# run as `python scripts/benchmark_processors.py` from anywhere
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from browser_env.constants import IGNORED_ACTREE_PROPERTIES
+from browser_env.processors import (
+    IN_VIEWPORT_RATIO_THRESHOLD,
+    TextObervationProcessor,
+)
+from browser_env.utils import AccessibilityTree, BrowserConfig, DOMTree
+
+VIEWPORT_SIZE = {"width": 1280, "height": 720}
+CONFIG: BrowserConfig = {
+    "win_top_bound": 0.0,
+    "win_left_bound": 0.0,
+    "win_width": 1280.0,
+    "win_height": 720.0,
+    "win_right_bound": 1280.0,
+    "win_lower_bound": 720.0,
+    "device_pixel_ratio": 1.0,
+}
+
+
+def make_accessibility_tree(
+    num_nodes: int, shape: str = "listing", seed: int = 0
+) -> AccessibilityTree:
+    """Make a synthetic page.
+    listing: a long product or issue list, each item has a link and a few
+    texts, stacked vertically.
+    grid: a single container whose visible cells are interleaved with
+    hidden overlays, the worst case of splicing children into the parent.
+    nested: deeply nested blocks, e.g., threaded comments or diff views."""
+    rng = random.Random(seed)
+    tree: list[dict[str, Any]] = []
+
+    def add_node(
+        role: str,
+        name: str,
+        parent: dict[str, Any] | None,
+        bound: list[float] | None,
+    ) -> dict[str, Any]:
+        node: dict[str, Any] = {
+            "nodeId": str(len(tree) + 1),
+            "ignored": False,
+            "role": {"type": "role", "value": role},
+            "name": {"type": "computedString", "value": name},
+            "properties": [],
+            "childIds": [],
+            "union_bound": bound,
+        }
+        # nodes without a DOM node, e.g., ignored nodes
+        if bound is not None or rng.random() < 0.5:
+            node["backendDOMNodeId"] = len(tree) + 100
+        if parent is not None:
+            node["parentId"] = parent["nodeId"]
+            parent["childIds"].append(node["nodeId"])
+        tree.append(node)
+        return node
+
+    root = add_node("RootWebArea", "Listing", None, [0.0, 0.0, 10.0, 10.0])
+    if shape == "grid":
+        grid = add_node("grid", "", root, [0.0, 0.0, 1280.0, 720.0])
+        while len(tree) < num_nodes:
+            cell = add_node("gridcell", "", grid, [0.0, 0.0, 64.0, 36.0])
+            overlay = add_node("generic", "", grid, [0.0, 0.0, 0.0, 0.0])
+            add_node("StaticText", "Quick view", overlay, [0, 0, 60, 20])
+            add_node("StaticText", f"{len(tree)}", cell, [0, 0, 20, 20])
+        return tree  # type: ignore[return-value]
+
+    if shape == "nested":
+        while len(tree) < num_nodes:
+            parent = root
+            for depth in range(500):
+                parent = add_node("generic", "", parent, [0, 0, 600, 20])
+                add_node(
+                    "StaticText", f"Reply {depth}", parent, [0, 0, 60, 20]
+                )
+        return tree  # type: ignore[return-value]
+
+    y = 0.0
+    while len(tree) < num_nodes:
+        section = add_node("list", "", root, [0.0, y, 1280.0, 0.0])
+        for _ in range(rng.randint(1000, 5000)):
+            item = add_node("listitem", "", section, [8.0, y, 1264.0, 40.0])
+            link = add_node(
+                "link", f"Item {len(tree)}", item, [16.0, y, 400.0, 20.0]
+            )
+            add_node(
+                "StaticText", f"Item {len(tree) - 1}", link, [16, y, 90, 20]
+            )
+            add_node("StaticText", f"${rng.random() * 100:.2f}", item, None)
+            if rng.random() < 0.3:
+                # hidden actions
+                menu = add_node("menu", "", item, [0.0, 0.0, 0.0, 0.0])
+                add_node("menuitem", "Add to Cart", menu, [0, 0, 0, 0])
+            y += 40.0
+        section["union_bound"][3] = y - section["union_bound"][1]
+    return tree  # type: ignore[return-value]
+
+
+def make_dom_tree(num_nodes: int, shape: str = "listing") -> DOMTree:
+    """Make the DOM tree of a synthetic page, see `make_accessibility_tree`"""
+    accessibility_tree = make_accessibility_tree(num_nodes, shape)
+    nodeid_to_cursor = {
+        node["nodeId"]: cursor
+        for cursor, node in enumerate(accessibility_tree)
+    }
+    dom_tree: DOMTree = []
+    for cursor, node in enumerate(accessibility_tree):
+        role = node["role"]["value"]
+        name = node["name"]["value"]
+        dom_tree.append(
+            {
+                "nodeId": str(cursor),
+                "nodeType": "generic",
+                "nodeName": "#text" if role == "StaticText" else "div",
+                "nodeValue": name if role == "StaticText" else "",
+                "attributes": f'role="{role}"' if name else "",
+                "backendNodeId": str(cursor + 100),
+                "parentId": str(
+                    nodeid_to_cursor.get(node.get("parentId", ""), -1)
+                ),
+                "childIds": [
+                    str(nodeid_to_cursor[child_id])
+                    for child_id in node["childIds"]
+                ],
+                "cursor": 0,
+                "union_bound": node["union_bound"],
+                "in_viewport_ratio": None,
+            }
+        )
+    return dom_tree
+
+
+def get_keep(
+    accessibility_tree: AccessibilityTree, config: BrowserConfig
+) -> list[bool]:
+    in_viewport = TextObervationProcessor.set_in_viewport_ratio(
+        accessibility_tree, config
+    )
+    return in_viewport.tolist()  # type: ignore[no-any-return]
+
+
+def legacy_get_keep(
+    accessibility_tree: AccessibilityTree, config: BrowserConfig
+) -> list[bool]:
+    """The per node viewport check before it was vectorized"""
+    keep = []
+    for node in accessibility_tree:
+        if not node["union_bound"]:
+            keep.append(False)
+            continue
+        [x, y, width, height] = node["union_bound"]
+        if width == 0 or height == 0:
+            keep.append(False)
+            continue
+        ratio = TextObervationProcessor.get_element_in_viewport_ratio(
+            float(x), float(y), float(width), float(height), config
+        )
+        keep.append(ratio >= IN_VIEWPORT_RATIO_THRESHOLD)
+    return keep
+
+
+def legacy_remove_nodes(
+    accessibility_tree: AccessibilityTree, keep: list[bool]
+) -> AccessibilityTree:
+    """The pruning before it was linear-time"""
+    nodeid_to_cursor = {}
+    for cursor, node in enumerate(accessibility_tree):
+        nodeid_to_cursor[node["nodeId"]] = cursor
+
+    def remove_node_in_graph(node: Any) -> None:
+        nodeid = node["nodeId"]
+        node_cursor = nodeid_to_cursor[nodeid]
+        parent_nodeid = node["parentId"]
+        children_nodeids = node["childIds"]
+        parent_cursor = nodeid_to_cursor[parent_nodeid]
+        index = accessibility_tree[parent_cursor]["childIds"].index(nodeid)
+        accessibility_tree[parent_cursor]["childIds"].pop(index)
+        for child_nodeid in children_nodeids:
+            accessibility_tree[parent_cursor]["childIds"].insert(
+                index, child_nodeid
+            )
+            index += 1
+        for child_nodeid in children_nodeids:
+            child_cursor = nodeid_to_cursor[child_nodeid]
+            accessibility_tree[child_cursor]["parentId"] = parent_nodeid
+        accessibility_tree[node_cursor]["parentId"] = "[REMOVED]"
+
+    for cursor, node in enumerate(accessibility_tree):
+        if not keep[cursor]:
+            remove_node_in_graph(node)
+
+    return [
+        node
+        for node in accessibility_tree
+        if node.get("parentId", "Root") != "[REMOVED]"
+    ]
+
+
+def legacy_parse_accessibility_tree(
+    accessibility_tree: AccessibilityTree,
+) -> tuple[str, dict[str, Any]]:
+    """The recursive serializer before it used an explicit stack"""
+    node_id_to_idx = {}
+    for idx, node in enumerate(accessibility_tree):
+        node_id_to_idx[node["nodeId"]] = idx
+
+    obs_nodes_info = {}
+
+    def dfs(idx: int, obs_node_id: str, depth: int) -> str:
+        tree_str = ""
+        node = accessibility_tree[idx]
+        indent = "\t" * depth
+        valid_node = True
+        try:
+            role = node["role"]["value"]
+            name = node["name"]["value"]
+            node_str = f"[{obs_node_id}] {role} {repr(name)}"
+            properties = []
+            for property in node.get("properties", []):
+                try:
+                    if property["name"] in IGNORED_ACTREE_PROPERTIES:
+                        continue
+                    properties.append(
+                        f'{property["name"]}: {property["value"]["value"]}'
+                    )
+                except KeyError:
+                    pass
+
+            if properties:
+                node_str += " " + " ".join(properties)
+
+            if not node_str.strip():
+                valid_node = False
+
+            if not name.strip():
+                if not properties:
+                    if role in [
+                        "generic",
+                        "img",
+                        "list",
+                        "strong",
+                        "paragraph",
+                        "banner",
+                        "navigation",
+                        "Section",
+                        "LabelText",
+                        "Legend",
+                        "listitem",
+                    ]:
+                        valid_node = False
+                elif role in ["listitem"]:
+                    valid_node = False
+
+            if valid_node:
+                tree_str += f"{indent}{node_str}"
+                obs_nodes_info[obs_node_id] = {
+                    "backend_id": node["backendDOMNodeId"],
+                    "union_bound": node["union_bound"],
+                    "in_viewport_ratio": node.get("in_viewport_ratio"),
+                    "text": node_str,
+                }
+
+        except Exception as e:
+            valid_node = False
+
+        for _, child_node_id in enumerate(node["childIds"]):
+            if child_node_id not in node_id_to_idx:
+                continue
+            child_depth = depth + 1 if valid_node else depth
+            child_str = dfs(
+                node_id_to_idx[child_node_id], child_node_id, child_depth
+            )
+            if child_str.strip():
+                if tree_str.strip():
+                    tree_str += "\n"
+                tree_str += child_str
+
+        return tree_str
+
+    tree_str = dfs(0, accessibility_tree[0]["nodeId"], 0)
+    return tree_str, obs_nodes_info
+
+
+def legacy_parse_html(dom_tree: DOMTree) -> tuple[str, dict[str, Any]]:
+    """The recursive serializer before it used an explicit stack"""
+    obs_nodes_info = {}
+    nodeid_to_cursor = {
+        node["nodeId"]: idx for idx, node in enumerate(dom_tree)
+    }
+
+    def dfs(node_cursor: int, depth: int) -> str:
+        tree_str = ""
+        node = dom_tree[node_cursor]
+        indent = "\t" * depth
+        valid_node = True
+        try:
+            node_str = f"[{node_cursor}] <{node['nodeName']}"
+            if node["attributes"]:
+                node_str += f" {node['attributes']}"
+            node_str += f"> {node['nodeValue']}"
+            valid_node = bool(node["attributes"] or node["nodeValue"])
+
+            if valid_node:
+                obs_nodes_info[str(node_cursor)] = {
+                    "backend_id": node["backendNodeId"],
+                    "union_bound": node["union_bound"],
+                    "in_viewport_ratio": node.get("in_viewport_ratio"),
+                    "text": node_str,
+                }
+                tree_str += f"{indent}{node_str}\n"
+
+        except Exception as e:
+            valid_node = False
+
+        for child_ids in node["childIds"]:
+            child_cursor = nodeid_to_cursor[child_ids]
+            child_depth = depth + 1 if valid_node else depth
+            child_str = dfs(child_cursor, child_depth)
+            tree_str += child_str
+
+        return tree_str
+
+    html = dfs(0, 0)
+    return html, obs_nodes_info
+
+
+def legacy_clean_accessibility_tree(tree_str: str) -> str:
+    clean_lines: list[str] = []
+    for line in tree_str.split("\n"):
+        # remove statictext if the content already appears in the previous line
+        if "statictext" in line.lower():
+            prev_lines = clean_lines[-3:]
+            pattern = r"\[\d+\] StaticText (.+)"
+
+            match = re.search(pattern, line, re.DOTALL)
+            if match:
+                static_text = match.group(1)[1:-1]  # remove the quotes
+                if static_text and all(
+                    static_text not in prev_line for prev_line in prev_lines
+                ):
+                    clean_lines.append(line)
+        else:
+            clean_lines.append(line)
+
+    return "\n".join(clean_lines)
+
+
+def timeit(fn: Callable[[], Any]) -> tuple[float, Any]:
+    # same as the timeit module, the garbage collector adds too much noise
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = fn()
+        return time.perf_counter() - start, result
+    finally:
+        gc.enable()
+
+
+def benchmark_prune(
+    sizes: list[int], shape: str, legacy_max_nodes: int
+) -> None:
+    print(f"{'nodes':>8} {'legacy (s)':>12} {'current (s)':>12}")
+    for size in sizes:
+        tree = make_accessibility_tree(size, shape)
+        keep = get_keep(tree, CONFIG)
+        cur_tree = copy.deepcopy(tree)
+        cur_time, cur_result = timeit(
+            lambda: TextObervationProcessor.remove_nodes_in_graph(
+                cur_tree, keep
+            )
+        )
+        legacy_str = "skipped"
+        if size <= legacy_max_nodes:
+            legacy_tree = copy.deepcopy(tree)
+            legacy_time, legacy_result = timeit(
+                lambda: legacy_remove_nodes(legacy_tree, keep)
+            )
+            assert cur_result == legacy_result, "Pruned trees differ"
+            legacy_str = f"{legacy_time:.4f}"
+        print(f"{size:>8} {legacy_str:>12} {cur_time:>12.4f}")
+
+
+def benchmark_viewport(sizes: list[int], shape: str) -> None:
+    print(f"{'nodes':>8} {'legacy (s)':>12} {'current (s)':>12}")
+    for size in sizes:
+        tree = make_accessibility_tree(size, shape)
+        cur_time, cur_result = timeit(lambda: get_keep(tree, CONFIG))
+        legacy_time, legacy_result = timeit(
+            lambda: legacy_get_keep(tree, CONFIG)
+        )
+        assert cur_result == legacy_result, "Viewport masks differ"
+        print(f"{size:>8} {legacy_time:>12.4f} {cur_time:>12.4f}")
+
+
+def benchmark_serialize(sizes: list[int], shape: str) -> None:
+    print(
+        f"{'nodes':>8} {'legacy actree (s)':>18} {'current actree (s)':>19}"
+        f" {'legacy html (s)':>16} {'current html (s)':>17}"
+    )
+    for size in sizes:
+        accessibility_tree = make_accessibility_tree(size, shape)
+        cur_ax_time, cur_ax_result = timeit(
+            lambda: TextObervationProcessor.parse_accessibility_tree(
+                accessibility_tree
+            )
+        )
+        legacy_ax_time, legacy_ax_result = timeit(
+            lambda: legacy_parse_accessibility_tree(accessibility_tree)
+        )
+        assert cur_ax_result == legacy_ax_result, "Accessibility trees differ"
+
+        dom_tree = make_dom_tree(size, shape)
+        cur_html_time, cur_html_result = timeit(
+            lambda: TextObervationProcessor.parse_html(dom_tree)
+        )
+        legacy_html_time, legacy_html_result = timeit(
+            lambda: legacy_parse_html(dom_tree)
+        )
+        assert cur_html_result == legacy_html_result, "HTML trees differ"
+        print(
+            f"{size:>8} {legacy_ax_time:>18.4f} {cur_ax_time:>19.4f}"
+            f" {legacy_html_time:>16.4f} {cur_html_time:>17.4f}"
+        )
+
+
+def benchmark_clean(sizes: list[int], shape: str) -> None:
+    print(f"{'nodes':>8} {'lines':>8} {'legacy (s)':>12} {'current (s)':>12}")
+    for size in sizes:
+        tree_str, _ = TextObervationProcessor.parse_accessibility_tree(
+            make_accessibility_tree(size, shape)
+        )
+        cur_time, cur_result = timeit(
+            lambda: TextObervationProcessor.clean_accesibility_tree(tree_str)
+        )
+        legacy_time, legacy_result = timeit(
+            lambda: legacy_clean_accessibility_tree(tree_str)
+        )
+        assert cur_result == legacy_result, "Cleaned trees differ"
+        num_lines = tree_str.count("\n") + 1
+        print(
+            f"{size:>8} {num_lines:>8} {legacy_time:>12.4f}"
+            f" {cur_time:>12.4f}"
+        )
+
+
+def benchmark_budget(sizes: list[int], shape: str, budget: int) -> None:
+    print(
+        f"{'nodes':>8} {'full actree (s)':>16} {'budget actree (s)':>18}"
+        f" {'emitted nodes':>14}"
+    )
+    for size in sizes:
+        accessibility_tree = make_accessibility_tree(size, shape)
+
+        def parse_full() -> str:
+            tree_str, _ = TextObervationProcessor.parse_accessibility_tree(
+                accessibility_tree
+            )
+            tree_str = TextObervationProcessor.clean_accesibility_tree(
+                tree_str
+            )
+            # what the prompt constructor keeps
+            return tree_str[:budget]
+
+        full_time, full_result = timeit(parse_full)
+        budget_time, (budget_result, obs_nodes_info) = timeit(
+            lambda: TextObervationProcessor.parse_accessibility_tree_with_budget(
+                accessibility_tree, budget
+            )
+        )
+        assert budget_result[:budget] == full_result, "Prompts differ"
+        print(
+            f"{size:>8} {full_time:>16.4f} {budget_time:>18.4f}"
+            f" {len(obs_nodes_info):>14}"
+        )
+
+
+def config() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--stage",
+        choices=["prune", "viewport", "serialize", "clean", "budget"],
+        default="prune",
+    )
+    parser.add_argument(
+        "--shape",
+        choices=["listing", "grid", "nested"],
+        default="listing",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10000, 50000, 100000, 200000],
+    )
+    parser.add_argument(
+        "--legacy_max_nodes",
+        type=int,
+        default=50000,
+        help="The legacy implementations are too slow on larger trees",
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        default=7680,
+        help="Number of characters kept in the budget stage",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = config()
+    if args.stage == "prune":
+        benchmark_prune(args.sizes, args.shape, args.legacy_max_nodes)
+    elif args.stage == "viewport":
+        benchmark_viewport(args.sizes, args.shape)
+    elif args.stage == "serialize":
+        benchmark_serialize(args.sizes, args.shape)
+    elif args.stage == "clean":
+        benchmark_clean(args.sizes, args.shape)
+    elif args.stage == "budget":
+        benchmark_budget(args.sizes, args.shape, args.budget)
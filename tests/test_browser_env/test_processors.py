@@ -0,0 +1,682 @@
+import json
+from typing import Any
+
+import numpy as np
+from playwright.sync_api import FloatRect
+
+from browser_env.processors import (
+    ObservationHandler,
+    StageProfile,
+    TextObervationProcessor,
+    merge_stage_profiles,
+)
+from browser_env.utils import (
+    BrowserConfig,
+    BrowserInfo,
+    ScreenshotConfig,
+)
+
+
+def make_node(
+    node_id: str, parent_id: str | None, child_ids: list[str]
+) -> dict[str, Any]:
+    node: dict[str, Any] = {"nodeId": node_id, "childIds": child_ids}
+    if parent_id is not None:
+        node["parentId"] = parent_id
+    return node
+
+
+def test_remove_nodes_in_graph() -> None:
+    # 1 -> (2 -> (4, 5 -> (6, 7)), 3)
+    tree: Any = [
+        make_node("1", None, ["2", "3"]),
+        make_node("2", "1", ["4", "5"]),
+        make_node("4", "2", []),
+        make_node("5", "2", ["6", "7"]),
+        make_node("6", "5", []),
+        make_node("7", "5", []),
+        make_node("3", "1", []),
+    ]
+    keep = [True, False, True, False, True, False, True]
+    tree = TextObervationProcessor.remove_nodes_in_graph(tree, keep)
+    assert [node["nodeId"] for node in tree] == ["1", "4", "6", "3"]
+    assert tree[0]["childIds"] == ["4", "6", "3"]
+    assert "parentId" not in tree[0]
+    assert [node["parentId"] for node in tree[1:]] == ["1", "1", "1"]
+
+
+def test_get_elements_in_viewport_ratio() -> None:
+    config: BrowserConfig = {
+        "win_top_bound": 0.0,
+        "win_left_bound": 0.0,
+        "win_width": 1280.0,
+        "win_height": 720.0,
+        "win_right_bound": 1280.0,
+        "win_lower_bound": 720.0,
+        "device_pixel_ratio": 1.0,
+    }
+    union_bounds = [
+        [0.0, 0.0, 10.0, 10.0],
+        [100.0, 700.0, 200.0, 40.0],
+        [-50.0, 100.0, 100.0, 20.0],
+        [0.0, 800.0, 100.0, 20.0],
+        [10.0, 10.0, 0.0, 20.0],
+        None,
+    ]
+    ratio, visible = TextObervationProcessor.get_elements_in_viewport_ratio(
+        union_bounds, config
+    )
+    assert visible.tolist() == [True, True, True, True, False, False]
+    for bound, node_ratio in zip(union_bounds[:4], ratio[:4]):
+        assert bound is not None
+        assert (
+            node_ratio
+            == TextObervationProcessor.get_element_in_viewport_ratio(
+                *bound, config=config
+            )
+        )
+    assert ratio[4] == 0.0
+    assert np.isnan(ratio[5])
+
+
+def make_nested_accessibility_tree(depth: int) -> Any:
+    tree = []
+    for idx in range(depth):
+        node = make_node(
+            str(idx), str(idx - 1) if idx else None, [str(idx + 1)]
+        )
+        node["role"] = {"value": "generic" if idx % 2 else "link"}
+        node["name"] = {"value": "" if idx % 2 else f"Reply {idx}"}
+        node["backendDOMNodeId"] = idx
+        node["union_bound"] = [0.0, 0.0, 10.0, 10.0]
+        tree.append(node)
+    tree[-1]["childIds"] = []
+    return tree
+
+
+def test_parse_deeply_nested_accessibility_tree() -> None:
+    # deeper than the recursion limit
+    tree = make_nested_accessibility_tree(5000)
+    (
+        tree_str,
+        obs_nodes_info,
+    ) = TextObervationProcessor.parse_accessibility_tree(tree)
+    lines = tree_str.split("\n")
+    assert len(lines) == len(obs_nodes_info) == 2500
+    assert lines[0] == "[0] link 'Reply 0'"
+    assert lines[1] == "\t[2] link 'Reply 2'"
+    assert lines[-1] == "\t" * 2499 + "[4998] link 'Reply 4998'"
+
+
+def test_parse_deeply_nested_html() -> None:
+    dom_tree: Any = []
+    for idx in range(5000):
+        node = make_node(str(idx), str(idx - 1), [str(idx + 1)])
+        node.update(
+            nodeName="div",
+            attributes=f'id="{idx}"',
+            nodeValue="",
+            backendNodeId=str(idx),
+            union_bound=None,
+        )
+        dom_tree.append(node)
+    dom_tree[-1]["childIds"] = []
+    html, obs_nodes_info = TextObervationProcessor.parse_html(dom_tree)
+    assert len(obs_nodes_info) == 5000
+    assert html.startswith('[0] <div id="0"> \n\t[1] <div id="1"> \n')
+    assert html.endswith("\t" * 4999 + '[4999] <div id="4999"> \n')
+
+
+def test_parse_accessibility_tree_with_budget() -> None:
+    tree = make_nested_accessibility_tree(100)
+    for idx in range(1, 100, 2):
+        # repeated static text is cleaned
+        tree[idx]["role"] = {"value": "StaticText"}
+        tree[idx]["name"] = {"value": f"Reply {idx - 1}"}
+    (
+        tree_str,
+        obs_nodes_info,
+    ) = TextObervationProcessor.parse_accessibility_tree(tree)
+    tree_str = TextObervationProcessor.clean_accesibility_tree(tree_str)
+    assert len(tree_str.split("\n")) == 50
+
+    (
+        full_str,
+        full_nodes_info,
+    ) = TextObervationProcessor.parse_accessibility_tree_with_budget(
+        tree, budget=10**6
+    )
+    assert full_str == tree_str
+    assert full_nodes_info == obs_nodes_info
+
+    (
+        budget_str,
+        budget_nodes_info,
+    ) = TextObervationProcessor.parse_accessibility_tree_with_budget(
+        tree, budget=200
+    )
+    # the line crossing the budget is kept, the rest is not visited
+    assert tree_str.startswith(budget_str)
+    assert len(budget_str) >= 200 > len(budget_str.rsplit("\n", 1)[0])
+    assert (
+        list(budget_nodes_info)
+        == list(obs_nodes_info)[: len(budget_nodes_info)]
+    )
+    assert len(budget_nodes_info) < len(obs_nodes_info)
+
+
+def test_clean_accessibility_tree() -> None:
+    tree_str = "\n".join(
+        [
+            "[1] link 'Home'",
+            "\t[2] StaticText 'Home'",
+            "\t[3] StaticText 'Forums'",
+            "\t[4] statictext",
+            "[5] StaticText ''",
+            "[6] StaticText 'multi\nline'",
+            "[7] button 'Forums'",
+            "[8] StaticText 'Forums'",
+            "[9] StaticText 'Home'",
+        ]
+    )
+    assert TextObervationProcessor.clean_accesibility_tree(tree_str) == (
+        "[1] link 'Home'\n\t[3] StaticText 'Forums'\n[6] StaticText 'multi"
+        "\nline'\n[7] button 'Forums'\n[9] StaticText 'Home'"
+    )
+
+
+class FakeAccessibilityClient:
+    """Serves the accessibility tree of a page that can be changed"""
+
+    def __init__(self, tree: Any) -> None:
+        self.tree = tree
+        self.sent: list[str] = []
+        self.handlers: dict[str, Any] = {}
+
+    def send(self, method: str, params: Any = None) -> Any:
+        self.sent.append(method)
+        if method == "Accessibility.getFullAXTree":
+            return {"nodes": [dict(node) for node in self.tree]}
+        if method == "Accessibility.getChildAXNodes":
+            nodes = {node["nodeId"]: node for node in self.tree}
+            child_ids = nodes[params["id"]]["childIds"]
+            return {"nodes": [dict(nodes[child_id]) for child_id in child_ids]}
+        return {}
+
+    def on(self, event: str, handler: Any) -> None:
+        self.handlers[event] = handler
+
+    def emit_update(self, nodes: Any) -> None:
+        self.handlers["Accessibility.nodesUpdated"]({"nodes": nodes})
+
+    def emit_mutation(self, mutation_count: int) -> None:
+        payload = {"documentId": "document", "count": mutation_count}
+        self.handlers["Runtime.bindingCalled"](
+            {"name": "__browserEnvMutation", "payload": json.dumps(payload)}
+        )
+
+
+def make_info(mutation_count: int) -> BrowserInfo:
+    return {
+        "DOMTree": {},
+        "config": {},  # type: ignore[typeddict-item]
+        "title": "",
+        "document_id": "document",
+        "mutation_count": mutation_count,
+        "layout_count": mutation_count,
+    }
+
+
+def test_incremental_accessibility_tree() -> None:
+    tree = make_nested_accessibility_tree(6)
+    client = FakeAccessibilityClient(tree)
+    processor = TextObervationProcessor(
+        "accessibility_tree",
+        current_viewport_only=False,
+        viewport_size={"width": 1280, "height": 720},
+        incremental=True,
+        verify_incremental=True,
+    )
+
+    def fetch(mutation_count: int) -> Any:
+        return processor.fetch_incremental_accessibility_tree(
+            make_info(mutation_count), client  # type: ignore[arg-type]
+        )
+
+    assert len(fetch(0)) == 6
+    # nothing changed
+    assert len(fetch(0)) == 6
+
+    # a new leaf below node 5 and node 3 is renamed
+    tree[5]["childIds"] = ["6"]
+    tree.append(make_node("6", "5", []))
+    tree[-1].update(role={"value": "link"}, name={"value": "New"})
+    tree[3]["name"] = {"value": "Renamed"}
+    client.emit_mutation(1)
+    client.emit_update([dict(tree[3]), dict(tree[5])])
+    patched = fetch(1)
+    assert [node["nodeId"] for node in patched] == [str(i) for i in range(7)]
+    assert patched[3]["name"] == {"value": "Renamed"}
+
+    # node 2 is removed, its subtree is no longer reachable
+    tree[1]["childIds"] = []
+    client.emit_mutation(2)
+    client.emit_update([dict(tree[1])])
+    assert [node["nodeId"] for node in fetch(2)] == ["0", "1"]
+    assert dict(processor.incremental_stats) == {
+        "full": 1,
+        "reused": 1,
+        "patched": 2,
+    }
+
+    # a mutation after the last update, its update is not sent yet
+    tree[0]["name"] = {"value": "Renamed"}
+    tree[1]["name"] = {"value": "Renamed"}
+    client.emit_mutation(3)
+    client.emit_update([dict(tree[0])])
+    client.emit_mutation(4)
+    assert fetch(4)[1]["name"] == {"value": "Renamed"}
+    assert processor.incremental_stats["full"] == 2
+
+    # mutations without updates, or wrong updates, fall back to a full fetch
+    tree[1]["childIds"] = ["2"]
+    assert len(fetch(5)) == 7
+    tree[0]["name"] = {"value": "Changed"}
+    client.emit_mutation(6)
+    client.emit_update([])
+    client.emit_update([dict(tree[1], childIds=[])])
+    assert fetch(6)[0]["name"] == {"value": "Changed"}
+    assert processor.incremental_stats["full"] == 4
+    assert processor.incremental_stats["mismatch"] == 1
+
+
+class FakePage:
+    def __init__(self) -> None:
+        self.url = "http://example.com"
+        self.state = {
+            "documentId": "document",
+            "changeCount": 0,
+            "pageXOffset": 0,
+            "pageYOffset": 0,
+        }
+        self.context = self
+        self.pages = [self]
+
+    def evaluate(self, expression: str) -> Any:
+        return dict(self.state)
+
+
+def test_observation_cache() -> None:
+    handler = ObservationHandler(
+        "text",
+        "accessibility_tree",
+        "",
+        current_viewport_only=True,
+        viewport_size={"width": 1280, "height": 720},
+        capture_screenshot=False,
+        observation_cache=True,
+    )
+    num_processed = 0
+
+    def process(page: Any, client: Any) -> str:
+        nonlocal num_processed
+        num_processed += 1
+        return f"observation {num_processed}"
+
+    handler.text_processor.process = process  # type: ignore[assignment]
+    page: Any = FakePage()
+    assert handler.get_observation(page, None)["text"] == "observation 1"
+    assert handler.get_observation(page, None)["text"] == "observation 1"
+    page.state["pageYOffset"] = 720
+    assert handler.get_observation(page, None)["text"] == "observation 2"
+    page.state["changeCount"] = 1
+    assert handler.get_observation(page, None)["text"] == "observation 3"
+    page.url = "http://example.com/next"
+    assert handler.get_observation(page, None)["text"] == "observation 4"
+    assert handler.get_observation(page, None)["text"] == "observation 4"
+    assert dict(handler.observation_cache_stats) == {"hit": 2, "miss": 4}
+    # the empty image is in the observation space
+    observation_space = handler.get_observation_space()
+    obs = handler.get_observation(page, None)
+    assert observation_space["image"].contains(obs["image"])
+
+
+def test_screenshot_observation_space() -> None:
+    def get_image_shape(screenshot_config: ScreenshotConfig) -> Any:
+        handler = ObservationHandler(
+            "image",
+            "",
+            "",
+            current_viewport_only=True,
+            viewport_size={"width": 1280, "height": 720},
+            screenshot_config=screenshot_config,
+        )
+        return handler.get_observation_space()["image"].shape
+
+    assert get_image_shape({}) == (720, 1280, 3)
+    assert get_image_shape({"mode": "cdp", "scale": 0.5}) == (360, 640, 3)
+    clip: FloatRect = {"x": 100.0, "y": 50.0, "width": 301.0, "height": 200.0}
+    assert get_image_shape({"mode": "cdp", "clip": clip}) == (200, 301, 3)
+    assert get_image_shape({"mode": "cdp", "clip": clip, "scale": 0.5}) == (
+        100,
+        150,
+        3,
+    )
+
+
+def test_observation_profile() -> None:
+    handler = ObservationHandler(
+        "text",
+        "accessibility_tree",
+        "",
+        current_viewport_only=False,
+        viewport_size={"width": 1280, "height": 720},
+        capture_screenshot=False,
+        profile_observation=True,
+    )
+    processor = handler.text_processor
+    tree = make_nested_accessibility_tree(6)
+    client = FakeAccessibilityClient(tree)
+
+    info = make_info(0)
+    info["config"] = {
+        "win_top_bound": 0.0,
+        "win_left_bound": 0.0,
+        "win_width": 1280.0,
+        "win_height": 720.0,
+        "win_right_bound": 1280.0,
+        "win_lower_bound": 720.0,
+        "device_pixel_ratio": 1.0,
+    }
+
+    def process(page: Any, client: Any) -> str:
+        processor.fetch_page_accessibility_tree(
+            info, client, current_viewport_only=False
+        )
+        return "observation"
+
+    processor.process = process  # type: ignore[assignment]
+    handler.get_observation(FakePage(), client)  # type: ignore[arg-type]
+    profile = processor.meta_data["profile"]
+    assert set(profile) == {"accessibility_tree", "bounds", "prune"}
+    assert profile["accessibility_tree"]["messages"] == 1
+    assert profile["accessibility_tree"]["bytes"] == len("{}") + len(
+        json.dumps({"nodes": tree}, separators=(",", ":"))
+    )
+    # one DOM.resolveNode per node, the fake client resolves nothing
+    assert profile["bounds"]["messages"] == len(tree)
+    assert handler.image_processor.meta_data["profile"] == {}
+    # the processors keep state per session, the wrapper is reused
+    assert handler.get_profiled_client(
+        client  # type: ignore[arg-type]
+    ) is handler.get_profiled_client(
+        client  # type: ignore[arg-type]
+    )
+
+    total: dict[str, StageProfile] = {}
+    merge_stage_profiles(total, profile)
+    merge_stage_profiles(total, profile)
+    assert total["accessibility_tree"]["messages"] == 2
+
+
+def test_stable_ids() -> None:
+    processor = TextObervationProcessor(
+        "accessibility_tree",
+        current_viewport_only=False,
+        viewport_size={"width": 1280, "height": 720},
+        stable_ids=True,
+    )
+    tree = make_nested_accessibility_tree(4)
+    client: Any = FakeAccessibilityClient(tree)
+    first = processor.assign_stable_ids(tree, client)
+    assert [node["nodeId"] for node in first] == ["1", "2", "3", "4"]
+    assert first[1]["parentId"] == "1"
+    assert first[1]["childIds"] == ["3"]
+    # the original tree is untouched
+    assert tree[1]["nodeId"] == "1"
+
+    # the accessibility ids change between the fetches, a node is inserted
+    refetched = make_nested_accessibility_tree(4)
+    for node in refetched:
+        node["nodeId"] = str(int(node["nodeId"]) + 100)
+        if "parentId" in node:
+            node["parentId"] = str(int(node["parentId"]) + 100)
+        node["childIds"] = [str(int(i) + 100) for i in node["childIds"]]
+    refetched[3]["childIds"] = ["200"]
+    refetched.append(make_node("200", "103", []))
+    refetched[-1]["backendDOMNodeId"] = 42
+    second = processor.assign_stable_ids(refetched, client)
+    assert [node["nodeId"] for node in second] == ["1", "2", "3", "4", "5"]
+    assert second[3]["childIds"] == ["5"]
+    assert second[4]["parentId"] == "4"
+
+    # the ids are per page
+    other_client: Any = FakeAccessibilityClient(tree)
+    other = processor.assign_stable_ids(refetched[-1:], other_client)
+    assert other[0]["nodeId"] == "1"
+
+    # a text node sharing the DOM node of its parent has its own id
+    refetched[-1]["childIds"] = ["201"]
+    refetched.append(make_node("201", "200", []))
+    refetched[-1].update(backendDOMNodeId=42, role={"value": "StaticText"})
+    third = processor.assign_stable_ids(refetched, client)
+    assert [node["nodeId"] for node in third] == ["1", "2", "3", "4", "5", "6"]
+
+    # the nodes that are gone are forgotten, their ids are not reused
+    fourth = processor.assign_stable_ids(refetched[:2], client)
+    assert [node["nodeId"] for node in fourth] == ["1", "2"]
+    assert len(processor.stable_id_tables[client].ids) == 2
+    fifth = processor.assign_stable_ids(refetched, client)
+    assert [node["nodeId"] for node in fifth] == [
+        "1",
+        "2",
+        "7",
+        "8",
+        "9",
+        "10",
+    ]
+
+
+def test_spatial_index() -> None:
+    obs_nodes_info: dict[str, Any] = {
+        "1": {"union_bound": [0.0, 0.0, 1280.0, 2000.0], "text": "[1] main"},
+        "2": {"union_bound": [100.0, 100.0, 200.0, 50.0], "text": "[2] a"},
+        "3": {"union_bound": [100.0, 100.0, 200.0, 50.0], "text": "[3] b"},
+        "4": {"union_bound": [250.0, 120.0, 20.0, 10.0], "text": "[4] c"},
+        "5": {"union_bound": None, "text": "[5] d"},
+        "6": {"union_bound": [0.0, 900.0, 50.0, 50.0], "text": "[6] e"},
+        "7": {"union_bound": [10.0, 10.0, 0.0, 0.0], "text": "[7] f"},
+    }
+    index = TextObervationProcessor.build_spatial_index(
+        obs_nodes_info, {"width": 1280, "height": 720}, cell_size=64
+    )
+    # nothing is indexed before the first lookup
+    assert not index.bounds
+    assert index.hit_test(0, 0) == ["1"]
+    assert set(index.bounds) == {"1", "2", "3", "4"}
+
+    def linear_hit_test(x: float, y: float) -> set[str]:
+        return {
+            element_id
+            for element_id, info in obs_nodes_info.items()
+            if info["union_bound"]
+            and info["union_bound"][1] < 720
+            and info["union_bound"][0]
+            <= x
+            < info["union_bound"][0] + info["union_bound"][2]
+            and info["union_bound"][1]
+            <= y
+            < info["union_bound"][1] + info["union_bound"][3]
+        }
+
+    for x in range(0, 1280, 10):
+        for y in range(0, 720, 10):
+            assert set(index.hit_test(x, y)) == linear_hit_test(x, y)
+
+    # the innermost element first, the deepest one on ties
+    assert index.hit_test(260, 125) == ["4", "3", "2", "1"]
+    assert index.hit_test(150, 110) == ["3", "2", "1"]
+    assert index.hit_test(1000, 700) == ["1"]
+    assert index.hit_test(-1, 10) == []
+    assert index.hit_test(10, 720) == []
+    assert index.get_element_at(260 / 1280, 125 / 720) == "4"
+
+
+class FakeViewportClient:
+    """Serves the accessibility tree of a page whose elements 1 (path), 2
+    and 4 (roots) are in the viewport, 9 is owned by 10 out of the DOM
+    subtree of 10"""
+
+    def __init__(self) -> None:
+        children = {
+            "0": ["1", "5", "10"],
+            "1": ["2", "3", "4"],
+            "2": ["6"],
+            "3": ["7"],
+            "5": ["8"],
+            "10": ["9"],
+        }
+        self.nodes = {}
+        for node_id in map(str, range(11)):
+            node = make_node(node_id, None, children.get(node_id, []))
+            node["backendDOMNodeId"] = int(node_id)
+            self.nodes[node_id] = node
+        for parent_id, child_ids in children.items():
+            for child_id in child_ids:
+                self.nodes[child_id]["parentId"] = parent_id
+        self.dom_subtrees = {"2": ["2", "6"], "4": ["4", "9"]}
+        self.sent: list[str] = []
+
+    def send(self, method: str, params: Any = None) -> Any:
+        self.sent.append(method)
+        if method == "Runtime.evaluate":
+            return {"result": {"objectId": "probe"}}
+        if method == "Runtime.getProperties":
+            items = {
+                "probe": ["path", "roots"],
+                "path": ["0", "1"],
+                "roots": ["2", "4"],
+            }[params["objectId"]]
+            return {
+                "result": [
+                    {"name": str(idx), "value": {"objectId": item}}
+                    for idx, item in enumerate(items)
+                ]
+                + [{"name": "length", "value": {"value": len(items)}}]
+            }
+        if method == "Accessibility.queryAXTree":
+            subtree = self.dom_subtrees[params["objectId"]]
+            return {"nodes": [dict(self.nodes[idx]) for idx in subtree]}
+        if method == "Accessibility.getPartialAXTree":
+            node_id = params.get("objectId", str(params.get("backendNodeId")))
+            nodes = [dict(self.nodes[node_id])]
+            while params["fetchRelatives"] and "parentId" in nodes[-1]:
+                nodes.append(dict(self.nodes[nodes[-1]["parentId"]]))
+            return {"nodes": nodes}
+        return {}
+
+
+def test_viewport_accessibility_tree() -> None:
+    client = FakeViewportClient()
+    processor = TextObervationProcessor(
+        "accessibility_tree",
+        current_viewport_only=True,
+        viewport_size={"width": 1280, "height": 720},
+        viewport_fetch=True,
+    )
+    tree = processor.fetch_viewport_accessibility_tree(
+        client  # type: ignore[arg-type]
+    )
+    assert tree is not None
+    assert [node["nodeId"] for node in tree] == [
+        "0",
+        "1",
+        "2",
+        "6",
+        "4",
+        "10",
+        "9",
+    ]
+    # the children out of the viewport are dropped
+    assert tree[0]["childIds"] == ["1", "10"]
+    assert tree[1]["childIds"] == ["2", "4"]
+    assert client.sent.count("Accessibility.queryAXTree") == 2
+    assert "Accessibility.getFullAXTree" not in client.sent
+    assert client.sent[-1] == "Accessibility.getPartialAXTree"
+
+
+class FakeScrollClient(FakeAccessibilityClient):
+    """The element 2 of the page is fixed"""
+
+    def send(self, method: str, params: Any = None) -> Any:
+        if method == "DOMSnapshot.captureSnapshot":
+            self.sent.append(method)
+            return {
+                "strings": ["static", "fixed"],
+                "documents": [
+                    {
+                        "layout": {
+                            "nodeIndex": [0, 1, 2, 3],
+                            "styles": [[0], [0], [1], [0]],
+                        },
+                        "nodes": {
+                            "parentIndex": [-1, 0, 0, 2],
+                            "backendNodeId": [0, 1, 2, 3],
+                        },
+                    }
+                ],
+            }
+        return super().send(method, params)
+
+
+def test_scroll_cached_accessibility_tree() -> None:
+    # root -> (1, 2 -> 3)
+    tree = [
+        make_node("0", None, ["1", "2"]),
+        make_node("1", "0", []),
+        make_node("2", "0", ["3"]),
+        make_node("3", "2", []),
+    ]
+    for idx, node in enumerate(tree):
+        node["role"] = {"value": "RootWebArea" if idx == 0 else "generic"}
+        node["backendDOMNodeId"] = idx
+    client = FakeScrollClient(tree)
+    processor = TextObervationProcessor(
+        "accessibility_tree",
+        current_viewport_only=True,
+        viewport_size={"width": 1280, "height": 720},
+        scroll_cache=True,
+    )
+    # the client rects of the page
+    page_bounds = {1: [0.0, 100.0, 10.0, 10.0], 3: [0.0, 0.0, 10.0, 10.0]}
+    processor.get_accessibility_node_bound = (  # type: ignore[assignment]
+        lambda node, snapshot_rects, client: page_bounds.get(
+            node["backendDOMNodeId"], [0.0, 0.0, 10.0, 10.0]
+        )
+    )
+
+    def fetch(scroll_y: float, layout_count: int) -> Any:
+        info = make_info(layout_count)
+        info["config"] = {"win_left_bound": 0.0, "win_top_bound": scroll_y}
+        return processor.fetch_scroll_cached_accessibility_tree(
+            info, client  # type: ignore[arg-type]
+        )
+
+    nodes, bounds = fetch(0.0, 0)
+    assert bounds[1] == [0.0, 100.0, 10.0, 10.0]
+    processor.scrolled = True
+    # the bounds of the elements that are not fixed are not measured again
+    page_bounds[1] = [-1.0, -1.0, -1.0, -1.0]
+    nodes, bounds = fetch(50.0, 0)
+    assert [node["nodeId"] for node in nodes] == ["0", "1", "2", "3"]
+    # moved by the scroll, the fixed element 3 is fetched again
+    assert bounds[1] == [0.0, 50.0, 10.0, 10.0]
+    assert bounds[3] == [0.0, 0.0, 10.0, 10.0]
+    assert client.sent.count("Accessibility.getFullAXTree") == 1
+    assert processor.scroll_cache_stats == {"full": 1, "sliced": 1}
+
+    # the layout changed, or the last action is not a scroll
+    processor.scrolled = True
+    fetch(50.0, 1)
+    fetch(50.0, 1)
+    assert client.sent.count("Accessibility.getFullAXTree") == 3
@@ -2,6 +2,7 @@ import asyncio
 import collections
 import json
 import tempfile
+from pathlib import Path
 from typing import Callable, Dict, Optional, Tuple, Type, Union, cast
 
 import pytest
@@ -13,6 +14,7 @@ from browser_env import (
     AsyncScriptBrowserEnv,
     DetachedPage,
     ScriptBrowserEnv,
+    VectorScriptBrowserEnv,
     create_focus_and_click_action,
     create_goto_url_action,
     create_keyboard_type_action,
@@ -20,6 +22,7 @@ from browser_env import (
     create_scroll_action,
 )
 from browser_env.actions import create_id_based_action
+from browser_env.envs import NetworkActivity
 
 
 def test_script_browser_env(script_browser_env: ScriptBrowserEnv) -> None:
@@ -251,3 +254,438 @@ def test_accessibility_tree_observation_update(
         )
     )
     assert "UNIQUE_NAME" in obs["text"]
+
+
+def test_batched_bounds(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.reset()
+    env.step(
+        create_playwright_action(
+            'page.goto("https://russmaxdesign.github.io/exercise/")'
+        )
+    )
+    processor = env.observation_handler.text_processor
+    client = env.get_page_client(env.page)
+    per_node_obs = processor.process(env.page, client)
+    per_node_info = processor.obs_nodes_info
+
+    processor.bounds_mode = "batched"
+    batched_obs = processor.process(env.page, client)
+    assert batched_obs == per_node_obs
+    for node_id, node_info in per_node_info.items():
+        assert processor.obs_nodes_info[node_id][
+            "union_bound"
+        ] == pytest.approx(node_info["union_bound"])
+
+
+def test_html_batched_bounds(
+    current_viewport_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = current_viewport_script_browser_env
+    env.reset()
+    env.step(
+        create_playwright_action(
+            'page.goto("https://russmaxdesign.github.io/exercise/")'
+        )
+    )
+    processor = env.observation_handler.text_processor
+    client = env.get_page_client(env.page)
+    per_node_obs = processor.process(env.page, client)
+
+    processor.bounds_mode = "batched"
+    batched_obs = processor.process(env.page, client)
+    assert batched_obs == per_node_obs
+
+
+def test_skip_screenshot(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.observation_handler.capture_screenshot = False
+    obs, _ = env.reset()
+    assert obs["image"].size == 0
+    assert obs["text"]
+
+    env.observation_handler.capture_screenshot = True
+    obs, *_ = env.step(create_goto_url_action("http://www.example.com"))
+    assert obs["image"].shape[-1] in (3, 4)
+
+
+def test_cdp_screenshot(script_browser_env: ScriptBrowserEnv) -> None:
+    env = script_browser_env
+    env.reset()
+    env.step(create_goto_url_action("http://www.example.com"))
+    processor = env.observation_handler.image_processor
+    client = env.get_page_client(env.page)
+    png_screenshot = processor.process(env.page, client)
+
+    processor.screenshot_config = {"mode": "cdp"}
+    cdp_screenshot = processor.process(env.page, client)
+    assert cdp_screenshot.shape[:2] == png_screenshot.shape[:2]
+
+    processor.screenshot_config = {
+        "mode": "cdp",
+        "format": "jpeg",
+        "quality": 80,
+        "scale": 0.5,
+    }
+    jpeg_screenshot = processor.process(env.page, client)
+    assert jpeg_screenshot.shape[0] == png_screenshot.shape[0] // 2
+    assert jpeg_screenshot.shape[1] == png_screenshot.shape[1] // 2
+
+
+def test_cached_tab_title_after_navigation(
+    accessibility_tree_current_viewport_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_current_viewport_script_browser_env
+    env.reset()
+    env.step(create_goto_url_action("http://www.example.com"))
+    obs, *_ = env.step(create_id_based_action("new_tab"))
+    assert obs["text"].startswith(  # type: ignore[union-attr]
+        "Tab 0: Example Domain | Tab 1 (current)"
+    )
+
+    # navigate the background tab, the cached title is dropped
+    background_tab = env.context.pages[0]
+    background_tab.goto("https://russmaxdesign.github.io/exercise/")
+    obs, *_ = env.step(create_goto_url_action("http://www.example.com"))
+    assert obs["text"].startswith(  # type: ignore[union-attr]
+        "Tab 0: Exercise page for keyboard and screen reader use"
+        " | Tab 1 (current): Example Domain"
+    )
+
+
+def test_dom_snapshot_only_when_needed(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.reset()
+    env.step(create_goto_url_action("http://www.example.com"))
+    processor = env.observation_handler.text_processor
+    client = env.get_page_client(env.page)
+    info = processor.fetch_browser_info(env.page, client)
+    assert info["DOMTree"] == {}
+
+    processor.bounds_mode = "batched"
+    info = processor.fetch_browser_info(env.page, client)
+    assert info["DOMTree"]["documents"]
+
+
+def test_incremental_accessibility_tree(
+    accessibility_tree_current_viewport_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_current_viewport_script_browser_env
+    processor = env.observation_handler.text_processor
+    processor.incremental = True
+    processor.verify_incremental = True
+    env.reset()
+    env.step(
+        create_goto_url_action("https://russmaxdesign.github.io/exercise/")
+    )
+    for action in [
+        create_scroll_action("down"),
+        create_scroll_action("down"),
+        create_scroll_action("up"),
+    ]:
+        obs, *_ = env.step(action)
+        processor.incremental = False
+        full_obs = processor.process(env.page, env.get_page_client(env.page))
+        processor.incremental = True
+        assert obs["text"] == full_obs
+    assert processor.incremental_stats["mismatch"] == 0
+
+
+def test_observation_cache(
+    accessibility_tree_current_viewport_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_current_viewport_script_browser_env
+    env.observation_handler.observation_cache = True
+    env.reset()
+    obs, *_ = env.step(create_goto_url_action("http://www.example.com"))
+    # the element does not exist, the page does not change
+    cached_obs, _, success, _, _ = env.step(
+        create_id_based_action("click [100000]")
+    )
+    assert cached_obs["text"] == obs["text"]
+    assert env.observation_handler.observation_cache_stats["hit"] == 1
+
+    obs, *_ = env.step(
+        create_goto_url_action("https://russmaxdesign.github.io/exercise/")
+    )
+    assert obs["text"] != cached_obs["text"]
+
+
+def test_viewport_accessibility_fetch(
+    accessibility_tree_current_viewport_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_current_viewport_script_browser_env
+    processor = env.observation_handler.text_processor
+    processor.viewport_fetch = True
+    env.reset()
+    env.step(
+        create_goto_url_action("https://russmaxdesign.github.io/exercise/")
+    )
+    for action in [
+        create_scroll_action("down"),
+        create_scroll_action("down"),
+        create_scroll_action("up"),
+    ]:
+        obs, *_ = env.step(action)
+        processor.viewport_fetch = False
+        full_obs = processor.process(env.page, env.get_page_client(env.page))
+        processor.viewport_fetch = True
+        assert obs["text"] == full_obs
+
+
+def test_scroll_observation_cache(
+    accessibility_tree_current_viewport_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_current_viewport_script_browser_env
+    processor = env.observation_handler.text_processor
+    processor.scroll_cache = True
+    env.reset()
+    env.step(
+        create_goto_url_action("https://russmaxdesign.github.io/exercise/")
+    )
+    for action in [
+        create_scroll_action("down"),
+        create_scroll_action("down"),
+        create_scroll_action("up"),
+    ]:
+        obs, *_ = env.step(action)
+        processor.scroll_cache = False
+        full_obs = processor.process(env.page, env.get_page_client(env.page))
+        processor.scroll_cache = True
+        assert obs["text"] == full_obs
+    assert processor.scroll_cache_stats["sliced"] > 0
+
+
+@pytest.mark.asyncio
+async def test_async_accessibility_tree_observation() -> None:
+    env = AsyncScriptBrowserEnv(
+        headless=True,
+        observation_type="accessibility_tree",
+        current_viewport_only=True,
+    )
+    await env.areset()
+    obs, _, _, _, info = await env.astep(
+        create_goto_url_action("http://www.example.com")
+    )
+    text = cast(str, obs["text"])  # type: ignore[call-overload]
+    assert text.startswith("Tab 0 (current): Example Domain")
+    assert "link 'More information...'" in text
+    metadata = info["observation_metadata"]
+    assert metadata["text"]["obs_nodes_info"]  # type: ignore[index]
+
+    link_id = text.split("] link 'More information...'")[0].split("[")[-1]
+    obs, _, _, _, info = await env.astep(
+        create_id_based_action(f"click [{link_id}]")
+    )
+    assert not info["fail_error"]
+    assert "iana" in env.page.url
+    await env.aclose()
+
+
+def test_stable_element_ids(
+    accessibility_tree_script_browser_env: ScriptBrowserEnv,
+) -> None:
+    env = accessibility_tree_script_browser_env
+    env.observation_handler.text_processor.stable_ids = True
+    env.reset()
+    obs, *_ = env.step(
+        create_goto_url_action("https://russmaxdesign.github.io/exercise/")
+    )
+    # the page is unchanged, only the accessibility node ids are refetched
+    next_obs, *_ = env.step(create_scroll_action("down"))
+    assert next_obs["text"] == obs["text"]
+
+
+def test_persistent_browser() -> None:
+    env = ScriptBrowserEnv(headless=True, persistent_browser=True)
+    _, info = env.reset()
+    browser = env.browser
+    env.step(create_goto_url_action("http://www.example.com"))
+    env.context.add_cookies(
+        [{"name": "task", "value": "1", "url": "http://www.example.com"}]
+    )
+
+    _, info = env.reset()
+    assert env.browser is browser
+    # the new task does not see the state of the previous one
+    assert env.context.cookies() == []
+    assert info["reset_latency"] >= 0
+    env.close()
+    assert not browser.is_connected()
+
+
+def test_context_pool() -> None:
+    with pytest.raises(ValueError):
+        ScriptBrowserEnv(context_pool_size=1)
+
+    env = ScriptBrowserEnv(
+        headless=True, persistent_browser=True, context_pool_size=1
+    )
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".json") as f:
+        json.dump({"start_url": "http://www.example.com"}, f)
+        f.flush()
+        env.reset(options={"config_file": f.name})
+        # the context of the next task is prepared explicitly
+        assert env.context_pool == []
+        env.prewarm(Path(f.name))
+        assert [pooled.key for pooled in env.context_pool] == [
+            env.get_context_pool_key(None, None)
+        ]
+        assert env.context_pool[0].start_urls == ["http://www.example.com"]
+        pooled_context = env.context_pool[0].context
+
+        env.reset(options={"config_file": f.name})
+        assert env.context is pooled_context
+        assert len(env.context.pages) == 1
+        assert env.page.url == "http://www.example.com/"
+        assert env.context_pool == []
+
+    # the prepared context has another geolocation
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".json") as f:
+        env.prewarm()
+        geolocation = {"latitude": 40.4, "longitude": -79.9}
+        json.dump(
+            {
+                "start_url": "http://www.example.com",
+                "geolocation": geolocation,
+            },
+            f,
+        )
+        f.flush()
+        pooled_context = env.context_pool[0].context
+        env.reset(options={"config_file": f.name})
+        assert env.context is not pooled_context
+        assert env.page.url == "http://www.example.com/"
+    env.close()
+
+
+def test_settle_detection() -> None:
+    env = ScriptBrowserEnv(headless=True, settle_timeout=5.0)
+    env.reset()
+    obs, _, _, _, info = env.step(
+        create_goto_url_action("https://russmaxdesign.github.io/exercise/")
+    )
+    # a static page settles well before the timeout
+    assert 0 < info["settle_time"] < 5.0
+    assert env.page.evaluate("document.readyState") == "complete"
+
+    # the requests of a page opened by the site are followed as well
+    with env.context.expect_page() as page_info:
+        env.page.evaluate("window.open()")
+    page_info.value.wait_for_load_state()
+    assert page_info.value in env.network_activities
+    env.close()
+
+
+class FakeEventTarget:
+    def __init__(self) -> None:
+        self.handlers: dict[str, Callable[..., None]] = {}
+
+    def on(self, event: str, handler: Callable[..., None]) -> None:
+        self.handlers[event] = handler
+
+    def send(self, method: str) -> None:
+        pass
+
+
+def test_network_activity() -> None:
+    page, client = FakeEventTarget(), FakeEventTarget()
+    network = NetworkActivity(page, client)  # type: ignore[arg-type]
+
+    def request(request_id: str, frame_id: str, loader_id: str) -> None:
+        client.handlers["Network.requestWillBeSent"](
+            {
+                "requestId": request_id,
+                "frameId": frame_id,
+                "loaderId": loader_id,
+            }
+        )
+
+    def navigate(frame: dict[str, str]) -> None:
+        client.handlers["Page.frameNavigated"]({"frame": frame})
+
+    request("1", "main", "old")
+    request("2", "child", "child-old")
+    request("3", "other", "other")
+    client.handlers["Network.loadingFinished"]({"requestId": "1"})
+    assert set(network.in_flight) == {"2", "3"}
+
+    # the requests of the old document of the child frame are cut off
+    request("4", "child", "child-new")
+    navigate({"id": "child", "parentId": "main", "loaderId": "child-new"})
+    assert set(network.in_flight) == {"3", "4"}
+
+    # the main frame takes the child frames along, not its new document
+    request("5", "main", "new")
+    navigate({"id": "main", "loaderId": "new"})
+    assert set(network.in_flight) == {"5"}
+
+    page.handlers["close"](page)
+    assert not network.in_flight
+
+
+def test_lazy_page_content() -> None:
+    env = ScriptBrowserEnv(headless=True, lazy_page_content=True)
+    env.reset()
+    _, _, _, _, info = env.step(
+        create_goto_url_action("http://www.example.com")
+    )
+    assert "Example Domain" in info["page"].content
+    _, _, _, _, info = env.step(
+        create_goto_url_action("https://russmaxdesign.github.io/exercise/")
+    )
+    page = info["page"]
+    env.step(create_goto_url_action("http://www.example.com"))
+    # not read before the next step
+    with pytest.raises(RuntimeError):
+        page.content
+    env.close()
+
+
+def test_vector_script_browser_env() -> None:
+    env = VectorScriptBrowserEnv(
+        2,
+        observation_type="accessibility_tree",
+        current_viewport_only=True,
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_files = []
+        for idx, url in enumerate(
+            [
+                "http://www.example.com",
+                "https://russmaxdesign.github.io/exercise/",
+            ]
+        ):
+            config_file = f"{temp_dir}/{idx}.json"
+            with open(config_file, "w") as f:
+                json.dump({"start_url": url}, f)
+            config_files.append(config_file)
+        obs, info = env.reset(options={"config_files": config_files})
+    assert obs["text"][0].startswith("Tab 0 (current): Example Domain")
+    assert "Exercise page" in obs["text"][1]
+
+    obs, rewards, _, _, info = env.step(
+        [
+            create_goto_url_action(
+                "https://russmaxdesign.github.io/exercise/"
+            ),
+            create_goto_url_action("http://www.example.com"),
+        ]
+    )
+    assert rewards.tolist() == [1.0, 1.0]
+    assert [page.url for page in info["page"]] == [
+        "https://russmaxdesign.github.io/exercise/",
+        "http://www.example.com/",
+    ]
+    assert len(info["observation_metadata"]) == 2
+    # the envs share one browser
+    browser = env.browser
+    assert all(sub_env.browser is browser for sub_env in env.envs)
+    env.close()
+    assert not browser.is_connected()